@@ -43,10 +43,68 @@ N_FLAG = 0b1000
 Z_FLAG = 0b0100
 C_FLAG = 0b0010
 V_FLAG = 0b0001
+SIGN_BIT = 1 << (WORD_SIZE - 1)
+
+
+# Kernels: pure functions taking operands (a, b) and returning
+# (signed result, flags), with the same results and flags as `Alu.execute`
+# but no hidden state. Indexed by control signal in `Alu.op_table`.
+
+def _add_kernel(a, b):
+    a &= WORD_MASK
+    b &= WORD_MASK
+    s = a + b
+    r = s & WORD_MASK
+    flags = ((N_FLAG if r & SIGN_BIT else 0)
+             | (Z_FLAG if r == 0 else 0)
+             | (C_FLAG if s > WORD_MASK else 0)
+             | (V_FLAG if ~(a ^ b) & (a ^ r) & SIGN_BIT else 0))
+    return r - (r & SIGN_BIT) * 2, flags
+
+
+def _sub_kernel(a, b):
+    return _add_kernel(a, -(b & WORD_MASK))
+
+
+def _and_kernel(a, b):
+    r = a & b & WORD_MASK
+    flags = (N_FLAG if r & SIGN_BIT else 0) | (Z_FLAG if r == 0 else 0)
+    return r - (r & SIGN_BIT) * 2, flags
+
+
+def _or_kernel(a, b):
+    r = (a | b) & WORD_MASK
+    flags = (N_FLAG if r & SIGN_BIT else 0) | (Z_FLAG if r == 0 else 0)
+    return r - (r & SIGN_BIT) * 2, flags
+
+
+def _shft_kernel(a, b):
+    a &= WORD_MASK
+    b &= WORD_MASK
+    amt = b & (WORD_SIZE - 1)
+    if amt == 0:  # no shift, carry unchanged (i.e., clear)
+        r, carry = a, 0
+    elif b & SIGN_BIT:  # negative, shift right
+        r, carry = a >> amt, (a >> (amt - 1)) & 1
+    else:
+        r, carry = (a << amt) & WORD_MASK, (a >> (WORD_SIZE - amt)) & 1
+    flags = ((N_FLAG if r & SIGN_BIT else 0)
+             | (Z_FLAG if r == 0 else 0)
+             | (C_FLAG if carry else 0))
+    return r - (r & SIGN_BIT) * 2, flags
+
+
+# Control signal (as in `Alu.decode`) for each operation
+CONTROL = {"ADD": 0b000, "SUB": 0b001, "AND": 0b010, "OR": 0b011, "SHFT": 0b100}
 
 
 class Alu:
 
+    # Fast entry point: kernels indexed by control signal, e.g.,
+    # `alu.op_table[CONTROL["ADD"]](a, b)` returns (result, flags). Unlike
+    # `execute`, these neither use nor change `_op` or `_flags`.
+    op_table = (_add_kernel, _sub_kernel, _and_kernel, _or_kernel, _shft_kernel)
+
     def __init__(self):
         """
         Here we initialize the ALU when instantiated.
@@ -271,4 +329,83 @@ class Alu:
         if op in self._ops.keys():
             self._op = op
         else:
-            raise ValueError(f"Bad op: {op}")
\ No newline at end of file
+            raise ValueError(f"Bad op: {op}")
+
+
+def _shft_result(a, b):
+    """
+    Result (without flags) of SHFT, as computed by `Alu._shft`.
+    """
+    amt = b & (WORD_SIZE - 1)
+    if amt == 0:
+        return a
+    if b & (1 << (WORD_SIZE - 1)):
+        return a >> amt
+    return (a << amt) & WORD_MASK
+
+
+# Results (without flags) of each operation on masked operands
+RESULTS = {
+    "ADD": lambda a, b: (a + b) & WORD_MASK,
+    "SUB": lambda a, b: (a - b) & WORD_MASK,
+    "AND": lambda a, b: a & b,
+    "OR": lambda a, b: a | b,
+    "SHFT": _shft_result,
+}
+
+
+class LazyAlu(Alu):
+    """
+    ALU that computes flags only when they are read.
+
+    `execute` records the operation and its operands and computes just the
+    result. Flags are computed (by the same methods `Alu` uses) the first
+    time `_flags`, `carry`, or `overflow` is read. `zero` and `negative`
+    come straight from the recorded result. Observable behavior is
+    identical to `Alu`.
+    """
+
+    def __init__(self):
+        self._pending = None  # (op, a, b) of last operation, flags unknown
+        self._result = 0  # signed result of last operation
+        self._flag_bits = 0
+        super().__init__()
+
+    @property
+    def _flags(self):
+        pending = self._pending
+        if pending is not None:
+            op, a, b = pending
+            self._pending = None
+            self._flag_bits = 0
+            self._ops[op](a, b)  # sets flags through the setter, below
+        return self._flag_bits
+
+    @_flags.setter
+    def _flags(self, value):
+        self._pending = None
+        self._flag_bits = value
+
+    @property
+    def zero(self):
+        if self._pending is not None:
+            return self._result == 0
+        return bool(self._flag_bits & Z_FLAG)
+
+    @property
+    def negative(self):
+        if self._pending is not None:
+            return self._result < 0
+        return bool(self._flag_bits & N_FLAG)
+
+    def execute(self, a, b):
+        """
+        Execute operation with operands a and b, deferring the flags.
+        """
+        op = self._op
+        result = RESULTS[op](a & WORD_MASK, b & WORD_MASK)
+        if result & (1 << (WORD_SIZE - 1)):
+            result -= 1 << WORD_SIZE
+        self._pending = (op, a, b)
+        self._result = result
+        return result
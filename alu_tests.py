@@ -5,9 +5,11 @@ CS 2210 Computer Organization
 Clayton Cafiero <cbcafier@uvm.edu>
 """
 
+import random
+
 import pytest
 
-from alu import Alu
+from alu import CONTROL, Alu, LazyAlu
 
 TEST_CASES = [
     {
@@ -466,3 +468,79 @@ def test_shift_behavioral_details():
         # This asserts masking rule and direction convention
         assert 0 <= amt <= 15
         assert direction in ("LEFT", "RIGHT")
+
+
+@pytest.mark.parametrize("case", TEST_CASES, ids=[c["comment"] for c in TEST_CASES])
+def test_lazy_alu_operations(case):
+    """
+    Lazy flags give the same result and flags as eager ones.
+    """
+    alu = LazyAlu()
+    alu.decode(case["opcode"])
+    result = alu.execute(case["a"], case["b"])
+    assert result == case["expected"]
+    for flag, expected_val in case["flags"].items():
+        assert getattr(alu, flag) == expected_val
+
+
+def test_lazy_alu_matches_eager():
+    """
+    Compare against eager ALU on many operands, reading flags in different
+    orders (or not at all) between operations.
+    """
+    rng = random.Random(2210)
+    values = [0, 1, 2, 15, 16, 0x7FFF, 0x8000, 0x8001, 0xFFFF, -1, -32768]
+    eager, lazy = Alu(), LazyAlu()
+    for _ in range(5000):
+        op = rng.choice(["ADD", "SUB", "AND", "OR", "SHFT"])
+        a = rng.choice(values + [rng.randrange(-0x8000, 0x10000)])
+        b = rng.choice(values + [rng.randrange(-0x8000, 0x10000)])
+        eager.set_op(op)
+        lazy.set_op(op)
+        assert lazy.execute(a, b) == eager.execute(a, b)
+        flags = ["zero", "negative", "carry", "overflow", "_flags"]
+        for flag in rng.sample(flags, rng.randrange(len(flags) + 1)):
+            assert getattr(lazy, flag) == getattr(eager, flag)
+    assert lazy._flags == eager._flags
+
+
+def test_lazy_alu_flags_assignment():
+    """
+    Assigning flags (as faster engines do) replaces pending flags.
+    """
+    alu = LazyAlu()
+    alu.set_op("SUB")
+    alu.execute(1, 1)
+    alu._flags = 0
+    assert not alu.zero
+    assert alu._flags == 0
+
+
+@pytest.mark.parametrize("case", TEST_CASES, ids=[c["comment"] for c in TEST_CASES])
+def test_op_table(case):
+    """
+    Kernels give the same result and flags, and leave ALU state alone.
+    """
+    alu = Alu()
+    result, flags = alu.op_table[case["opcode"]](case["a"], case["b"])
+    assert result == case["expected"]
+    assert alu._op is None
+    assert alu._flags == 0
+    alu.decode(case["opcode"])
+    alu.execute(case["a"], case["b"])
+    assert flags == alu._flags
+
+
+def test_op_table_matches_execute():
+    """
+    Compare kernels against `execute` on many operands.
+    """
+    rng = random.Random(2211)
+    alu = Alu()
+    for _ in range(5000):
+        op = rng.choice(list(CONTROL))
+        a = rng.randrange(-0x8000, 0x10000)
+        b = rng.choice([rng.randrange(-0x8000, 0x10000), rng.randrange(-17, 17)])
+        alu.set_op(op)
+        result = alu.execute(a, b)
+        assert alu.op_table[CONTROL[op]](a, b) == (result, alu._flags)
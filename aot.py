@@ -0,0 +1,440 @@
+"""
+Ahead-of-time recompiler for the Catamount Processing Unit.
+
+Takes the word list returned by `assembler.assemble()` and recompiles the
+whole program into one Python module. The program's entry (address 0) and
+every CALL target become Python functions. Within a function, basic blocks
+are the arms of a dispatch on PC, bisected so that finding a block takes
+O(log n) comparisons, and a block that branches back to its own entry
+becomes a `while` loop. CALL pushes the return address onto the
+machine's stack, as usual, and then calls the target's function; RET
+returns from it if the popped address is the one the CALL pushed.
+
+The generated module is cached on disk, keyed by a hash of the program
+words, so later processes import it without recompiling. It is only cached
+once it has compiled; a program we can't recompile is run by the
+interpreter instead.
+
+Anything the recompiled program can't handle (a RET to somewhere other
+than its CALL site, calls nested deeper than `MAX_DEPTH`, running into
+words that aren't part of the program, a breakpoint) is handed back to the
+reference interpreter, which carries on from exactly the same machine
+state. Results are identical to the interpreter.
+
+Usage:
+
+    c = aot.make_cpu(assemble(src))
+    c.run()
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import hashlib
+import importlib.util
+import os
+import types
+from array import array
+from functools import partial
+
+from alu import Alu
+from cpu import STOP_BUDGET, STOP_HALT, Cpu
+from instruction_set import predecode
+from jit import body_source
+from memory import DataMemory, InstructionMemory, ProgramImage
+from register_file import RegisterFile
+from threaded import MAX_BLOCK, TERMINATORS
+
+VERSION = 3  # bump when generated code changes, to invalidate caches
+MAX_DEPTH = 200  # nested calls before we hand over to the interpreter
+LEAF = 8  # most arms tested in turn; a dispatch on more is split on PC
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__aotcache__")
+
+_loaded = {}  # program hash -> module, for this process
+
+# Machine state kept in locals by every generated function
+_STATE = [f"r{r} = _R{r}.value" for r in range(8)] + [
+    "flags = _alu._flags",
+    "op = _alu._op",
+    "sp = _cpu._sp",
+    "ir = _cpu._ir",
+]
+_SPILL = [f"_R{r}.value = r{r}" for r in range(8)] + [
+    "_alu._flags = flags",
+    "_alu._op = op",
+    "_cpu._sp = sp",
+    "_cpu._ir = ir",
+]
+
+
+def program_hash(words):
+    """
+    Hex digest identifying a program (and the recompiler version).
+    """
+    data = array("H", [w & 0xFFFF for w in words]).tobytes()
+    return hashlib.sha256(b"aot%d:" % VERSION + data).hexdigest()
+
+
+def _scan(words, pc):
+    """
+    Predecoded entries of the block starting at `pc`, up to and including
+    its terminator. Empty if `pc` isn't a translatable word of the program.
+    """
+    entries = []
+    addr = pc
+    while 0 <= addr < len(words) and addr - pc < MAX_BLOCK:
+        entry = predecode(words[addr] & 0xFFFF, addr)
+        if entry is None:
+            break
+        entries.append(entry)
+        addr += 1
+        if entry[0] in TERMINATORS:
+            break
+    return entries
+
+
+def _function(words, entry):
+    """
+    Blocks making up the function starting at `entry`: those reachable
+    without following a CALL. Returns ({block PC: entries}, callees).
+    """
+    blocks = {}
+    callees = set()
+    todo = [entry]
+    while todo:
+        pc = todo.pop()
+        if pc in blocks:
+            continue
+        entries = _scan(words, pc)
+        if not entries:
+            continue  # dispatch falls through to the interpreter
+        blocks[pc] = entries
+        last = entries[-1]
+        nxt = pc + len(entries)
+        match last[0]:
+            case "BEQ" | "BNE":
+                todo += [last[6], nxt]
+            case "B":
+                todo.append(last[6])
+            case "CALL":
+                callees.add(last[6])
+                todo.append(nxt)
+            case "RET" | "HALT":
+                pass
+            case _:  # no terminator; falls through
+                todo.append(nxt)
+    return blocks, callees
+
+
+def _block_source(pc, entries, functions):
+    """
+    Source lines for one arm of a function's dispatch.
+    """
+    size = len(entries)
+    nxt = pc + size
+    last = entries[-1]
+    term = last[0] if last[0] in TERMINATORS else None
+    target = last[6]
+    word = last[-1]
+    loops = term in ("BEQ", "BNE", "B") and target == pc
+
+    lines = [
+        f"c = cycles + {size}",
+        "if c > budget:",
+        f"    raise Escape({pc}, cycles)",
+        "cycles = c",
+    ]
+    lines += body_source(entries, base=pc)
+    if term in ("CALL", "RET"):
+        lines.append(f"i = {nxt - 1}")
+    match term:
+        case None:
+            lines += [f"ir = {word}", f"pc = {nxt}"]
+        case "BEQ" | "BNE" if loops:
+            taken = "flags & 4" if term == "BEQ" else "not flags & 4"
+            lines += [f"ir = {word}", f"if {taken}:", "    continue"]
+            lines += [f"pc = {nxt}", "break"]
+        case "B" if loops:
+            lines.append(f"ir = {word}")
+        case "BEQ":
+            lines += [f"ir = {word}", f"pc = {target} if flags & 4 else {nxt}"]
+        case "BNE":
+            lines += [f"ir = {word}", f"pc = {nxt} if flags & 4 else {target}"]
+        case "B":
+            lines += [f"ir = {word}", f"pc = {target}"]
+        case "CALL":
+            lines += [
+                "sp -= 1",
+                "_write_enable(True)",
+                f"_write(sp, {nxt}, from_stack=True)",
+                f"ir = {word}",
+            ]
+            if target in functions:
+                lines += [
+                    f"if depth == {MAX_DEPTH}:",
+                    f"    raise Escape({target}, cycles)",
+                ]
+                lines += _SPILL
+                lines += [
+                    "calling = True",
+                    f"cycles = f_{target:04X}({target}, {nxt}, depth + 1, cycles)",
+                    "calling = False",
+                ]
+                lines += _STATE
+                lines.append(f"pc = {nxt}")
+            else:
+                lines.append(f"raise Escape({target}, cycles)")
+        case "RET":
+            lines += [
+                "ret = _read(sp)",
+                "sp += 1",
+                f"ir = {word}",
+                "if ret == ret_to:",
+                "    return cycles",
+                "raise Escape(ret, cycles)",
+            ]
+        case "HALT":
+            lines += [
+                f"ir = {word}",
+                "_cpu._halt = True",
+                f"raise Escape({nxt}, cycles)",
+            ]
+    if loops:
+        lines = ["while True:"] + ["    " + line for line in lines]
+    return lines
+
+
+def _indent(lines, n):
+    return [" " * n + line for line in lines]
+
+
+def _dispatch(arms):
+    """
+    Source lines dispatching on `pc` to `arms`, a sorted list of (block PC,
+    lines). Up to `LEAF` arms are an `if`/`elif` chain; more are split in
+    half on PC, which also keeps the chains short enough for the compiler.
+    """
+    if len(arms) > LEAF:
+        mid = len(arms) // 2
+        return (
+            [f"if pc < {arms[mid][0]}:"]
+            + _indent(_dispatch(arms[:mid]), 4)
+            + ["else:"]
+            + _indent(_dispatch(arms[mid:]), 4)
+        )
+    lines = []
+    keyword = "if"
+    for pc, body in arms:
+        lines.append(f"{keyword} pc == {pc}:")
+        lines += _indent(body, 4)
+        keyword = "elif"
+    if keyword == "if":  # no blocks at all
+        return ["raise Escape(pc, cycles)"]
+    return lines + ["else:", "    raise Escape(pc, cycles)"]
+
+
+def generate(words):
+    """
+    Generate the source of a Python module running `words`. The module
+    defines `run(cpu, pc, budget)`, which runs the program on `cpu` from
+    `pc` for at most `budget` instructions and returns (PC, cycles). It
+    stops early, with the machine in a consistent state, on HALT or on
+    anything it can't handle; the caller tells the two apart by `cpu.running`
+    and carries on with the interpreter.
+    """
+    functions = {}
+    todo = [0]
+    while todo:
+        entry = todo.pop()
+        if entry in functions or not 0 <= entry < len(words):
+            continue
+        blocks, callees = _function(words, entry)
+        functions[entry] = blocks
+        todo += callees
+
+    src = [
+        '"""',
+        "Catamount program recompiled by aot.py. Do not edit.",
+        "",
+        f"Program hash: {program_hash(words)}",
+        '"""',
+        "",
+        f"WORDS = {tuple(w & 0xFFFF for w in words)!r}",
+        "",
+        "",
+        "class Escape(Exception):",
+        "    def __init__(self, pc, cycles):",
+        "        super().__init__(pc)",
+        "        self.pc = pc",
+        "        self.cycles = cycles",
+        "",
+        "",
+        "def run(_cpu, pc, budget):",
+        "    _R0, _R1, _R2, _R3, _R4, _R5, _R6, _R7 = _cpu._regs.registers",
+        "    _alu = _cpu._alu",
+        "    _read = _cpu._d_mem.read",
+        "    _write = _cpu._d_mem.write",
+        "    _write_enable = _cpu._d_mem.write_enable",
+        '    _shft = _cpu._kernels["SHFT"]',
+    ]
+    for entry in sorted(functions):
+        src += ["", f"    def f_{entry:04X}(pc, ret_to, depth, cycles):"]
+        src += _indent(_STATE, 8)
+        src += _indent(["i = 0", "calling = False", "try:", "    while True:"], 8)
+        arms = [
+            (pc, _block_source(pc, entries, functions))
+            for pc, entries in sorted(functions[entry].items())
+        ]
+        src += _indent(_dispatch(arms), 16)
+        src += _indent(
+            [
+                "except Escape:",
+                "    raise",
+                "except BaseException:",
+                "    if not calling:",
+                "        # Leave PC and IR as the interpreter would have on",
+                "        # the faulting instruction.",
+                "        _cpu._pc = i + 1",
+                "        ir = WORDS[i]",
+                "    raise",
+                "finally:",
+                "    if not calling:",
+            ],
+            8,
+        )
+        src += _indent(_SPILL, 16)
+
+    if 0 in functions:
+        src += [
+            "",
+            "    try:",
+            "        f_0000(pc, None, 0, 0)  # never returns; RET has no caller",
+            "    except Escape as e:",
+            "        return e.pc, e.cycles",
+        ]
+    src += ["    return pc, 0", ""]
+    return "\n".join(src)
+
+
+def load(words, cache_dir=None):
+    """
+    The recompiled module for `words`, from this process, from the on-disk
+    cache in `cache_dir` (default `CACHE_DIR`), or freshly generated. A
+    generated module is compiled before it is cached, so one that doesn't
+    compile (`SyntaxError`, `RecursionError`, ...) raises and is never
+    cached.
+    """
+    digest = program_hash(words)
+    module = _loaded.get(digest)
+    if module is not None:
+        return module
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    name = f"catamount_{digest[:32]}"
+    path = os.path.join(cache_dir, name + ".py")
+    if os.path.exists(path):
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    else:
+        source = generate(words)
+        code = compile(source, path, "exec")
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as fh:
+            fh.write(source)
+        os.replace(tmp, path)  # atomic, in case of concurrent writers
+        module = types.ModuleType(name)
+        module.__file__ = path
+        exec(code, module.__dict__)
+    _loaded[digest] = module
+    return module
+
+
+def program_words(i_mem):
+    """
+    Contents of instruction memory from address 0 to the highest address
+    written.
+    """
+    if not i_mem._cells:
+        return []
+    return [i_mem.read(addr) for addr in range(max(i_mem._cells) + 1)]
+
+
+class AotEngine:
+    """
+    Runs a `Cpu` using its program recompiled ahead of time. Pass the class
+    as `engine` to `Cpu` or `make_cpu`. The program is (re)compiled, or
+    loaded from the cache, whenever it is (re)loaded. If it can't be
+    recompiled, the interpreter runs it.
+    """
+
+    def __init__(self, cpu, cache_dir=None):
+        self._cpu = cpu
+        self._cache_dir = cache_dir
+        self._module = None
+        self._program_gen = None
+
+    def execute(self, max_cycles, until_pc):
+        """
+        Same contract as `Cpu._execute`: returns (cycles, reason).
+        Breakpoints are left to the interpreter.
+        """
+        cpu = self._cpu
+        if cpu._halt:
+            return 0, STOP_HALT
+        if until_pc is not None:
+            return cpu._execute(max_cycles, until_pc)
+        if self._program_gen != cpu._i_mem.generation:
+            try:
+                self._module = load(program_words(cpu._i_mem), self._cache_dir)
+            except (SyntaxError, RecursionError, MemoryError):
+                self._module = None  # too big or too deep for `compile()`
+            self._program_gen = cpu._i_mem.generation
+        if self._module is None:
+            return cpu._execute(max_cycles, None)
+        budget = (1 << 62) if max_cycles is None else max_cycles
+        try:
+            cpu._pc, cycles = self._module.run(cpu, cpu._pc, budget)
+        finally:
+            cpu._decoded = None
+        if cpu._halt:
+            return cycles, STOP_HALT
+        if cycles == max_cycles:
+            return cycles, STOP_BUDGET
+        # Something the recompiled program can't handle.
+        remaining = None if max_cycles is None else max_cycles - cycles
+        n, reason = cpu._execute(remaining, None)
+        return cycles + n, reason
+
+
+class AotCpu(Cpu):
+    """
+    A `Cpu` that runs its program recompiled ahead of time. The recompiled
+    program doesn't stop between instructions, so `tick()` runs until HALT
+    (or until whatever `run()` would stop at).
+    """
+
+    def __init__(self, *, alu, regs, d_mem, i_mem, cache_dir=None):
+        engine = partial(AotEngine, cache_dir=cache_dir)
+        super().__init__(alu=alu, regs=regs, d_mem=d_mem, i_mem=i_mem, engine=engine)
+
+    def tick(self):
+        if not self._halt:
+            self.run()
+            return True
+        return False
+
+
+# Helper function, a drop-in for `cpu.make_cpu`
+def make_cpu(prog=None, cache_dir=None):
+    alu = Alu()
+    d_mem = DataMemory()
+    if isinstance(prog, ProgramImage):
+        i_mem, prog = prog, None  # shared, not copied
+    else:
+        i_mem = InstructionMemory()
+    regs = RegisterFile()
+    cpu = AotCpu(alu=alu, d_mem=d_mem, i_mem=i_mem, regs=regs, cache_dir=cache_dir)
+    if prog:
+        cpu.load_program(prog)
+    return cpu
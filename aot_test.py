@@ -0,0 +1,143 @@
+"""
+Tests for the ahead-of-time recompiler. The reference interpreter
+(`Cpu._execute`) is the oracle: both must leave the machine in exactly the
+same state.
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import glob
+import random
+
+import pytest
+
+import aot
+from assembler import assemble
+from cpu import STOP_BUDGET, STOP_HALT, make_cpu
+from instruction_set import DecodeError
+from memory import ProgramImage
+from threaded_test import GAUSS, random_program, state
+
+
+def run_both(prog, cache_dir, **kwargs):
+    """
+    Run `prog` on the interpreter and recompiled; return results.
+    """
+    results = []
+    for c in (make_cpu(prog), aot.make_cpu(prog, cache_dir=cache_dir)):
+        try:
+            outcome = c.run(**kwargs)
+            outcome = (outcome.cycles, outcome.reason)
+        except (ValueError, RuntimeError) as e:
+            outcome = type(e)
+        results.append((outcome, state(c)))
+    return results
+
+
+def asm_programs():
+    """
+    Every program in asm/ that assembles.
+    """
+    progs = []
+    for filename in sorted(glob.glob("asm/*.asm")):
+        with open(filename) as fh:
+            try:
+                progs.append(pytest.param(assemble(fh.readlines()), id=filename))
+            except ValueError:
+                pass
+    return progs
+
+
+def test_gauss_matches_interpreter(tmp_path):
+    ref, recompiled = run_both(GAUSS, tmp_path)
+    assert ref == recompiled
+    assert recompiled[0] == (402, STOP_HALT)
+
+
+@pytest.mark.parametrize("budget", [0, 1, 5, 6, 7, 100, 401])
+def test_budget_then_resume(tmp_path, budget):
+    ref = make_cpu(GAUSS)
+    c = aot.make_cpu(GAUSS, cache_dir=tmp_path)
+    for cpu in (ref, c):
+        assert cpu.run(max_cycles=budget).reason == STOP_BUDGET
+    assert state(ref) == state(c)
+    assert c.run().cycles == 402 - budget
+    assert c.get_reg(2) == 5050
+
+
+@pytest.mark.parametrize("prog", asm_programs())
+def test_asm_programs_match_interpreter(tmp_path, prog):
+    ref, recompiled = run_both(prog, tmp_path, max_cycles=5000)
+    assert ref == recompiled
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_random_programs_match_interpreter(tmp_path, seed):
+    rng = random.Random(seed)
+    prog = random_program(rng, rng.randrange(4, 40))
+    ref, recompiled = run_both(prog, tmp_path, max_cycles=500)
+    assert ref == recompiled
+
+
+def test_deep_recursion_handed_to_interpreter(tmp_path):
+    # FOO: CALL FOO, forever
+    ref, recompiled = run_both([0xDFF0, 0xF000], tmp_path, max_cycles=1000)
+    assert ref == recompiled
+    assert recompiled[1][1] == 0xFFFF - 1000  # SP
+
+
+def test_shared_program_image(tmp_path):
+    image = ProgramImage(GAUSS)
+    cpus = [aot.make_cpu(image, cache_dir=tmp_path) for _ in range(3)]
+    for c in cpus:
+        assert c.run().cycles == 402
+        assert c.get_reg(2) == 5050
+
+
+def test_bad_program_image(tmp_path):
+    with pytest.raises(DecodeError):
+        aot.make_cpu(ProgramImage([0x0202, 0xF001]), cache_dir=tmp_path)
+
+
+def test_tick_runs_to_halt(tmp_path):
+    c = aot.make_cpu(GAUSS, cache_dir=tmp_path)
+    assert c.tick()
+    assert not c.running
+    assert not c.tick()
+    assert c.get_reg(2) == 5050
+
+
+def test_cached_module_reused(tmp_path, monkeypatch):
+    monkeypatch.setattr(aot, "_loaded", {})
+    aot.load(GAUSS, tmp_path)
+    assert len(list(tmp_path.glob("*.py"))) == 1
+    # A later process imports the cached module instead of recompiling.
+    monkeypatch.setattr(aot, "_loaded", {})
+    monkeypatch.setattr(aot, "generate", None)
+    c = aot.make_cpu(GAUSS, cache_dir=tmp_path)
+    c.run()
+    assert c.get_reg(2) == 5050
+
+
+def test_program_hash():
+    assert aot.program_hash(GAUSS) == aot.program_hash(list(GAUSS))
+    assert aot.program_hash(GAUSS) != aot.program_hash(GAUSS[:-1])
+
+
+def test_many_blocks(tmp_path):
+    # 3000 blocks of LOADI R1, #1; BEQ +0 in one function, then HALT
+    prog = [0x0202, 0xA000] * 3000 + [0xF000]
+    ref, recompiled = run_both(prog, tmp_path)
+    assert ref == recompiled
+    assert recompiled[0] == (6001, STOP_HALT)
+    assert len(list(tmp_path.glob("*.py"))) == 1
+
+
+def test_uncompilable_program_run_by_interpreter(tmp_path, monkeypatch):
+    monkeypatch.setattr(aot, "_loaded", {})
+    monkeypatch.setattr(aot, "generate", lambda words: "def run(:\n")
+    ref, recompiled = run_both(GAUSS, tmp_path)
+    assert ref == recompiled
+    assert recompiled[0] == (402, STOP_HALT)
+    assert not list(tmp_path.iterdir())  # nothing cached
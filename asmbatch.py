@@ -0,0 +1,130 @@
+"""
+Assemble many source files at once, in parallel.
+
+`assemble_many()` assembles each file in a pool of worker processes and
+writes the result next to the source, as an object file (see `objfile`)
+or as JSON. A file that fails to assemble doesn't stop the others; its
+error is reported with its result. Results come back in the order the
+paths were given, however the work was spread across workers.
+
+From the command line:
+
+    python asmbatch.py -j 8 asm/          # asm/*.asm -> asm/*.obj
+    python asmbatch.py --format json a.asm b.asm
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from assembler import assemble_with_symbols
+from objfile import write_object
+
+FORMATS = {"obj": ".obj", "json": ".json"}  # format -> suffix
+
+
+@dataclass
+class BatchResult:
+    """
+    Outcome of assembling one file.
+    """
+
+    path: str
+    output: str  # file written, or None
+    words: int  # number of words assembled
+    seconds: float  # time to assemble and write
+    error: str = None  # what went wrong, or None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def assemble_file(path, fmt="obj"):
+    """
+    Assemble the file at `path` and write the result next to it in format
+    `fmt` ("obj", "json", or `None` for nothing). Errors are caught and
+    returned in the result.
+    """
+    start = time.perf_counter()
+    output = None
+    try:
+        with open(path) as fh:
+            words, labels, line_map = assemble_with_symbols(fh)
+        if fmt is not None:
+            output = os.path.splitext(path)[0] + FORMATS[fmt]
+            if fmt == "obj":
+                write_object(output, words, labels, line_map)
+            else:
+                with open(output, "w") as fh:
+                    json.dump({"words": words, "labels": labels, "line_map": line_map}, fh)
+    except Exception as e:  # isolate: one bad file doesn't stop the batch
+        return BatchResult(path, None, 0, time.perf_counter() - start, f"{type(e).__name__}: {e}")
+    return BatchResult(path, output, len(words), time.perf_counter() - start)
+
+
+def assemble_many(paths, workers=None, fmt="obj"):
+    """
+    Assemble the files at `paths` using `workers` processes (default: one
+    per CPU; 1 means no pool at all). Returns a list of `BatchResult`, in
+    the same order as `paths`.
+    """
+    paths = list(paths)
+    if fmt is not None and fmt not in FORMATS:
+        raise ValueError(f"Unknown output format {fmt}")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(paths))
+    if workers <= 1:
+        return [assemble_file(path, fmt) for path in paths]
+    chunksize = max(1, len(paths) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(assemble_file, paths, [fmt] * len(paths), chunksize=chunksize))
+
+
+def _expand(args):
+    """
+    Paths from the command line; a directory stands for its `.asm` files.
+    """
+    paths = []
+    for arg in args:
+        if os.path.isdir(arg):
+            paths.extend(sorted(glob.glob(os.path.join(arg, "*.asm"))))
+        else:
+            paths.append(arg)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Assemble Catamount source files.")
+    parser.add_argument("paths", nargs="*", default=["asm"],
+                        help="source files or directories (default: asm)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--format", choices=["obj", "json"], default="obj",
+                        help="output written next to each source (default: obj)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results = assemble_many(_expand(args.paths), args.jobs, args.format)
+    for r in results:
+        if r.ok:
+            print(f"{r.path}: {r.words} words -> {r.output} ({r.seconds * 1000:.1f} ms)")
+        else:
+            print(f"{r.path}: {r.error}", file=sys.stderr)
+    failed = sum(not r.ok for r in results)
+    print(f"{len(results) - failed} assembled, {failed} failed "
+          f"in {time.perf_counter() - start:.2f} s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Tests for batch assembly
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import json
+
+import pytest
+
+from asmbatch import assemble_many, main
+from assembler import assemble
+from assembler_test import generated_source
+from objfile import ObjectFile
+
+
+def write_sources(tmp_path, n, bad=()):
+    paths = []
+    for i in range(n):
+        path = tmp_path / f"prog{i:02d}.asm"
+        src = ["FOO R1"] if i in bad else generated_source(50 + i, i)
+        path.write_text("\n".join(src))
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_objects_in_order(tmp_path, workers):
+    paths = write_sources(tmp_path, 7)
+    results = assemble_many(reversed(paths), workers=workers)
+    assert [r.path for r in results] == paths[::-1]
+    for r in results:
+        assert r.ok and r.seconds >= 0
+        with open(r.path) as fh:
+            expected = assemble(fh)
+        assert r.words == len(expected)
+        with ObjectFile(r.output) as obj:
+            assert obj.words.tolist() == expected
+
+
+def test_json_output(tmp_path):
+    (path,) = write_sources(tmp_path, 1)
+    (r,) = assemble_many([path], fmt="json")
+    with open(r.output) as fh:
+        data = json.load(fh)
+    assert data["words"] == assemble(generated_source(50, 0))
+    assert data["labels"]["L0"] == 0
+
+
+def test_errors_isolated(tmp_path):
+    paths = write_sources(tmp_path, 5, bad={1, 3})
+    paths.append(str(tmp_path / "missing.asm"))
+    results = assemble_many(paths, workers=2)
+    assert [r.ok for r in results] == [True, False, True, False, True, False]
+    assert "Unknown instruction FOO" in results[1].error
+    assert results[5].error.startswith("FileNotFoundError")
+    assert results[1].output is None
+
+
+def test_cli(tmp_path, capsys):
+    write_sources(tmp_path, 3)
+    assert main(["-j", "2", str(tmp_path)]) == 0
+    assert len(list(tmp_path.glob("*.obj"))) == 3
+    write_sources(tmp_path, 4, bad={3})
+    assert main([str(tmp_path), "--format", "json"]) == 1
+    out, err = capsys.readouterr()
+    assert "3 assembled, 1 failed" in out
+    assert "prog03.asm" in err
@@ -0,0 +1,152 @@
+"""
+Cache for the assembler, so the same source is only assembled once.
+
+Sources are keyed by a hash of their lines as the assembler sees them
+(comments, surrounding whitespace, and blank lines dropped), so editing a
+comment doesn't cause a miss. Keys also cover `VERSION` and
+`objfile.VERSION`, so bumping either after a change to the assembler or the
+object format retires everything cached before. Assembled programs are kept
+in memory, least recently used first out, and optionally on disk as object
+files (see `objfile`), so later processes can use them too.
+
+Usage:
+
+    cache = AssemblyCache(cache_dir="__asmcache__")
+    prog = assemble(src, cache=cache)
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import objfile
+from assembler import _strip, assemble_with_symbols
+from objfile import SUFFIX, ObjectFile, write_object
+
+VERSION = 1  # bump when the assembler's output changes, to invalidate caches
+
+
+def source_hash(lines):
+    """
+    Hex digest of the source `lines`, ignoring comments, surrounding
+    whitespace, and blank lines (and of the assembler and object file
+    versions, so a cache never outlives the code that filled it).
+    """
+    h = hashlib.sha256(b"asm%d:obj%d:" % (VERSION, objfile.VERSION))
+    for raw in lines:
+        line = _strip(raw)
+        if line:
+            h.update(line.encode())
+            h.update(b"\n")
+    return h.hexdigest()
+
+
+class AssemblyCache:
+    """
+    Two-level cache of assembled programs: the `maxsize` most recently used
+    in memory and, if `cache_dir` is given, any number on disk, up to
+    `max_disk_bytes` in total (no limit if `None`), evicting the least
+    recently used first.
+
+    `hits`, `disk_hits`, and `misses` count lookups answered from memory,
+    from disk, and by assembling.
+    """
+
+    def __init__(self, cache_dir=None, maxsize=128, max_disk_bytes=None):
+        self.cache_dir = cache_dir
+        self.maxsize = maxsize
+        self.max_disk_bytes = max_disk_bytes
+        self._programs = OrderedDict()  # digest -> tuple of words
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def assemble(self, lines):
+        """
+        Assembled words for source `lines`, as `assembler.assemble()`
+        returns them.
+        """
+        lines = list(lines)
+        digest = source_hash(lines)
+        words = self._programs.get(digest)
+        if words is not None:
+            self._programs.move_to_end(digest)
+            self.hits += 1
+            return list(words)
+        words = self._read(digest)
+        if words is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            words, labels, line_map = assemble_with_symbols(lines)
+            self._write(digest, words, labels)
+        self._remember(digest, words)
+        return list(words)
+
+    def clear(self):
+        """
+        Forget everything in memory (the disk cache is left alone).
+        """
+        self._programs.clear()
+
+    def _remember(self, digest, words):
+        self._programs[digest] = tuple(words)
+        while len(self._programs) > self.maxsize:
+            self._programs.popitem(last=False)
+
+    def _path(self, digest):
+        return os.path.join(self.cache_dir, digest + SUFFIX)
+
+    def _read(self, digest):
+        """
+        Words from the disk cache, or `None`.
+        """
+        if self.cache_dir is None:
+            return None
+        path = self._path(digest)
+        try:
+            with ObjectFile(path) as obj:
+                words = obj.words.tolist()
+        except (OSError, ValueError):
+            return None  # missing, or not ours
+        os.utime(path)  # recently used
+        return words
+
+    def _write(self, digest, words, labels):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(digest)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        write_object(tmp, words, labels)
+        os.replace(tmp, path)  # atomic, in case of concurrent writers
+        if self.max_disk_bytes is not None:
+            self._evict(keep=path)
+
+    def _evict(self, keep):
+        """
+        Remove least recently used object files until the disk cache fits
+        in `max_disk_bytes`, never removing `keep`.
+        """
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(SUFFIX):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # another process got there first
+            total -= size
@@ -0,0 +1,95 @@
+"""
+Tests for the assembler cache
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import os
+
+import asmcache
+import assembler
+from asmcache import AssemblyCache, source_hash
+from assembler import assemble
+
+SOURCE = [
+    "LOADI R1, #3  ; three",
+    "LOADI R2, #1",
+    "TOP:",
+    "SUB R1, R1, R2",
+    "HALT",
+]
+
+
+def program(n):
+    return [f"LOADI R1, #{n}", "HALT"]
+
+
+def count_assembles(monkeypatch):
+    calls = []
+    real = assembler.assemble_with_symbols
+
+    def counting(lines):
+        calls.append(lines)
+        return real(lines)
+
+    monkeypatch.setattr("asmcache.assemble_with_symbols", counting)
+    return calls
+
+
+def test_source_hash_ignores_comments_and_blank_lines():
+    edited = ["", "  LOADI R1, #3", "LOADI R2, #1 ; one", "TOP:", "SUB R1, R1, R2", "HALT", ""]
+    assert source_hash(SOURCE) == source_hash(edited)
+    assert source_hash(SOURCE) != source_hash(SOURCE[:-1])
+
+
+def test_source_hash_includes_version(monkeypatch):
+    before = source_hash(SOURCE)
+    monkeypatch.setattr("asmcache.VERSION", asmcache.VERSION + 1)
+    assert source_hash(SOURCE) != before
+
+
+def test_memory_hits(monkeypatch):
+    calls = count_assembles(monkeypatch)
+    cache = AssemblyCache()
+    first = assemble(SOURCE, cache=cache)
+    assert first == assemble(SOURCE)
+    first.append(0)  # callers get their own list
+    assert assemble(iter(SOURCE), cache=cache) == assemble(SOURCE)
+    assert (cache.hits, cache.disk_hits, cache.misses) == (1, 0, 1)
+    assert len(calls) == 1
+
+
+def test_memory_lru(monkeypatch):
+    calls = count_assembles(monkeypatch)
+    cache = AssemblyCache(maxsize=2)
+    for n in (1, 2, 1, 3, 1, 2):
+        cache.assemble(program(n))
+    # 2 was least recently used when 3 came in
+    assert (cache.hits, cache.misses) == (2, 4)
+    assert len(calls) == 4
+
+
+def test_disk_cache_shared(tmp_path, monkeypatch):
+    calls = count_assembles(monkeypatch)
+    AssemblyCache(cache_dir=tmp_path).assemble(SOURCE)
+    cache = AssemblyCache(cache_dir=tmp_path)  # e.g., another process
+    assert cache.assemble(SOURCE) == assemble(SOURCE)
+    assert cache.assemble(SOURCE) == assemble(SOURCE)
+    assert (cache.hits, cache.disk_hits, cache.misses) == (1, 1, 0)
+    assert len(calls) == 1
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = AssemblyCache(cache_dir=tmp_path, maxsize=0)
+    cache.assemble(program(1))
+    (size,) = {entry.stat().st_size for entry in os.scandir(tmp_path)}
+    cache.max_disk_bytes = 2 * size
+    cache.assemble(program(2))
+    for path in os.scandir(tmp_path):  # make 1 the least recently used
+        os.utime(path, (0, 0) if path.name.startswith(source_hash(program(1))) else None)
+    cache.assemble(program(3))
+    names = {entry.name for entry in os.scandir(tmp_path)}
+    assert names == {source_hash(program(n)) + ".obj" for n in (2, 3)}
+    cache.assemble(program(1))
+    assert cache.misses == 4
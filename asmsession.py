@@ -0,0 +1,119 @@
+"""
+Incremental reassembly, for sources that are edited a line at a time.
+
+An `AssemblySession` remembers how each line of the source was encoded and
+where every label ended up. Given the edited source, it only encodes lines
+it hasn't seen before; the rest is fixing up addresses and the offsets of
+branches and CALLs. Along with the new words, it returns what changed, which
+can be applied to a loaded program in place:
+
+    session = AssemblySession(src)
+    cpu = make_cpu(session.words)
+    ...
+    src[12] = "LOADI R5, #0x2A"
+    words, changes = session.update(src)
+    cpu.patch_program(changes)
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+from assembler import _encode_line
+
+
+class AssemblySession:
+    """
+    Assembles `lines` and reassembles them after edits (see `update()`).
+    `words` and `labels` are the current program and label table;
+    `encoded` counts the lines actually encoded so far.
+    """
+
+    def __init__(self, lines=()):
+        self._lines = []
+        self._entries = []  # per line, from `_encode_line()`
+        self._addrs = []  # per line, address of its word (or label)
+        self._memo = {}  # line -> entry, for lines seen before
+        self.words = []
+        self.labels = {}
+        self.encoded = 0
+        self.update(lines)
+
+    def update(self, lines):
+        """
+        Reassemble after `lines` (the whole edited source) has changed.
+        Returns `(words, changes)`, where `changes` maps each address whose
+        word changed to its new word; addresses past the end of a program
+        that got shorter map to 0. On error the session is left as it was.
+        """
+        lines = list(lines)
+        if len(lines) == len(self._lines):
+            edited = [num for num, (old, new) in enumerate(zip(self._lines, lines))
+                      if old != new]
+            entries = [self._entry(lines[num]) for num in edited]
+            if all(isinstance(self._entries[num], tuple) and isinstance(entry, tuple)
+                   for num, entry in zip(edited, entries)):
+                return self._patch(lines, edited, entries)
+        return self._relayout(lines)
+
+    def _entry(self, line):
+        entry = self._memo.get(line, self)
+        if entry is self:
+            entry = self._memo[line] = _encode_line(line)
+            self.encoded += 1
+        return entry
+
+    def _patch(self, lines, edited, entries):
+        """
+        Only instructions changed, so no label moved: just re-encode them.
+        """
+        words = list(self.words)
+        changes = {}
+        for num, entry in zip(edited, entries):
+            addr = self._addrs[num]
+            word = self._resolve(entry, addr, self.labels)
+            if word != words[addr]:
+                words[addr] = changes[addr] = word
+        for num, entry in zip(edited, entries):
+            self._entries[num] = entry
+        self._lines = lines
+        self.words = words
+        return words, changes
+
+    def _relayout(self, lines):
+        """
+        Lines came, went, or turned into (or from) labels: lay out again.
+        """
+        entries = [self._entry(line) for line in lines]
+        labels = {}
+        addrs = []
+        pc = 0
+        for entry in entries:
+            addrs.append(pc)
+            if isinstance(entry, str):
+                if entry in labels:
+                    raise ValueError(f"Duplicate label: {entry}")
+                labels[entry] = pc
+            elif entry is not None:
+                pc += 1
+        words = [self._resolve(entry, addr, labels)
+                 for entry, addr in zip(entries, addrs) if isinstance(entry, tuple)]
+        old = self.words
+        changes = {addr: word for addr, word in enumerate(words)
+                   if addr >= len(old) or old[addr] != word}
+        changes.update(dict.fromkeys(range(len(words), len(old)), 0))
+        self._lines, self._entries, self._addrs = lines, entries, addrs
+        self.words, self.labels = words, labels
+        return words, changes
+
+    @staticmethod
+    def _resolve(entry, addr, labels):
+        """
+        The word for instruction `entry` at `addr`, with any offset filled
+        in.
+        """
+        word, label, shift = entry
+        if label is None:
+            return word
+        if label not in labels:
+            raise ValueError(f"Unknown label {label}")
+        return word | ((labels[label] - addr - 1) & 0xFF) << shift
@@ -0,0 +1,98 @@
+"""
+Tests for incremental reassembly
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import random
+
+import pytest
+
+from asmsession import AssemblySession
+from assembler import assemble, assemble_with_symbols
+from assembler_test import generated_source
+from cpu import make_cpu
+from instruction_set import predecode
+
+
+def apply(words, changes):
+    words = words + [0] * (max(changes, default=-1) + 1 - len(words))
+    for addr, word in changes.items():
+        words[addr] = word
+    return words
+
+
+def test_initial_assembly():
+    src = generated_source(300, 0)
+    session = AssemblySession(src)
+    assert session.words == assemble(src)
+    assert session.labels == assemble_with_symbols(src)[1]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_edits_match_full_reassembly(seed):
+    rng = random.Random(seed)
+    src = generated_source(300, seed)
+    spare = generated_source(300, seed + 100)
+    session = AssemblySession(src)
+    for _ in range(30):
+        src = list(src)
+        num = rng.randrange(len(src) - 1)  # keep the final HALT
+        kind = rng.randrange(4)
+        if kind == 0:  # change an instruction
+            if src[num].endswith(":"):
+                continue
+            src[num] = rng.choice([line for line in spare if not line.endswith(":")])
+        elif kind == 1:  # insert a line
+            src.insert(num, rng.choice(["ADD R1, R2, R3", "; comment", ""]))
+        elif kind == 2:  # delete a line, unless it's a label
+            if src[num].endswith(":"):
+                continue
+            del src[num]
+        else:  # move a label
+            labels = [n for n, line in enumerate(src) if line.endswith(":")]
+            label = src.pop(rng.choice(labels))
+            src.insert(num, label)
+        old = session.words
+        words, changes = session.update(src)
+        assert words == session.words == assemble(src)
+        assert apply(old, changes)[:len(words)] == words
+        assert all(word == 0 for word in apply(old, changes)[len(words):])
+
+
+def test_only_new_lines_encoded():
+    src = generated_source(300, 1)
+    session = AssemblySession(src)
+    encoded = session.encoded
+    src[5] = "LOADI R5, #0x2A"
+    words, changes = session.update(src)
+    assert session.encoded == encoded + 1
+    assert list(changes) == [session._addrs[5]]  # OK to access in tests
+    src.insert(0, "LOADI R5, #0x2A")  # seen before
+    session.update(src)
+    assert session.encoded == encoded + 1
+
+
+def test_errors_leave_session_unchanged():
+    src = ["X:", "B X", "HALT"]
+    session = AssemblySession(src)
+    for bad in (["X:", "B Y", "HALT"], ["X:", "X:", "HALT"], ["X:", "FOO", "HALT"]):
+        with pytest.raises(ValueError):
+            session.update(bad)
+        assert session.words == assemble(src)
+    assert session.update(src) == (assemble(src), {})
+
+
+def test_patch_loaded_program():
+    src = ["LOADI R1, #3", "LOADI R2, #4", "ADD R3, R1, R2", "HALT"]
+    session = AssemblySession(src)
+    c = make_cpu(session.words)
+    src[1] = "LOADI R2, #10"
+    words, changes = session.update(src)
+    c.patch_program(changes)
+    assert c._predecoded == {  # OK to access in tests
+        addr: predecode(word, addr) for addr, word in enumerate(words)
+    }
+    c.run()
+    assert c.get_reg(3) == 13
@@ -18,8 +18,13 @@ Clayton Cafiero <cbcafier@uvm.edu>
 import glob
 import os
 import re
+from dataclasses import dataclass
 from instruction_set import ISA
 
+# Tokenizer patterns, compiled once
+_TOKEN = re.compile(r'\[[^\]]+\]|[^\s,]+')
+_MEM_OPERAND = re.compile(r'\[(R\d)(?:\s*\+\s*#?(-?\w+))?\]')
+
 
 def _strip(line):
     """Remove comments and surrounding whitespace."""
@@ -41,6 +46,16 @@ def _reg(token):
     return n
 
 
+class _Registers(dict):
+    """Register numbers by token; anything unusual goes through `_reg`."""
+
+    def __missing__(self, token):
+        return _reg(token)
+
+
+_REGISTERS = _Registers({f"R{n}": n for n in range(8)})
+
+
 def _imm(token, bits):
     """Parse an immediate (#n or numeric literal) and mask to width."""
     if token.startswith('#'):
@@ -54,7 +69,7 @@ def _mem_operand(token):
     Parse memory operand like [R3 + #5] or [R3].
     Returns (base_reg, 6-bit offset).
     """
-    m = re.match(r'\[(R\d)(?:\s*\+\s*#?(-?\w+))?\]', token)
+    m = _MEM_OPERAND.match(token)
 
     if not m:
         raise ValueError(f"Bad memory operand: {token}")
@@ -63,20 +78,87 @@ def _mem_operand(token):
     return base, offset & 0x3F
 
 
-def assemble(lines):
+def assemble(lines, cache=None):
     """
     Assemble a list of source lines into 16-bit instruction words.
+
+    With `cache` (an `asmcache.AssemblyCache`), source that has been
+    assembled before isn't assembled again.
+    """
+    if cache is not None:
+        return cache.assemble(lines)
+    return assemble_with_symbols(lines)[0]
+
+
+def assemble_with_symbols(lines):
+    """
+    Assemble like `assemble()`, also returning the label table from pass 1
+    and, for each word, the (1-based) number of the source line it came
+    from: `(words, labels, line_map)`.
+    """
+    return _assemble(lines)[:3]
+
+
+def assemble_program(lines):
+    """
+    Assemble source lines into a `Program`, which can be re-bound to new
+    immediates without assembling again. Here an immediate of LOADI, LUI,
+    or ADDI may be a name instead of a number (e.g., `LOADI R5, #A`), which
+    `Program.bind()` sets; until then it is zero.
+    """
+    words, labels, line_map, patch_points = _assemble(lines, symbolic=True)
+    patch_points = {name: tuple(sites) for name, sites in patch_points.items()}
+    return Program(tuple(words), labels, tuple(line_map), patch_points)
+
+
+@dataclass(frozen=True)
+class Program:
+    """
+    An assembled program with patch points: the immediate fields of its
+    LOADI, LUI, and ADDI instructions. Each is named `L<n>` after its
+    source line `n`, and named immediates are also patch points under
+    their names. `patch_points` maps a name to its sites, as `(address,
+    shift, bits)` tuples.
+    """
+
+    words: tuple
+    labels: dict
+    line_map: tuple
+    patch_points: dict
+
+    def bind(self, **values):
+        """
+        Instruction words with the named immediate fields set to `values`,
+        e.g., `prog.bind(A=42, L7=-1)`. Only the fields named are touched.
+        Raises `ValueError` for a value that does not fit its field.
+        """
+        words = list(self.words)
+        for name, value in values.items():
+            if name not in self.patch_points:
+                raise ValueError(f"Unknown patch point {name}")
+            for addr, shift, bits in self.patch_points[name]:
+                if not -(1 << (bits - 1)) <= value < (1 << bits):
+                    raise ValueError(f"{name} = {value} does not fit in {bits} bits")
+                mask = ((1 << bits) - 1) << shift
+                words[addr] = (words[addr] & ~mask) | ((value << shift) & mask)
+        return words
+
+
+def _assemble(lines, symbolic=False):
+    """
+    Both passes. Returns `(words, labels, line_map, patch_points)`, see
+    `Program`. Named immediates are only allowed if `symbolic`.
     """
     # Pass 1: record labels and strip comments
     labels = {}
     pc = 0
     cleaned = []
 
-    for raw in lines:
+    for num, raw in enumerate(lines, 1):
         line = _strip(raw)
         if not line:
             continue
-        cleaned.append(line)
+        cleaned.append((num, line))
         if _is_label(line):
             name = line[:-1]
             if name in labels:
@@ -87,77 +169,127 @@ def assemble(lines):
 
     # Pass 2: encode instructions
     program = []
+    line_map = []
+    patch_points = {}
     pc = 0
 
-    for line in cleaned:
+    for num, line in cleaned:
         if _is_label(line) or not line:
             continue
 
-        tokens = re.findall(r'\[[^\]]+\]|[^\s,]+', line)
-        mnemonic = tokens[0].upper()
-        if mnemonic not in ISA:
-            raise ValueError(f"Unknown instruction {mnemonic}")
-
-        info = ISA[mnemonic]
-        opcode = info['opcode']
-        word = 0  # leave this as-is for now
-
-        if info['format'] == 'R':
-            rd, ra, rb = map(_reg, tokens[1:4])
-            word = (opcode << 12) | (rd << 9) | (ra << 6) | (rb << 3)
-
-        elif mnemonic in ('LOADI', 'LUI'):
-            rd = _reg(tokens[1])
-            imm = _imm(tokens[2], 8)
-            word = (opcode << 12) | (rd << 9) | (imm << 1)
-
-        elif mnemonic == 'ADDI':
-            rd, ra = map(_reg, tokens[1:3])
-            imm = _imm(tokens[3], 6)
-            word = (opcode << 12) | (rd << 9) | (ra << 6) | imm
-
-        elif mnemonic == 'LOAD':
-            rd = _reg(tokens[1])
-            ra, offset = _mem_operand(tokens[2])
-            word = (opcode << 12) | (rd << 9) | (ra << 6) | offset
-
-        elif mnemonic == 'STORE':
-            ra = _reg(tokens[1])
-            rb, offset = _mem_operand(tokens[2])
-            word = (opcode << 12) | (ra << 9) | (rb << 6) | offset
-
-        elif mnemonic in ('BEQ', 'BNE'):
-            ra = _reg(tokens[1])
-            label = tokens[-1]
-            if label not in labels:
-                raise ValueError(f"Unknown label {label}")
-            offset = (labels[label] - pc - 1) & 0xFF
-            word = (opcode << 12) | (ra << 9) | (offset << 1)
+        def imm(token, shift, bits):
+            return _patch_point(patch_points, token, pc, num, shift, bits, symbolic)
 
-        elif mnemonic == 'B':
-            label = tokens[-1]
+        word, label, shift = _encode_line(line, imm)
+        if label is not None:
             if label not in labels:
                 raise ValueError(f"Unknown label {label}")
-            offset = (labels[label] - pc - 1) & 0xFF
-            word = (opcode << 12) | (offset << 4)
+            word |= ((labels[label] - pc - 1) & 0xFF) << shift
 
-        elif mnemonic == 'CALL':
-            label = tokens[1]
-            if label not in labels:
-                raise ValueError(f"Unknown label {label}")
-            offset = (labels[label] - pc - 1) & 0xFF
-            word = (opcode << 12) | (offset << 4)
+        program.append(word & 0xFFFF)
+        line_map.append(num)
+        pc += 1
 
-        elif mnemonic in ('RET', 'HALT'):
-            word = (opcode << 12)
+    return program, labels, line_map, patch_points
 
-        else:
-            raise ValueError(f"Unhandled instruction {mnemonic}")
 
-        program.append(word & 0xFFFF)
-        pc += 1
+def _patch_point(patch_points, token, pc, num, shift, bits, symbolic):
+    """
+    Record the immediate field at `pc` (from source line `num`) as a patch
+    point, and return its value: `token` parsed, or zero for a name.
+    """
+    site = (pc, shift, bits)
+    patch_points.setdefault(f"L{num}", []).append(site)
+    name = token[1:] if token.startswith('#') else token
+    if symbolic and name.isidentifier():
+        patch_points.setdefault(name, []).append(site)
+        return 0
+    return _imm(token, bits)
+
+
+def assemble_stream(lines):
+    """
+    Assemble in a single pass over `lines`, which may be any iterable of
+    source lines (an open file, a generator, ...), so the source never has
+    to be held in memory. Words are encoded as lines arrive; offsets of
+    branches and CALLs to labels not yet seen are left zero and patched in
+    at the end from a list of fixups. Gives the same words as `assemble()`.
+    """
+    labels = {}
+    fixups = []  # (address, label, shift) of offsets still to fill in
+    words = []
+    emit = words.append
+
+    for raw in lines:
+        entry = _encode_line(raw)
+        if entry is None:
+            continue
+        if isinstance(entry, str):
+            if entry in labels:
+                raise ValueError(f"Duplicate label: {entry}")
+            labels[entry] = len(words)
+            continue
+        word, label, shift = entry
+        if label is not None:
+            pc = len(words)
+            if label in labels:
+                word |= ((labels[label] - pc - 1) & 0xFF) << shift
+            else:
+                fixups.append((pc, label, shift))
+        emit(word)
+
+    # Backpatch forward references
+    for pc, label, shift in fixups:
+        if label not in labels:
+            raise ValueError(f"Unknown label {label}")
+        words[pc] |= ((labels[label] - pc - 1) & 0xFF) << shift
+
+    return words
 
-    return program
+
+def _encode_line(raw, imm=None):
+    """
+    Encode one source line on its own: `None` for a blank line, the name
+    for a label, or `(word, label, shift)` for an instruction. For a branch
+    or CALL, the offset to `label` still has to be added to `word` at bit
+    `shift`; otherwise `label` is `None`. This is the one place instructions
+    are encoded: `_assemble()`, `assemble_stream()`, `asmsession`,
+    `linker`, and `relax` all go through it.
+
+    `imm(token, shift, bits)`, if given, parses the immediate of LOADI,
+    LUI, or ADDI, whose field is `bits` wide at bit `shift`.
+    """
+    line = _strip(raw)
+    if not line:
+        return None
+    if _is_label(line):
+        return line[:-1]
+    tokens = _TOKEN.findall(line)
+    mnemonic = tokens[0].upper()
+    info = ISA.get(mnemonic)
+    if info is None:
+        raise ValueError(f"Unknown instruction {mnemonic}")
+    opcode = info['opcode'] << 12
+    reg = _REGISTERS
+    if info['format'] == 'R':
+        _, rd, ra, rb = tokens[:4]
+        return opcode | (reg[rd] << 9) | (reg[ra] << 6) | (reg[rb] << 3), None, 0
+    if mnemonic in ('LOADI', 'LUI'):
+        value = imm(tokens[2], 1, 8) if imm else _imm(tokens[2], 8)
+        return opcode | (reg[tokens[1]] << 9) | (value << 1), None, 0
+    if mnemonic == 'ADDI':
+        word = opcode | (reg[tokens[1]] << 9) | (reg[tokens[2]] << 6)
+        return word | (imm(tokens[3], 0, 6) if imm else _imm(tokens[3], 6)), None, 0
+    if mnemonic in ('LOAD', 'STORE'):
+        rb, offset = _mem_operand(tokens[2])
+        return opcode | (reg[tokens[1]] << 9) | (rb << 6) | offset, None, 0
+    if mnemonic in ('BEQ', 'BNE'):
+        return opcode | (reg[tokens[1]] << 9), tokens[-1], 1
+    if mnemonic in ('B', 'CALL'):
+        return opcode, tokens[1 if mnemonic == 'CALL' else -1], 4
+    if mnemonic in ('RET', 'HALT'):
+        return opcode, None, 0
+    raise ValueError(f"Unhandled instruction {mnemonic}")
 
 
 if __name__ == '__main__':
@@ -8,8 +8,11 @@ Clayton Cafiero <cbcafier@uvm.edu>
 
 """
 
+import random
+
 import pytest  # pip install pytest
 from assembler import _strip, _is_label, _reg, _imm, _mem_operand, assemble
+from assembler import assemble_program, assemble_stream
 
 
 def test_strip():
@@ -283,5 +286,86 @@ def test_duplicate_label_raises():
         assemble(["LOOP:", "LOOP:", "HALT"])
 
 
+def test_program_bind_matches_reassembly():
+    template = ["LOADI R5, #{a}", "LUI R5, #{b}", "LOOP:", "ADDI R6, R5, #{c}", "HALT"]
+    prog = assemble_program([line.format(a="A", b="B", c="A") for line in template])
+    assert prog.labels == {"LOOP": 2}
+    assert sorted(prog.patch_points) == ["A", "B", "L1", "L2", "L4"]
+    for a, b in [(0, 0), (42, 0xFF), (-1, 7), (-32, 31)]:
+        expected = assemble([line.format(a=a, b=b, c=a) for line in template])
+        assert prog.bind(A=a, B=b) == expected
+    # by line, too
+    expected = assemble([line.format(a=3, b=0, c=0) for line in template])
+    assert prog.bind(L1=3) == expected
+
+
+def test_program_bind_untouched_fields():
+    prog = assemble_program(["LOADI R5, #0x2A", "ADDI R1, R2, #A", "HALT"])
+    assert list(prog.words) == assemble(["LOADI R5, #0x2A", "ADDI R1, R2, #0", "HALT"])
+    assert prog.bind() == list(prog.words)
+    assert prog.bind(A=5)[0] == prog.words[0]
+
+
+def test_program_bind_rejects_bad_values():
+    prog = assemble_program(["LOADI R5, #A", "ADDI R1, R2, #B", "HALT"])
+    with pytest.raises(ValueError):
+        prog.bind(A=256)
+    with pytest.raises(ValueError):
+        prog.bind(A=-129)
+    with pytest.raises(ValueError):
+        prog.bind(B=64)
+    with pytest.raises(ValueError, match="Unknown patch point"):
+        prog.bind(C=1)
+
+
+def test_named_immediates_only_in_programs():
+    with pytest.raises(ValueError):
+        assemble(["LOADI R5, #A"])
+
+
+def generated_source(n, seed):
+    """Random valid source with forward and backward references."""
+    rng = random.Random(seed)
+    reg = lambda: f"R{rng.randrange(8)}"
+    lines = []
+    for i in range(n):
+        if i % 10 == 0:
+            lines.append(f"L{i // 10}:")
+        label = f"L{max(0, min((n - 1) // 10, i // 10 + rng.randrange(-3, 4)))}"
+        lines.append(rng.choice([
+            f"ADD {reg()}, {reg()}, {reg()}",
+            f"SHFT {reg()} {reg()} {reg()}  ; no commas",
+            f"LOADI {reg()}, #{rng.randrange(-128, 256)}",
+            f"LUI {reg()}, 0x{rng.randrange(256):X}",
+            f"ADDI {reg()}, {reg()}, #{rng.randrange(-32, 64)}",
+            f"LOAD {reg()}, [{reg()} + #{rng.randrange(64)}]",
+            f"STORE {reg()}, [{reg()}]",
+            f"BEQ {reg()}, {label}",
+            f"B {label}",
+            f"CALL {label}",
+            "RET",
+            "   ; nothing here",
+        ]))
+    lines.append("HALT")
+    return lines
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_assemble_stream_matches_assemble(seed):
+    src = generated_source(500, seed)
+    assert assemble_stream(line for line in src) == assemble(src)
+
+
+def test_assemble_stream_backpatches_forward_references():
+    src = ["CALL END", "B END", "BNE R1, END", "END:", "B END"]
+    assert assemble_stream(src) == assemble(src)
+    with pytest.raises(ValueError, match="Unknown label"):
+        assemble_stream(["B NOWHERE", "HALT"])
+    with pytest.raises(ValueError, match="Duplicate label"):
+        assemble_stream(["X:", "X:", "HALT"])
+    with pytest.raises(ValueError, match="Register out of range"):
+        assemble_stream(["ADD R1, R2, R8"])
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -0,0 +1,201 @@
+"""
+Checkpoints, so a long run can be stopped and resumed later, in another
+process. A checkpoint holds the machine state (registers, PC, SP, IR, halt
+state, and the ALU's flags and last operation), every initialized cell of
+data memory (stack included), and a hash of the program, so it can only be
+resumed with the program it was taken from.
+
+    checkpoint.save(cpu, "run.ckpt")
+    ...
+    cpu = make_cpu(prog)
+    checkpoint.resume(cpu, "run.ckpt")
+    cpu.run()
+
+Layout (all little-endian):
+
+    header      magic b"CATK", version (u16), compression (u8: 1 zlib,
+                2 lzma); everything after the header is compressed
+    state       program hash (SHA-256, 32 bytes), PC (u32), SP (u32),
+                IR (u16), halted (u8), flags (u8), last ALU operation (u8,
+                index into `OPS`), R0-R7 (i32 each, registers can hold
+                negative values)
+    memory      number of runs (u32), then per run of consecutive initialized
+                cells: first address (u16), length (u32), and one u16 per cell
+
+Writing and reading are streamed through the compressor, a run at a time.
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import hashlib
+import lzma
+import struct
+import sys
+import zlib
+from array import array
+
+from cpu import Snapshot
+
+MAGIC = b"CATK"
+VERSION = 1
+HEADER = struct.Struct("<4sHB")
+STATE = struct.Struct("<32sIIHBBB8i")
+RUN = struct.Struct("<HI")
+COUNT = struct.Struct("<I")
+COMPRESSION = {"zlib": 1, "lzma": 2}
+OPS = (None, "ADD", "SUB", "AND", "OR", "SHFT")  # last ALU operation
+CHUNK = 1 << 16  # bytes compressed or read at a time
+
+
+def _to_bytes(words):
+    """
+    `words` (an `array('H')`) as little-endian bytes.
+    """
+    if sys.byteorder != "little":
+        words = array("H", words)
+        words.byteswap()
+    return words.tobytes()
+
+
+def program_hash(i_mem):
+    """
+    SHA-256 digest of the program in instruction memory `i_mem`, from
+    address 0 to the highest initialized address.
+    """
+    highest = i_mem._highest()
+    count = 0 if highest is None else highest + 1
+    words = array("H", [i_mem.read(addr) for addr in range(count)])
+    return hashlib.sha256(_to_bytes(words)).digest()
+
+
+def _runs(cells):
+    """
+    `(start, array('H'))` for each run of consecutive addresses in `cells`
+    (address -> word), in address order.
+    """
+    runs = []
+    for addr in sorted(cells):
+        if runs and addr == runs[-1][0] + len(runs[-1][1]):
+            runs[-1][1].append(cells[addr])
+        else:
+            runs.append((addr, array("H", [cells[addr]])))
+    return runs
+
+
+def _compressor(kind):
+    if kind == COMPRESSION["zlib"]:
+        return zlib.compressobj()
+    if kind == COMPRESSION["lzma"]:
+        return lzma.LZMACompressor()
+    raise ValueError(f"Unknown checkpoint compression {kind}")
+
+
+def _decompressor(kind):
+    if kind == COMPRESSION["zlib"]:
+        return zlib.decompressobj()
+    if kind == COMPRESSION["lzma"]:
+        return lzma.LZMADecompressor()
+    raise ValueError(f"Unknown checkpoint compression {kind}")
+
+
+def save(cpu, path, compression="zlib"):
+    """
+    Write a checkpoint of `cpu` to `path`, compressed with `compression`
+    ("zlib" or "lzma").
+    """
+    if compression not in COMPRESSION:
+        raise ValueError(f"Unknown checkpoint compression {compression}")
+    kind = COMPRESSION[compression]
+    alu = cpu._alu
+    state = STATE.pack(
+        program_hash(cpu._i_mem),
+        cpu.pc,
+        cpu.sp,
+        cpu.ir,
+        not cpu.running,
+        alu._flags,
+        OPS.index(alu._op),
+        *(cpu._regs.read1(r) for r in range(8)),
+    )
+    runs = _runs(cpu._d_mem._cells)
+    comp = _compressor(kind)
+    with open(path, "wb") as fh:
+        fh.write(HEADER.pack(MAGIC, VERSION, kind))
+        buf = bytearray(state + COUNT.pack(len(runs)))
+        for start, words in runs:
+            buf += RUN.pack(start, len(words))
+            buf += _to_bytes(words)
+            if len(buf) >= CHUNK:  # compress a chunk at a time
+                fh.write(comp.compress(buf))
+                buf.clear()
+        fh.write(comp.compress(buf))
+        fh.write(comp.flush())
+
+
+class _Stream:
+    """
+    Decompressed bytes of an open checkpoint, read as needed.
+    """
+
+    def __init__(self, fh, kind):
+        self._fh = fh
+        self._dec = _decompressor(kind)
+        self._buf = bytearray()
+
+    def _more(self):
+        chunk = self._fh.read(CHUNK)
+        if not chunk:
+            raise ValueError("Truncated checkpoint")
+        self._buf += self._dec.decompress(chunk)
+
+    def read(self, n):
+        while len(self._buf) < n:
+            self._more()
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        return data
+
+    def finish(self):
+        """
+        Make sure the compressed stream is complete (checksum and all).
+        """
+        while not self._dec.eof:
+            self._more()
+
+
+def resume(cpu, path):
+    """
+    Put `cpu` in the state saved in the checkpoint at `path`. `cpu` must
+    have the same program loaded and nothing in data memory yet (e.g.,
+    straight from `make_cpu(prog)`). Raises `ValueError` if the checkpoint
+    is not for this program, or is not a checkpoint at all.
+    """
+    d_mem = cpu._d_mem
+    if len(d_mem):
+        raise ValueError("Data memory must be empty to resume a checkpoint")
+    with open(path, "rb") as fh:
+        magic, version, kind = HEADER.unpack(fh.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a Catamount checkpoint: {path}")
+        if version != VERSION:
+            raise ValueError(f"Unsupported checkpoint version {version}")
+        stream = _Stream(fh, kind)
+        digest, pc, sp, ir, halt, flags, op, *registers = STATE.unpack(
+            stream.read(STATE.size)
+        )
+        if digest != program_hash(cpu._i_mem):
+            raise ValueError("Checkpoint was taken with a different program")
+        (nruns,) = COUNT.unpack(stream.read(COUNT.size))
+        runs = []
+        for _ in range(nruns):
+            start, length = RUN.unpack(stream.read(RUN.size))
+            words = array("H", stream.read(2 * length))
+            if sys.byteorder != "little":
+                words.byteswap()
+            runs.append((start, words))
+        stream.finish()
+    # Only now that the whole checkpoint has been read is the CPU changed
+    for start, words in runs:
+        d_mem._install(start, words)
+    cpu.restore(Snapshot(pc, ir, sp, bool(halt), tuple(registers), flags, OPS[op], None))
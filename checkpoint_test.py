@@ -0,0 +1,103 @@
+"""
+Tests for checkpoints
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import pytest
+
+import checkpoint
+from assembler import assemble
+from constants import STACK_BASE
+from cpu import make_cpu
+
+# Loop forever: R1 += 1; R2 += R1; store and load R2. B hand-encoded.
+LOOP = [0x4241, 0x5488, 0x3405, 0x2605, 0xC0FB]
+
+CALLS = assemble(
+    [
+        "LOADI R1, #0x7F",
+        "LOADI R2, #0x10",
+        "STORE R1, [R2 + #0]",
+        "CALL FOO",
+        "HALT",
+        "FOO:",
+        "SUB R4, R1, R1",
+        "LOAD R3, [R2 + #0]",
+        "RET",
+    ]
+)
+
+
+def machine_state(c):
+    return (
+        c.pc,
+        c.sp,
+        c.ir,
+        c.running,
+        [c.get_reg(r) for r in range(8)],
+        c._alu._flags,  # OK to access in tests
+        c._alu._op,  # OK to access in tests
+        dict(c._d_mem._cells),  # OK to access in tests
+    )
+
+
+@pytest.mark.parametrize("compression", ["zlib", "lzma"])
+def test_resume_is_bit_exact(tmp_path, compression):
+    path = tmp_path / "run.ckpt"
+    a = make_cpu(LOOP)
+    a.run(max_cycles=1001)
+    checkpoint.save(a, path, compression)
+    b = make_cpu(LOOP)
+    checkpoint.resume(b, path)
+    assert machine_state(b) == machine_state(a)
+    b.run(max_cycles=1000)
+    c = make_cpu(LOOP)
+    c.run(max_cycles=2001)
+    assert machine_state(b) == machine_state(c)
+
+
+@pytest.mark.parametrize("options", [{}, {"flat_memory": True}, {"paged_memory": True}])
+def test_resume_with_stack(tmp_path, options):
+    path = tmp_path / "run.ckpt"
+    a = make_cpu(CALLS, **options)
+    for _ in range(5):  # into FOO, return address on the stack
+        a.tick()
+    assert any(addr >= STACK_BASE for addr in a._d_mem._cells)  # OK to access in tests
+    checkpoint.save(a, path)
+    b = make_cpu(CALLS, **options)
+    checkpoint.resume(b, path)
+    a.run()
+    b.run()
+    assert not b.running
+    assert machine_state(b) == machine_state(a)
+
+
+def test_resume_checks_program(tmp_path):
+    path = tmp_path / "run.ckpt"
+    checkpoint.save(make_cpu(LOOP), path)
+    with pytest.raises(ValueError, match="different program"):
+        checkpoint.resume(make_cpu(CALLS), path)
+
+
+def test_resume_needs_empty_memory(tmp_path):
+    path = tmp_path / "run.ckpt"
+    a = make_cpu(LOOP)
+    a.run(max_cycles=10)
+    checkpoint.save(a, path)
+    with pytest.raises(ValueError, match="empty"):
+        checkpoint.resume(a, path)
+
+
+def test_rejects_bad_files(tmp_path):
+    path = tmp_path / "run.ckpt"
+    path.write_bytes(b"not a checkpoint")
+    with pytest.raises(ValueError, match="Not a Catamount checkpoint"):
+        checkpoint.resume(make_cpu(LOOP), path)
+    checkpoint.save(make_cpu(LOOP), path)
+    path.write_bytes(path.read_bytes()[:-4])
+    with pytest.raises(ValueError, match="Truncated"):
+        checkpoint.resume(make_cpu(LOOP), path)
+    with pytest.raises(ValueError):
+        checkpoint.save(make_cpu(LOOP), path, "bz2")
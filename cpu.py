@@ -8,22 +8,85 @@ Clayton Cafiero <cbcafier@uvm.edu>
 STARTER CODE
 """
 
-from alu import Alu
+import time
+from dataclasses import dataclass
+
+from alu import CONTROL, RESULTS, Z_FLAG, Alu, LazyAlu
 from constants import STACK_TOP
-from instruction_set import Instruction
-from memory import DataMemory, InstructionMemory
+from instruction_set import DecodeError, check_padding, decode, predecode, validate
+from memory import (
+    DataMemory,
+    FlatDataMemory,
+    FlatInstructionMemory,
+    InstructionMemory,
+    PagedDataMemory,
+    ProgramImage,
+    _as_words,
+)
 from register_file import RegisterFile
 
+# Reasons `Cpu.run()` may stop
+STOP_HALT = "halt"
+STOP_BUDGET = "budget"
+STOP_BREAKPOINT = "breakpoint"
+
+
+@dataclass
+class RunResult:
+    """
+    What happened during a call to `Cpu.run()`.
+    """
+
+    cycles: int  # instructions executed
+    reason: str  # one of STOP_HALT, STOP_BUDGET, STOP_BREAKPOINT
+    wall_time: float  # seconds
+
+    @property
+    def ips(self):
+        """
+        Instructions per second.
+        """
+        return self.cycles / self.wall_time if self.wall_time else 0.0
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    Machine state saved by `Cpu.snapshot()`. `d_mem` is whatever the data
+    memory's own `snapshot()` returned, or `None` for a snapshot that
+    leaves data memory alone when restored.
+    """
+
+    pc: int
+    ir: int
+    sp: int
+    halt: bool
+    registers: tuple
+    flags: int
+    op: str  # last ALU operation
+    d_mem: object
+
 
 class Cpu:
     """
     Catamount Processing Unit
     """
 
-    def __init__(self, *, alu, regs, d_mem, i_mem):
+    def __init__(self, *, alu, regs, d_mem, i_mem, engine=None, strict=False):
         """
         Constructor
+
+        `engine` optionally selects a faster execution engine for `run()`,
+        e.g., `threaded.ThreadedEngine`. It is called with this CPU and must
+        provide `execute(max_cycles, until_pc)` with the same contract as
+        `_execute()`. By default `run()` uses the interpreter.
+
+        Programs are checked for bad zero padding when loaded (see
+        `load_program()`), so fetching doesn't check again. With `strict`,
+        loading doesn't check, and every fetch does, as it used to: a bad
+        word raises `DecodeError` only when (and if) it is reached.
         """
+        self._strict = strict
         self._i_mem = i_mem
         self._d_mem = d_mem
         self._regs = regs
@@ -31,8 +94,13 @@ class Cpu:
         self._pc = 0  # program counter
         self._ir = 0  # instruction register
         self._sp = STACK_TOP  # stack pointer
-        self._decoded = Instruction()
+        self._decoded = decode(0)
         self._halt = False
+        # Predecoded program: address -> tuple from `predecode()`.
+        self._invalidate_program()
+        # ALU kernels by mnemonic, bound once: (a, b) -> (result, flags)
+        self._kernels = {op: alu.op_table[c] for op, c in CONTROL.items()}
+        self._engine = engine(self) if engine else None
 
     @property
     def running(self):
@@ -52,6 +120,8 @@ class Cpu:
 
     @property
     def decoded(self):
+        if self._decoded is None:
+            self._decoded = decode(self._ir)
         return self._decoded
 
     def get_reg(self, r):
@@ -65,141 +135,266 @@ class Cpu:
         """
         Fetch-decode-execute
         Implementation incomplete.
+
+        Decoding is done once per word, when the program is loaded (see
+        `_predecoded`), so a tick only has to look up the entry for PC.
         """
         if not self._halt:
-            self._fetch()
-            self._decode()
-
-            # execute...
-            match self._decoded.mnem:
-                case "LOADI":
-                    rd = self._decoded.rd
-                    imm = self._decoded.imm
-                    self._regs.execute(rd=rd, data=imm, write_enable=True)
-                case "LUI":
-                    # TODO Refactor for future semester(s) if any.
-                    # Cheating for compatibility with released ALU tests
-                    # and starter code. Leave as-is for 2025 Fall.
-                    rd = self._decoded.rd
-                    imm = self._decoded.imm & 0xFF
-                    upper = imm << 8
-                    lower, _ = self._regs.execute(ra=rd)
-                    lower &= 0x00FF  # clear upper bits
-                    data = upper | lower
-                    self._regs.execute(rd=rd, data=data, write_enable=True)
-                case "LOAD":
-                    base , _ = self._regs.execute(ra=self._decoded.ra)
-                    offset = self.sext(self._decoded.addr)
-                    data = self._d_mem.read(base + offset)
-                    self._regs.execute(rd=self._decoded.rd, data=data, write_enable=True)
-                case "STORE":
-                    ra = self._decoded.ra
-                    rb = self._decoded.rb
-                    offset = self._decoded.imm
-                    addr = self._regs.execute(ra=rb)[0] + offset
-                    data = self._regs.execute(ra=ra)[0]
-                    self._d_mem.write(addr, data)
-                case "ADDI":
-                    rd = self._decoded.rd
-                    ra = self._decoded.ra
-                    imm = self._decoded.imm
-                    op_a, _ = self._regs.execute(ra=ra)
-                    self._alu.set_op("ADD")
-                    result = self._alu.execute(op_a, imm)
-                    self._regs.execute(rd=rd, data=result, write_enable=True)
-                case "ADD":
-                    self._alu.set_op("ADD")
-                    rd = self._decoded.rd
-                    ra = self._decoded.ra
-                    rb = self._decoded.rb
-                    op_a, op_b = self._regs.execute(ra=ra, rb=rb)
-                    result = self._alu.execute(op_a, op_b)
-                    self._regs.execute(rd=rd, data=result, write_enable=True)
-                case "SUB":
-                    self._alu.set_op("SUB")
-                    rd = self._decoded.rd
-                    ra = self._decoded.ra
-                    rb = self._decoded.rb
-                    op_a, op_b = self._regs.execute(ra=ra, rb=rb)
-                    result = self._alu.execute(op_a, op_b)
-                    self._regs.execute(rd=rd, data=result, write_enable=True)
-                case "AND":
-                    self._alu.set_op("AND")
-                    rd = self._decoded.rd
-                    ra = self._decoded.ra
-                    rb = self._decoded.rb
-                    op_a, op_b = self._regs.execute(ra=ra, rb=rb)
-                    result = self._alu.execute(op_a, op_b)
-                    self._regs.execute(rd=rd, data=result, write_enable=True)
-                case "OR":
-                    self._alu.set_op("OR")
-                    rd = self._decoded.rd
-                    ra = self._decoded.ra
-                    rb = self._decoded.rb
-                    op_a, op_b = self._regs.execute(ra=ra, rb=rb)
-                    result = self._alu.execute(op_a, op_b)
-                    self._regs.execute(rd=rd, data=result, write_enable=True)
-                case "SHFT":
-                    self._alu.set_op("SHFT")
-                    rd = self._decoded.rd
-                    ra = self._decoded.ra
-                    rb = self._decoded.rb
-                    op_a, op_b = self._regs.execute(ra=ra, rb=rb)
-                    result = self._alu.execute(op_a, op_b)
-                    self._regs.execute(rd=rd, data=result, write_enable=True)
-                case "BEQ":
-                    if self._alu.zero:
-                        offset = self.sext(self._decoded.imm, 8)
-                        self._pc += offset
-                        
-                case "BNE":
-                    if not self._alu.zero:
-                        offset = self.sext(self._decoded.imm, 8)
-                        self._pc += offset
-                        
-                        
-                case "B":
-                    offset += self.sext(self._decoded.imm, 8)
-                    self._pc += offset # jump to target
-                case "CALL":
-                    self._sp -= 1  # grow stack downward
-                    # PC is incremented immediately upon fetch so already
-                    # pointing to next instruction, which is return address.
-                    ret_addr = self._pc  # explicit
-                    self._d_mem.write_enable(True)
-                    # push return address...
-                    self._d_mem.write(self._sp, ret_addr, from_stack=True)
-                    offset = self._decoded.imm
-                    self._pc += self.sext(offset, 8)  # jump to target
-                case "RET":
-                    # Get return address from memory via SP
-                    # Increment SP
-                    # Update PC
-                    ret_addr = self._d_mem.read(self._sp)
-                    self._sp += 1  # shrink stack upward
-                    self._pc = ret_addr
-                case "HALT":
-                    self._halt = True
-                case _:  # default
-                    raise ValueError(
-                        "Unknown mnemonic: " + str(self._decoded) + "\n" + str(self._ir)
-                    )
-
+            self._execute(1, None)
             return True
         return False
 
+    def run(self, max_cycles=None, until_pc=None):
+        """
+        Run until HALT, until `max_cycles` instructions have executed, or
+        until PC reaches `until_pc` (checked after each instruction, so the
+        instruction at the current PC always executes). This is much faster
+        than calling `tick()` in a loop. Returns a `RunResult`.
+        """
+        if max_cycles is not None and max_cycles < 0:
+            raise ValueError(f"Bad cycle budget: {max_cycles}")
+        execute = self._engine.execute if self._engine else self._execute
+        start = time.perf_counter()
+        cycles, reason = execute(max_cycles, until_pc)
+        return RunResult(cycles, reason, time.perf_counter() - start)
+
+    def _execute(self, max_cycles, until_pc):
+        """
+        The interpreter loop shared by `tick()` and `run()`. Everything used
+        per instruction is hoisted into locals, and PC, SP, IR, and the ALU's
+        flags and operation are only written back on the way out. Returns
+        (cycles, reason).
+
+        ALU operations compute just their result. The last one's operation
+        and operands are kept in `fop`, `fa`, and `fb`, BEQ and BNE test the
+        result for zero, and the full flags are computed once, on exit (or
+        left pending, if the ALU is a `LazyAlu`).
+        """
+        if self._halt:
+            return 0, STOP_HALT
+        if self._program_gen != self._i_mem.generation:
+            self._invalidate_program()
+        lookup = self._predecoded.get
+        predecode_at = self._predecode_at
+        regs = self._regs.registers
+        alu = self._alu
+        results = RESULTS
+        d_mem = self._d_mem
+        sext = self.sext
+        pc = self._pc
+        sp = self._sp
+        ir = self._ir
+        lazy = isinstance(alu, LazyAlu)
+        op = alu._op
+        fop = None  # ALU operation whose flags are pending, if any
+        fa = fb = result = 0
+        if lazy:
+            # Carry a LazyAlu's pending flags through, without forcing them
+            flags = alu._flag_bits
+            if alu._pending is not None:
+                fop, fa, fb = alu._pending
+                result = alu._result
+        else:
+            flags = alu._flags
+        cycles = 0
+        reason = STOP_BUDGET
+        try:
+            while cycles != max_cycles:
+                entry = lookup(pc) or predecode_at(pc)
+                if entry is None:
+                    # Bad zero padding (strict mode only)
+                    ir = self._i_mem.read(pc)
+                    pc += 1
+                    check_padding(ir, pc - 1)
+                mnem, rd, ra, rb, imm, addr, target, ir = entry
+                pc += 1
+                cycles += 1
+
+                # execute...
+                match mnem:
+                    case "LOADI":
+                        regs[rd].value = imm
+                    case "LUI":
+                        # TODO Refactor for future semester(s) if any.
+                        # Cheating for compatibility with released ALU tests
+                        # and starter code. Leave as-is for 2025 Fall.
+                        upper = (imm & 0xFF) << 8
+                        lower = regs[rd].value & 0x00FF  # clear upper bits
+                        regs[rd].value = upper | lower
+                    case "LOAD":
+                        base = regs[ra].value
+                        regs[rd].value = d_mem.read(base + sext(addr))
+                    case "STORE":
+                        offset = imm
+                        data = regs[ra].value
+                        d_mem.write_enable(True)
+                        d_mem.write(regs[rb].value + offset, data)
+                    case "ADDI":
+                        fa, fb = regs[ra].value, imm
+                        result = ((fa + fb + 0x8000) & 0xFFFF) - 0x8000
+                        regs[rd].value = result
+                        fop = op = "ADD"
+                    case "ADD" | "SUB" | "AND" | "OR" | "SHFT":
+                        fa, fb = regs[ra].value, regs[rb].value
+                        result = results[mnem](fa & 0xFFFF, fb & 0xFFFF)
+                        result -= (result & 0x8000) << 1
+                        regs[rd].value = result
+                        fop = op = mnem
+                    case "BEQ":
+                        if result == 0 if fop else flags & Z_FLAG:
+                            pc = target
+                    case "BNE":
+                        if not (result == 0 if fop else flags & Z_FLAG):
+                            pc = target
+                    case "B":
+                        pc = target  # jump to target
+                    case "CALL":
+                        sp -= 1  # grow stack downward
+                        # PC is incremented immediately upon fetch so already
+                        # pointing to next instruction, the return address.
+                        d_mem.write_enable(True)
+                        d_mem.write(sp, pc, from_stack=True)
+                        pc = target  # jump to target
+                    case "RET":
+                        ret_addr = d_mem.read(sp)
+                        sp += 1  # shrink stack upward
+                        pc = ret_addr
+                    case "HALT":
+                        self._halt = True
+                        reason = STOP_HALT
+                        break
+                    case _:  # default
+                        raise ValueError(f"Unknown mnemonic: {mnem}\n{ir}")
+
+                if pc == until_pc:
+                    reason = STOP_BREAKPOINT
+                    break
+        finally:
+            self._pc = pc
+            self._sp = sp
+            self._ir = ir
+            alu._op = op
+            if fop is None:
+                alu._flags = flags
+            elif lazy:
+                alu._pending = (fop, fa, fb)
+                alu._result = result
+            else:
+                alu._flags = self._kernels[fop](fa, fb)[1]
+            self._decoded = None  # built on demand, see `decoded`
+        return cycles, reason
+
+    def _predecode_at(self, addr):
+        """
+        Cache miss: decode the word at `addr` and remember it (in this CPU's
+        own `_misses`, never in a shared image's table). Reading through
+        instruction memory keeps the usual address checks on PC.
+        """
+        entry = self._misses.get(addr)
+        if entry is None:
+            entry = predecode(self._i_mem.read(addr), addr, self._strict)
+            if entry is not None:
+                self._misses[addr] = entry
+        return entry
+
+    def _invalidate_program(self):
+        """
+        Drop all predecoded entries, e.g., after the program is reloaded.
+        A shared `ProgramImage` brings its own, already filled in, which is
+        only read; misses go in a separate dict. Unless in strict mode, an
+        image with bad zero padding raises `DecodeError` (its words were
+        checked once, when it was built).
+        """
+        if isinstance(self._i_mem, ProgramImage):
+            if self._i_mem.bad and not self._strict:
+                raise DecodeError(self._i_mem.bad)
+            self._predecoded = self._i_mem.predecoded
+            self._misses = {}
+        else:
+            self._predecoded = self._misses = {}
+        self._program_gen = self._i_mem.generation
+
     def _decode(self):
         """
         We're effectively delegating decoding to the Instruction class.
         """
-        self._decoded = Instruction(raw=self._ir)
+        self._decoded = decode(self._ir)
 
     def _fetch(self):
-        self._ir = self._i_mem.read(self._pc)
+        if self._program_gen != self._i_mem.generation:
+            self._invalidate_program()
+        entry = self._predecoded.get(self._pc) or self._predecode_at(self._pc)
+        self._ir = entry[-1] if entry else self._i_mem.read(self._pc)
         self._pc += 1
 
     def load_program(self, prog):
-        self._i_mem.load_program(prog)
+        """
+        Load program into instruction memory and predecode every word.
+        Unless in strict mode, raises `DecodeError` listing every word with
+        bad zero padding, and loads nothing.
+        """
+        prog = _as_words(prog)
+        if not self._strict:
+            validate(prog)
+        n = self._i_mem.load_program(prog)
+        self._invalidate_program()
+        for addr in range(n):
+            self._predecode_at(addr)
+
+    def patch_program(self, changes):
+        """
+        Change some words of the loaded program in place (`changes` maps
+        address to word), predecoding just those words again. Checked like
+        `load_program()`.
+        """
+        if not self._strict:
+            bad = [(addr, word) for addr, word in changes.items() if predecode(word, addr) is None]
+            if bad:
+                raise DecodeError(sorted(bad))
+        stale = self._program_gen != self._i_mem.generation
+        self._i_mem.patch(changes)
+        if stale:
+            self._invalidate_program()
+            return
+        self._program_gen = self._i_mem.generation
+        for addr in changes:
+            self._misses.pop(addr, None)
+            self._predecode_at(addr)
+
+    def snapshot(self):
+        """
+        Save the state of the machine: PC, IR, SP, whether halted, the
+        registers, the ALU's flags, and data memory (not the program). Cheap
+        with a `PagedDataMemory`, which shares its pages with the snapshot.
+        """
+        return Snapshot(
+            self._pc,
+            self._ir,
+            self._sp,
+            self._halt,
+            tuple(reg.value for reg in self._regs.registers),
+            self._alu._flags,
+            self._alu._op,
+            self._d_mem.snapshot(),
+        )
+
+    def restore(self, snap):
+        """
+        Go back to the state saved by `snapshot()`. A snapshot can be
+        restored any number of times, e.g., to run several cases from one
+        warmed-up starting point.
+        """
+        self._pc = snap.pc
+        self._ir = snap.ir
+        self._sp = snap.sp
+        self._halt = snap.halt
+        for reg, value in zip(self._regs.registers, snap.registers):
+            reg.value = value
+        self._alu._flags = snap.flags
+        self._alu._op = snap.op
+        if snap.d_mem is not None:
+            self._d_mem.restore(snap.d_mem)
+        self._decoded = None  # built on demand, see `decoded`
 
     @staticmethod
     def sext(value, bits=16):
@@ -208,11 +403,24 @@ class Cpu:
 
 
 # Helper function
-def make_cpu(prog=None):
-    alu = Alu()
-    d_mem = DataMemory()
-    i_mem = InstructionMemory()
-    if prog:
-        i_mem.load_program(prog)
+def make_cpu(prog=None, engine=None, lazy_flags=False, flat_memory=False, strict=False,
+             paged_memory=False):
+    """
+    `prog` may be a `ProgramImage`, which is then shared rather than copied.
+    With `paged_memory`, data memory is a `PagedDataMemory`, for cheap
+    snapshots.
+    """
+    alu = LazyAlu() if lazy_flags else Alu()
+    if paged_memory:
+        d_mem = PagedDataMemory()
+    else:
+        d_mem = FlatDataMemory() if flat_memory else DataMemory()
+    if isinstance(prog, ProgramImage):
+        i_mem, prog = prog, None
+    else:
+        i_mem = FlatInstructionMemory() if flat_memory else InstructionMemory()
     regs = RegisterFile()
-    return Cpu(alu=alu, d_mem=d_mem, i_mem=i_mem, regs=regs)
+    cpu = Cpu(alu=alu, d_mem=d_mem, i_mem=i_mem, regs=regs, engine=engine, strict=strict)
+    if prog:
+        cpu.load_program(prog)
+    return cpu
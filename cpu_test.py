@@ -11,9 +11,9 @@ import pytest
 from alu import Z_FLAG, Alu
 from assembler import assemble
 from constants import STACK_TOP
-from cpu import Cpu, make_cpu
-from instruction_set import Instruction
-from memory import DataMemory, InstructionMemory
+from cpu import STOP_BREAKPOINT, STOP_BUDGET, STOP_HALT, Cpu, make_cpu
+from instruction_set import DecodeError, Instruction
+from memory import DataMemory, InstructionMemory, ProgramImage
 from register_file import RegisterFile
 
 
@@ -91,6 +91,13 @@ def test_decode():
         assert c.decoded.mnem == mnems[i]
 
 
+@pytest.mark.parametrize("r", [-1, 8])
+def test_get_reg_bad_index(r):
+    c = make_cpu()
+    with pytest.raises(IndexError):
+        c.get_reg(r)
+
+
 def test_bne_forward_label():
     """
     Ensure BNE branches correctly on forward label
@@ -688,3 +695,298 @@ def test_and_resets_negative_flag():
     assert not c._alu.negative
     assert not c._alu.carry
     assert not c._alu.overflow
+
+
+def test_program_predecoded_on_load():
+    """
+    Ensure every word is decoded once, at load, and `decoded` still gives us
+    an equivalent `Instruction`
+    """
+    prog = [0x0202, 0x0404, 0x5650, 0x58C8, 0x4B0A, 0xF000]
+    c = make_cpu(prog)
+    assert sorted(c._predecoded) == list(range(len(prog)))  # OK in tests
+    for word in prog:
+        c.tick()
+        assert c.decoded == Instruction(raw=word)
+    assert c.get_reg(5) == 14
+
+
+def test_predecoded_program_invalidated_on_reload():
+    """
+    Ensure reloading instruction memory discards stale predecoded entries
+    """
+    c = make_cpu([0x0202, 0xF000])  # LOADI R1, #1; HALT
+    c._i_mem.load_program([0x0204, 0xF000])  # LOADI R1, #2; HALT
+    c.tick()
+    assert c.get_reg(1) == 2
+    c.load_program([0x0206, 0x0208, 0xF000])
+    assert c._predecoded[1][0] == "LOADI"  # OK to access in tests
+
+
+def test_bad_padding_raises_on_load():
+    """
+    Every word with bad zero padding is reported when the program is loaded
+    """
+    with pytest.raises(DecodeError) as e:
+        make_cpu([0x0202, 0xF001, 0x5A41])  # HALT, ADD with nonzero padding
+    assert e.value.bad == [(1, 0xF001), (2, 0x5A41)]
+    c = make_cpu([0x0202, 0xF000])
+    with pytest.raises(DecodeError):
+        c.patch_program({1: 0xF001})
+    with pytest.raises(DecodeError):
+        make_cpu(ProgramImage([0xF001]))
+    with pytest.raises(DecodeError):
+        Cpu(
+            alu=Alu(),
+            regs=RegisterFile(),
+            d_mem=DataMemory(),
+            i_mem=ProgramImage([0x0202, 0xF001]),
+        )
+
+
+def test_strict_bad_padding_raises_on_fetch():
+    """
+    In strict mode, bad zero padding is reported when the word is fetched,
+    not on load
+    """
+    c = make_cpu([0xF000 | 0x1], strict=True)  # HALT with nonzero padding
+    with pytest.raises(DecodeError):
+        c.tick()
+
+
+def test_unchecked_bad_padding_is_ignored_on_fetch():
+    c = make_cpu([0x0202, 0xF000])
+    c._i_mem.load_program([0x0202, 0xF001])  # OK to access in tests
+    c.run()
+    assert c.get_reg(1) == 1
+    assert not c.running
+
+
+def test_run_until_halt():
+    """
+    Ensure `run()` executes to HALT and reports it
+    """
+    prog = [0x0202, 0x0404, 0x5650, 0x58C8, 0x4B0A, 0xF000]
+    c = make_cpu(prog)
+    result = c.run()
+    assert result.reason == STOP_HALT
+    assert result.cycles == len(prog)
+    assert result.wall_time >= 0
+    assert not c.running
+    assert c.pc == len(prog)
+    assert c.get_reg(5) == 14
+    assert c.decoded.mnem == "HALT"
+    assert c.run().cycles == 0  # already halted
+
+
+def test_run_budget_exhausted():
+    """
+    Ensure a cycle budget stops an infinite loop
+    """
+    c = make_cpu([0x0202, 0xC0FF])  # LOADI R1, #1; LOOP: B LOOP
+    result = c.run(max_cycles=1000)
+    assert result.reason == STOP_BUDGET
+    assert result.cycles == 1000
+    assert c.running
+    assert c.pc == 1
+    with pytest.raises(ValueError):
+        c.run(max_cycles=-1)
+
+
+def test_run_until_pc():
+    """
+    Ensure `run()` stops when PC reaches a breakpoint, and can be resumed
+    """
+    prog = [0x0202, 0x0404, 0x5650, 0x58C8, 0x4B0A, 0xF000]
+    c = make_cpu(prog)
+    result = c.run(until_pc=3)
+    assert result.reason == STOP_BREAKPOINT
+    assert result.cycles == 3
+    assert c.pc == 3
+    assert c.get_reg(3) == 3
+    assert c.get_reg(4) == 0
+    assert c.run(until_pc=3).reason == STOP_HALT  # runs past it
+
+
+def test_run_matches_tick():
+    """
+    Ensure `run()` leaves the CPU in the same state as ticking
+    """
+    prog = assemble(
+        [
+            "LOADI R1, #0xAB",
+            "LUI R1, #0x80",
+            "LOADI R2, #0x10",
+            "STORE R1, [R2 + #0]",
+            "LOAD R3, [R2 + #0]",
+            "SUB R4, R2, R1",
+            "SHFT R5, R2, R2",
+            "CALL FOO",
+            "HALT",
+            "FOO:",
+            "OR R6, R1, R2",
+            "RET",
+        ]
+    )
+    a = make_cpu(prog)
+    b = make_cpu(prog)
+    while a.running:
+        a.tick()
+    b.run()
+    assert (a.pc, a.sp, a.ir) == (b.pc, b.sp, b.ir)
+    assert [a.get_reg(r) for r in range(8)] == [b.get_reg(r) for r in range(8)]
+    assert a._alu._flags == b._alu._flags  # OK to access in tests
+    assert a._d_mem._cells == b._d_mem._cells  # OK to access in tests
+
+
+def test_lazy_flags_same_state():
+    """
+    Ensure a CPU with lazy ALU flags ends up in the same state
+    """
+    # Count R1 down from 5, then HALT. BNE hand-encoded (offset -2).
+    prog = [0x0002, 0x020A, 0x6240, 0xB0FE, 0x5640, 0xF000]
+    a = make_cpu(prog)
+    b = make_cpu(prog, lazy_flags=True)
+    a.run()
+    b.run()
+    assert (a.pc, a.sp, a.ir) == (b.pc, b.sp, b.ir)
+    assert [a.get_reg(r) for r in range(8)] == [b.get_reg(r) for r in range(8)]
+    assert b._alu._pending == ("ADD", 0, 1)  # OK to access in tests
+    assert a._alu._flags == b._alu._flags  # OK to access in tests
+    assert b.get_reg(1) == 0
+
+
+def test_lazy_flags_stay_pending_across_ticks():
+    """
+    Ensure ticking doesn't force a lazy ALU's pending flags
+    """
+    prog = [0x0202, 0x5640, 0x0402, 0xF000]  # LOADI R1; ADD R3, R1, R0; LOADI R2
+    a = make_cpu(prog)
+    b = make_cpu(prog, lazy_flags=True)
+    for _ in range(3):
+        a.tick()
+        b.tick()
+    assert b._alu._pending == ("ADD", 1, 0)  # OK to access in tests
+    assert a._alu._flags == b._alu._flags  # OK to access in tests
+
+
+def test_flat_memory_same_state():
+    """
+    Ensure a CPU with flat memory ends up in the same state
+    """
+    prog = assemble(
+        [
+            "LOADI R1, #0x7F",
+            "LOADI R2, #0x10",
+            "STORE R1, [R2 + #0]",
+            "LOAD R3, [R2 + #0]",
+            "CALL FOO",
+            "HALT",
+            "FOO:",
+            "RET",
+        ]
+    )
+    a = make_cpu(prog)
+    b = make_cpu(prog, flat_memory=True)
+    a.run()
+    b.run()
+    assert (a.pc, a.sp, a.ir) == (b.pc, b.sp, b.ir)
+    assert [a.get_reg(r) for r in range(8)] == [b.get_reg(r) for r in range(8)]
+    assert a._d_mem._cells == b._d_mem._cells  # OK to access in tests
+
+
+def machine_state(c):
+    return (
+        c.pc,
+        c.sp,
+        c.ir,
+        c.running,
+        [c.get_reg(r) for r in range(8)],
+        c._alu._flags,  # OK to access in tests
+        dict(c._d_mem._cells),  # OK to access in tests
+    )
+
+
+@pytest.mark.parametrize("paged", [False, True])
+def test_snapshot_restore(paged):
+    """
+    Ensure a CPU can be forked from a snapshot, as many times as needed
+    """
+    prog = assemble(
+        [
+            "LOADI R1, #0x7F",
+            "LOADI R2, #0x10",
+            "STORE R1, [R2 + #0]",
+            "LOAD R3, [R2 + #0]",
+            "SUB R4, R1, R1",
+            "CALL FOO",
+            "HALT",
+            "FOO:",
+            "RET",
+        ]
+    )
+    c = make_cpu(prog, paged_memory=paged)
+    c.tick()
+    c.tick()
+    start = machine_state(c)
+    snap = c.snapshot()
+    c.run()
+    end = machine_state(c)
+    assert end != start
+    for _ in range(2):
+        c.restore(snap)
+        assert machine_state(c) == start
+        c.run()
+        assert machine_state(c) == end
+    fresh = make_cpu(prog)
+    fresh.run()
+    assert machine_state(fresh) == end
+
+
+def test_shared_program_image_not_written():
+    """
+    Ensure a CPU's cache misses stay out of a shared image's table, so
+    another CPU doesn't pick them up
+    """
+    image = ProgramImage([0x0202, 0xF001])  # HALT with bad zero padding
+    a = make_cpu(image, strict=True)
+    with pytest.raises(DecodeError):
+        a.run()
+    assert 1 not in image.predecoded
+    with pytest.raises(DecodeError):
+        make_cpu(image)
+
+
+def test_shared_program_image():
+    """
+    Ensure CPUs sharing one `ProgramImage` run independently and end up as a
+    CPU with its own copy of the program does.
+    """
+    prog = assemble(
+        [
+            "LOADI R1, #0x7F",
+            "LOADI R2, #0x10",
+            "STORE R1, [R2 + #0]",
+            "LOAD R3, [R2 + #0]",
+            "CALL FOO",
+            "HALT",
+            "FOO:",
+            "RET",
+        ]
+    )
+    image = ProgramImage(prog)
+    a = make_cpu(prog)
+    b = make_cpu(image)
+    c = make_cpu(image, flat_memory=True)
+    assert b._i_mem is c._i_mem is image  # OK to access in tests
+    assert b._predecoded is c._predecoded is image.predecoded
+    a.run()
+    b.run(max_cycles=3)
+    assert b.pc == 3 and c.pc == 0  # nothing shared but the program
+    b.run()
+    c.run()
+    for cpu in (b, c):
+        assert (a.pc, a.sp, a.ir) == (cpu.pc, cpu.sp, cpu.ir)
+        assert [a.get_reg(r) for r in range(8)] == [cpu.get_reg(r) for r in range(8)]
+    with pytest.raises(RuntimeError):
+        b.load_program(prog)
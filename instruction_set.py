@@ -20,6 +20,16 @@ v. 1.0.3 2025-11-11
     - Fixed operands for LOAD/STORE
 v. 1.0.4 2025-11-13
     - Picking nits, improving descriptions
+v. 1.1.0 2026-10-17
+    - `Instruction` is frozen and slotted; `decode()` returns a shared
+    `Instruction` for any word, decoding each word at most once.
+v. 1.2.0 2026-10-17
+    - Decoding no longer checks zero padding (no assertion, no printing);
+    `validate()` checks a whole program at once, and `check_padding()` one
+    word, raising `DecodeError`.
+v. 1.2.1 2026-10-18
+    - `predecode()` and `Instruction` extract fields with the same function,
+    `_fields()`.
 """
 
 from dataclasses import dataclass  # For Instruction class, below.
@@ -253,6 +263,36 @@ ISA = {
 # Reverse map for opcode lookup
 OPCODE_MAP = {v["opcode"]: k for k, v in ISA.items()}
 
+# Format by mnemonic
+FORMATS = {k: v["format"] for k, v in ISA.items()}
+
+# Zero padding bits, by opcode (the low bits that must be zero)
+PADDING = tuple(
+    {"ADD": 0x7, "SUB": 0x7, "AND": 0x7, "OR": 0x7, "SHFT": 0x7,
+     "LOADI": 0x1, "LUI": 0x1, "CALL": 0xF, "RET": 0xFFF, "HALT": 0xFFF
+     }.get(OPCODE_MAP[opcode], 0)
+    for opcode in range(16)
+)
+
+
+class DecodeError(ValueError):
+    """
+    Words with bad zero padding. `bad` lists `(address, word)` for every
+    one of them, so a whole program can be reported at once.
+    """
+
+    def __init__(self, bad):
+        self.bad = list(bad)
+        lines = [
+            f"  {addr:#06x}: {word:04X} ({OPCODE_MAP[(word >> 12) & 0xF]}, "
+            f"{word:016b})"
+            for addr, word in self.bad
+        ]
+        super().__init__(
+            f"Bad zero padding in {len(self.bad)} word(s). "
+            "Problem with decoding? Or assembler bug?\n" + "\n".join(lines)
+        )
+
 
 def get_instruction_spec(key):
     """
@@ -264,7 +304,80 @@ def get_instruction_spec(key):
     return ISA[OPCODE_MAP[key]]  # if it's not a str, assume it's an int
 
 
-@dataclass
+def _fields(word):
+    """
+    Fields of a 16-bit word, as a dict keyed by `Instruction` field name.
+    Only the fields the word's format has are included (plus `opcode`,
+    `mnem`, `zero`, and `raw`).
+    """
+    f = {"opcode": (word >> 12) & 0xF}
+    f["mnem"] = mnem = OPCODE_MAP.get(f["opcode"], "???")
+    fmt = FORMATS.get(mnem)
+    if fmt == "R":
+        f["rd"] = (word >> 9) & 0x7
+        f["ra"] = (word >> 6) & 0x7
+        f["rb"] = (word >> 3) & 0x7
+        f["zero"] = word & 0x7  # 4-bit zero padding
+    elif mnem in ("LOADI", "LUI"):
+        f["rd"] = (word >> 9) & 0x7
+        f["imm"] = (word >> 1) & 0xFF  # fixed 2025-10-31
+        f["zero"] = word & 1  # 1-bit zero padding
+    elif mnem == "ADDI":
+        f["rd"] = (word >> 9) & 0x7
+        f["ra"] = (word >> 6) & 0x7
+        f["imm"] = word & 0x3F
+        f["zero"] = 0  # no zero padding
+    elif fmt == "M":
+        # Fixed order of operands 2025-11-11. Students need to know.
+        if mnem == "STORE":
+            f["ra"] = (word >> 9) & 0x7  # source/data register
+            f["rb"] = (word >> 6) & 0x7  # base register
+        else:  # LOAD
+            f["rd"] = (word >> 9) & 0x7  # destination register
+            f["ra"] = (word >> 6) & 0x7  # base register
+        f["addr"] = word & 0x3F  # 63 (6 bits)
+        f["zero"] = 0  # no zero padding
+    elif mnem == "CALL":  # added 2025-10-31
+        f["imm"] = (word >> 4) & 0xFF  # TODO: Should be labeled `offset`.
+        f["zero"] = word & 0xF  # 4-bit zero padding
+    elif mnem in ("RET", "HALT"):  # added 2025-10-31
+        f["zero"] = word & 0xFFF  # 12-bit zero padding
+    elif fmt == "B":  # B, BEQ, BNE
+        f["imm"] = word & 0xFF  # fixed 2025-11-09
+        f["zero"] = 0
+    else:
+        raise ValueError(f"Unhandled instruction {mnem}")
+    f["raw"] = word
+    return f
+
+
+def predecode(word, pc, strict=True):
+    """
+    Decode a 16-bit word, once, into a compact tuple for the CPU:
+
+        (mnem, rd, ra, rb, imm, addr, target, raw)
+
+    Fields come from `_fields()`, as `Instruction`'s do. `target` is
+    the resolved destination of BEQ, BNE, B, and CALL for a word stored at
+    address `pc` (PC after fetch plus signextend(imm8)); it is `None` for
+    everything else. Returns `None` if the zero padding is bad, so callers can
+    fall back to `check_padding()` for diagnostics, unless `strict` is false,
+    in which case padding is ignored.
+    """
+    f = _fields(word)
+    mnem = f["mnem"]
+    imm = f.get("imm", 0)
+    target = None
+    if mnem in ("BEQ", "BNE", "B", "CALL"):
+        target = pc + 1 + (imm & 0x7F) - (imm & 0x80)
+    if f["zero"] and strict:
+        return None
+    get = f.get
+    rd, ra, rb, addr = get("rd", 0), get("ra", 0), get("rb", 0), get("addr", 0)
+    return (mnem, rd, ra, rb, imm, addr, target, word)
+
+
+@dataclass(frozen=True, slots=True)
 class Instruction:  # pylint: disable=too-many-instance-attributes
     """
     Represents a single decoded instruction for the Catamount
@@ -279,6 +392,12 @@ class Instruction:  # pylint: disable=too-many-instance-attributes
     i.opcode       # gets us the opcode of instruction i
     i.rd           # gets us the destination register of instruction i
     etc.
+
+    Instructions are immutable (and have no `__dict__`), so one decoded
+    instruction can be shared; see `decode()`.
+
+    Decoding doesn't check zero padding; `zero` holds whatever was there.
+    See `validate()` and `check_padding()`.
     """
 
     # Defaults (constructor is implicit)
@@ -302,70 +421,24 @@ class Instruction:  # pylint: disable=too-many-instance-attributes
         if self.raw is not None:  # fixed 2025-11-12 was: if self.raw
             self._decode_from_word(self.raw)
         if not self.mnem and self.opcode:
-            self.mnem = OPCODE_MAP.get(self.opcode, "???")
+            object.__setattr__(self, "mnem", OPCODE_MAP.get(self.opcode, "???"))
         if not self.opcode and self.mnem:
-            self.opcode = ISA[self.mnem]["opcode"]
+            object.__setattr__(self, "opcode", ISA[self.mnem]["opcode"])
 
     @property
     def format(self):
         """
         Get the instruction format.
         """
-        spec = ISA.get(self.mnem)
-        if not spec:
-            return None
-        return spec["format"]
+        return FORMATS.get(self.mnem)
 
     def _decode_from_word(self, word):
         """
-        Self-decode instruction from 16-bit word.
+        Self-decode instruction from 16-bit word, with `_fields()`.
+        (Frozen: fields are set with `object.__setattr__`.)
         """
-        self.opcode = (word >> 12) & 0xF
-        self.mnem = OPCODE_MAP.get(self.opcode, "???")
-        fmt = self.format
-        if fmt == "R":
-            self.rd = (word >> 9) & 0x7
-            self.ra = (word >> 6) & 0x7
-            self.rb = (word >> 3) & 0x7
-            self.zero = word & 0x7  # 4-bit zero padding
-        elif self.mnem in ("LOADI", "LUI"):
-            self.rd = (word >> 9) & 0x7
-            self.imm = (word >> 1) & 0xFF  # fixed 2025-10-31
-            self.zero = word & 1  # 1-bit zero padding
-        elif self.mnem == "ADDI":
-            self.rd = (word >> 9) & 0x7
-            self.ra = (word >> 6) & 0x7
-            self.imm = word & 0x3F
-            self.zero = 0  # no zero padding
-        elif fmt == "M":
-            # Fixed order of operands 2025-11-11. Students need to know.
-            if self.mnem == "STORE":
-                self.ra = (word >> 9) & 0x7  # source/data register
-                self.rb = (word >> 6) & 0x7  # base register
-            else:  # LOAD
-                self.rd = (word >> 9) & 0x7  # destination register
-                self.ra = (word >> 6) & 0x7  # base register
-            self.addr = word & 0x3F  # 63 (6 bits)
-            self.zero = 0  # no zero padding
-        elif self.mnem == "CALL":  # added 2025-10-31
-            self.imm = (word >> 4) & 0xFF  # TODO: Should be labeled `offset`.
-            self.zero = word & 0xF  # 4-bit zero padding
-        elif self.mnem in ("RET", "HALT"):  # added 2025-10-31
-            self.zero = word & 0xFFF  # 12-bit zero padding
-        elif fmt == "B":  # B, BEQ, BNE
-            self.imm = word & 0xFF  # fixed 2025-11-09
-            self.zero = 0
-        else:
-            raise ValueError(f"Unhandled instruction {self.mnem}")
-        self.raw = word
-        try:  # added 2025-10-31
-            assert self.zero == 0
-        except AssertionError:
-            print(f"BAD zero padding on {self.mnem}!")
-            print(f"Raw word (hex): {word:04X}")
-            print(f"Raw word (bin): {word:16b}")
-            print("Problem with decoding? Or assembler bug?")
-            raise
+        for name, value in _fields(word).items():
+            object.__setattr__(self, name, value)
 
     @property
     def raw_bin(self):  # added 2025-11-02
@@ -411,3 +484,42 @@ class Instruction:  # pylint: disable=too-many-instance-attributes
             s += f"imm=0x{self.imm:02X}, zero=0x{self.zero:01X}, "
         s += f"raw_hex={self.raw_hex}, raw_bin={self.raw_bin})"
         return s
+
+
+# Shared decoded instructions by raw word, filled in as words are seen
+_DECODED = [None] * 0x10000
+
+
+def decode(word):
+    """
+    The `Instruction` for 16-bit `word`. Each word is decoded the first time
+    it is asked for; after that this is a single list index, returning the
+    same (immutable) `Instruction`. Only words actually decoded take up
+    memory, beyond the list itself. Zero padding is not checked.
+    """
+    inst = _DECODED[word]
+    if inst is None:
+        inst = _DECODED[word] = Instruction(raw=word)
+    return inst
+
+
+def check_padding(word, addr):
+    """
+    Raise `DecodeError` if `word`, at address `addr`, has bad zero padding.
+    """
+    if word & PADDING[word >> 12]:
+        raise DecodeError([(addr, word)])
+
+
+def validate(words, start=0):
+    """
+    Check the zero padding of every word of a program loaded at `start`,
+    raising one `DecodeError` that lists all bad words, if any.
+    """
+    bad = [
+        (addr, word)
+        for addr, word in enumerate(words, start)
+        if word & PADDING[(word >> 12) & 0xF]
+    ]
+    if bad:
+        raise DecodeError(bad)
@@ -5,9 +5,22 @@ CS 2210 Computer Organization
 Clayton Cafiero <cbcafier@uvm.edu>
 """
 
+import dataclasses
+import tracemalloc
+
 import pytest
 
-from instruction_set import ISA, OPCODE_MAP, Instruction, get_instruction_spec
+from instruction_set import (
+    ISA,
+    OPCODE_MAP,
+    DecodeError,
+    Instruction,
+    check_padding,
+    decode,
+    get_instruction_spec,
+    predecode,
+    validate,
+)
 
 
 def test_get_instruction_spec_basic():
@@ -64,3 +77,79 @@ def test_repr_contains_fields():
     assert "ADDI" in s
     assert "raw_hex=" in s
     assert "raw_bin=" in s
+
+
+@pytest.mark.parametrize(
+    "raw,pc,target",
+    [
+        (0xA404, 0, 5),  # BEQ +4
+        (0xB0FA, 10, 5),  # BNE -6
+        (0xC0FF, 3, 3),  # B -1 (self loop)
+        (0xD010, 1, 3),  # CALL +1
+        (0x5488, 7, None),  # ADD
+    ],
+)
+def test_predecode_resolves_branch_targets(raw, pc, target):
+    entry = predecode(raw, pc)
+    i = Instruction(raw=raw)
+    assert entry[:6] == (i.mnem, i.rd, i.ra, i.rb, i.imm, i.addr)
+    assert entry[6] == target
+    assert entry[7] == raw
+
+
+def test_predecode_rejects_bad_padding():
+    assert predecode(0xF001, 0) is None
+
+
+def test_instructions_are_immutable():
+    i = Instruction(raw=0x5A40)
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        i.rd = 1
+    assert not hasattr(i, "__dict__")
+
+
+def test_decode_shares_one_instruction_per_word():
+    assert decode(0x5A40) is decode(0x5A40)
+    assert decode(0x5A40) == Instruction(raw=0x5A40)
+    assert decode(0x5A40).mnem == "ADD"
+    assert decode(0x0000) == Instruction()
+
+
+def test_decode_does_not_check_padding(capsys):
+    i = decode(0xF001)  # HALT with a stray bit
+    assert i.mnem == "HALT"
+    assert i.zero == 1
+    assert capsys.readouterr().out == ""
+
+
+def test_predecode_can_ignore_padding():
+    assert predecode(0xF001, 0, strict=False)[0] == "HALT"
+
+
+def test_check_padding():
+    check_padding(0xF000, 0)
+    with pytest.raises(DecodeError) as e:
+        check_padding(0xF001, 7)
+    assert e.value.bad == [(7, 0xF001)]
+
+
+def test_validate_reports_all_bad_words():
+    validate([0x0202, 0x5A40, 0xF000])
+    with pytest.raises(DecodeError) as e:
+        # LOADI, ADD, CALL, HALT with stray bits; ADDI and LOAD have none
+        validate([0x0203, 0x5A41, 0x4FFF, 0xD001, 0x2FFF, 0xF800], start=0x10)
+    assert e.value.bad == [(0x10, 0x0203), (0x11, 0x5A41), (0x13, 0xD001), (0x15, 0xF800)]
+    assert "0x0015: F800 (HALT" in str(e.value)
+
+
+def test_decode_table_memory_is_bounded():
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for word in range(0x10000):
+            decode(word)
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    # Every word decoded: well under 200 bytes apiece
+    assert used < 0x10000 * 200
@@ -0,0 +1,379 @@
+"""
+Dynamic block JIT for the Catamount Processing Unit.
+
+The engine counts how often each basic block (see `threaded.py`) is
+entered. Cold blocks are run by the reference interpreter. Once a block has
+been entered more than `threshold` times it is translated into straight-line
+Python source, compiled with the built-in `compile()`, and cached by entry
+PC. The generated function keeps R0-R7, SP, and the ALU flags in local
+variables and writes them back to the `RegisterFile`, `Alu`, and `Cpu` when
+the block exits (normally or by raising). A block whose terminator branches
+back to its own entry becomes a `while` loop, so a tight loop runs without
+returning to the engine at all.
+
+Flags are computed exactly as `Alu._update_arith_flags_add`,
+`_update_logic_flags`, and `_update_shift_flags` compute them, but only for
+an ALU operation whose flags can be observed: the last one in the block, or
+one followed by a load, store, CALL, or RET (which may fault and leave the
+machine visible to the caller). Every other ALU operation only computes its
+result. Results are identical to the interpreter.
+
+Usage:
+
+    c = make_cpu(prog, engine=JitEngine)
+    c.run()
+    print(c._engine.stats)
+
+To choose a different threshold, pass e.g.
+`functools.partial(JitEngine, threshold=0)` as the engine.
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import time
+from dataclasses import dataclass, field
+
+from cpu import STOP_BREAKPOINT, STOP_BUDGET, STOP_HALT, Cpu
+from threaded import ALU_OPS, FAULTING, MAX_BLOCK, TERMINATORS, observed_flags
+
+HOT_THRESHOLD = 16  # block entries before a block is compiled
+
+
+@dataclass
+class JitStats:
+    """
+    What the JIT has done so far.
+    """
+
+    blocks_compiled: int = 0
+    compile_time: float = 0.0  # seconds spent generating and compiling
+    hits: dict = field(default_factory=dict)  # entry PC -> compiled runs
+
+
+def _alu_lines(mnem, rd, a, b, with_flags):
+    """
+    Source lines for one ALU operation. `a` and `b` are expressions for the
+    operands. If `with_flags`, also set `flags` and `op` as `Alu.execute`
+    would leave `_flags` and `_op`.
+    """
+    op = "ADD" if mnem == "ADDI" else mnem
+    if mnem == "SHFT":
+        lines = [f"r{rd}, fl = _shft({a}, {b})"]
+        return lines + ["flags = fl", "op = 'SHFT'"] if with_flags else lines
+    if not with_flags:
+        expr = {
+            "ADDI": f"{a} + {b}",
+            "ADD": f"{a} + {b}",
+            "SUB": f"{a} - {b}",
+            "AND": f"{a} & {b}",
+            "OR": f"{a} | {b}",
+        }[mnem]
+        return [f"r{rd} = ((({expr}) + 0x8000) & 0xFFFF) - 0x8000"]
+
+    lines = [f"a = {a} & 0xFFFF", f"b = {b} & 0xFFFF"]
+    if op in ("ADD", "SUB"):
+        if op == "SUB":
+            lines.append("b = -b & 0xFFFF")  # two's complement, as `_sub`
+        lines += [
+            "s = a + b",
+            "t = s & 0xFFFF",
+            "flags = ((t >> 12) & 8) | (4 if t == 0 else 0)"
+            " | (2 if s > 0xFFFF else 0)"
+            " | (1 if ~(a ^ b) & (a ^ t) & 0x8000 else 0)",
+        ]
+    else:
+        lines += [
+            f"t = a {'&' if op == 'AND' else '|'} b",
+            "flags = ((t >> 12) & 8) | (4 if t == 0 else 0)",
+        ]
+    return lines + [f"op = {op!r}", f"r{rd} = (t ^ 0x8000) - 0x8000"]
+
+
+def body_source(entries, base=0):
+    """
+    Source lines for the non-branch instructions in predecoded `entries`
+    (a basic block, possibly ending with its terminator). Registers are
+    locals `r0`-`r7`. Before any instruction that may fault, `i` is set to
+    `base` plus the instruction's index in the block.
+
+    Flags (and `op`) are only materialized for ALU operations whose flags
+    can be observed: the last one in the block, and any followed by a
+    faulting instruction before the next ALU operation.
+    """
+    need_flags = observed_flags(entries)
+    lines = []
+    for i, (mnem, rd, ra, rb, imm, addr, _, _) in enumerate(entries):
+        if mnem in TERMINATORS:
+            break
+        if mnem in FAULTING:
+            lines.append(f"i = {base + i}")
+        match mnem:
+            case "LOADI":
+                lines.append(f"r{rd} = {imm}")
+            case "LUI":
+                lines.append(f"r{rd} = {(imm & 0xFF) << 8} | (r{rd} & 0x00FF)")
+            case "LOAD":
+                lines.append(f"r{rd} = _read(r{ra} + {Cpu.sext(addr)})")
+            case "STORE":
+                lines.append("_write_enable(True)")
+                lines.append(f"_write(r{rb} + {imm}, r{ra})")
+            case "ADDI":
+                lines += _alu_lines(mnem, rd, f"r{ra}", imm, i in need_flags)
+            case _:
+                lines += _alu_lines(
+                    mnem, rd, f"r{ra}", f"r{rb}", i in need_flags
+                )
+    return lines
+
+
+def generate(entries, entry_pc):
+    """
+    Generate Python source for the block made of predecoded `entries`
+    starting at `entry_pc`. The source defines `block(limit)`, returning
+    (next PC, times the block ran). `limit` only matters for blocks that
+    loop back to their own entry: they stop after `limit` runs (never, if
+    `limit` is negative).
+    """
+    term = entries[-1] if entries[-1][0] in TERMINATORS else None
+    body = entries[:-1] if term else entries
+    nxt = entry_pc + len(entries)
+    loops = term is not None and term[6] == entry_pc and term[0] != "CALL"
+
+    # Registers read or written, and registers written
+    used, written = set(), set()
+    for mnem, rd, ra, rb, *_ in body:
+        if mnem in ("LOADI", "LUI", "LOAD") or mnem in ALU_OPS:
+            written.add(rd)
+        if mnem in ("LOAD", "STORE") or mnem in ALU_OPS:
+            used.add(ra)
+        if mnem in ("STORE", "ADD", "SUB", "AND", "OR", "SHFT"):
+            used.add(rb)
+    used |= written  # loaded too, so a fault writes back what we had
+
+    lines = body_source(entries)
+
+    if term is None:
+        lines.append(f"return {nxt}, 1")
+    else:
+        mnem, target = term[0], term[6]
+        if term[0] in FAULTING:
+            lines.append(f"i = {len(body)}")
+        if loops:
+            lines.append("k += 1")
+            cond = {"BEQ": "flags & 4", "BNE": "not flags & 4", "B": "True"}
+            lines += [
+                f"if {cond[mnem]}:",
+                "    if k != limit:",
+                "        continue",
+                f"    return {target}, k",
+                f"return {nxt}, k",
+            ]
+        else:
+            match mnem:
+                case "BEQ":
+                    lines.append(f"return ({target} if flags & 4 else {nxt}), 1")
+                case "BNE":
+                    lines.append(f"return ({nxt} if flags & 4 else {target}), 1")
+                case "B":
+                    lines.append(f"return {target}, 1")
+                case "CALL":
+                    lines += [
+                        "sp -= 1",
+                        "_write_enable(True)",
+                        f"_write(sp, {nxt}, from_stack=True)",
+                        f"return {target}, 1",
+                    ]
+                case "RET":
+                    lines += ["ret = _read(sp)", "sp += 1", "return ret, 1"]
+                case "HALT":
+                    lines += ["_cpu._halt = True", f"return {nxt}, 1"]
+
+    src = ["def block(limit):"]
+    src += [f"    r{r} = _R{r}.value" for r in sorted(used)]
+    src += ["    flags = _alu._flags", "    op = _alu._op", "    sp = _cpu._sp"]
+    src += ["    i = 0", "    k = 0", "    try:"]
+    indent = "        "
+    if loops:
+        src.append(indent + "while True:")
+        indent += "    "
+    src += [indent + line for line in lines]
+    src += [
+        "    except BaseException:",
+        "        # Leave PC and IR as the interpreter would have on the",
+        "        # faulting instruction.",
+        f"        _cpu._pc = {entry_pc + 1} + i",
+        "        _cpu._ir = _words[i]",
+        "        raise",
+        "    finally:",
+    ]
+    src += [f"        _R{r}.value = r{r}" for r in sorted(written)]
+    src += [
+        "        _alu._flags = flags",
+        "        _alu._op = op",
+        "        _cpu._sp = sp",
+    ]
+    return "\n".join(src) + "\n"
+
+
+class CompiledBlock:
+    """
+    A basic block compiled to a Python function.
+    """
+
+    def __init__(self, entry, size, words, source, run):
+        self.entry = entry  # address of first instruction
+        self.size = size  # instructions (cycles) per run of the block
+        self.end = entry + size  # address after last instruction
+        self.words = words  # raw words, for IR (includes terminator)
+        self.source = source  # generated Python source
+        self.run = run  # run(limit) -> (next PC, runs)
+        self.loops = "while True:" in source
+
+
+class JitEngine:
+    """
+    Runs a `Cpu`, compiling hot basic blocks to Python. Pass the class as
+    `engine` to `Cpu` or `make_cpu`; it is instantiated once per CPU, and
+    its caches are dropped whenever the program is reloaded.
+    """
+
+    def __init__(self, cpu, threshold=HOT_THRESHOLD):
+        self._cpu = cpu
+        self.threshold = threshold
+        self.stats = JitStats()
+        self._sizes = {}  # entry PC -> block size, for cold blocks
+        self._counts = {}  # entry PC -> entries while cold
+        self._compiled = {}  # entry PC -> CompiledBlock
+        self._program_gen = None
+
+    def _scan(self, pc):
+        """
+        Predecoded entries of the block starting at `pc`, up to and
+        including its terminator. Empty if `pc` can't be translated.
+        """
+        cpu = self._cpu
+        entries = []
+        addr = pc
+        while addr - pc < MAX_BLOCK:
+            try:
+                entry = cpu._predecoded.get(addr) or cpu._predecode_at(addr)
+            except ValueError:  # ran off the end of instruction memory
+                entry = None
+            if entry is None:
+                break
+            entries.append(entry)
+            addr += 1
+            if entry[0] in TERMINATORS:
+                break
+        return entries
+
+    def compile(self, pc):
+        """
+        Compile the block starting at `pc`, or return `None` if the
+        instruction at `pc` can't be translated.
+        """
+        start = time.perf_counter()
+        entries = self._scan(pc)
+        if not entries:
+            return None
+        cpu = self._cpu
+        source = generate(entries, pc)
+        namespace = {
+            "_cpu": cpu,
+            "_alu": cpu._alu,
+            "_read": cpu._d_mem.read,
+            "_write": cpu._d_mem.write,
+            "_write_enable": cpu._d_mem.write_enable,
+            "_shft": cpu._kernels["SHFT"],
+            "_words": [entry[-1] for entry in entries],
+        }
+        for r, reg in enumerate(cpu._regs.registers):
+            namespace[f"_R{r}"] = reg
+        code = compile(source, f"<jit block {pc:04X}>", "exec")
+        exec(code, namespace)  # pylint: disable=exec-used
+        block = CompiledBlock(
+            pc, len(entries), namespace["_words"], source, namespace["block"]
+        )
+        self._compiled[pc] = block
+        self.stats.blocks_compiled += 1
+        self.stats.compile_time += time.perf_counter() - start
+        return block
+
+    def execute(self, max_cycles, until_pc):
+        """
+        Same contract as `Cpu._execute`: returns (cycles, reason).
+        """
+        cpu = self._cpu
+        if cpu._halt:
+            return 0, STOP_HALT
+        if self._program_gen != cpu._i_mem.generation:
+            if cpu._program_gen != cpu._i_mem.generation:
+                cpu._invalidate_program()
+            self._sizes = {}
+            self._counts = {}
+            self._compiled = {}
+            self._program_gen = cpu._i_mem.generation
+        compiled = self._compiled
+        counts = self._counts
+        sizes = self._sizes
+        hits = self.stats.hits
+        interpret = cpu._execute
+        threshold = self.threshold
+        pc = cpu._pc
+        cycles = 0
+        while cycles != max_cycles:
+            remaining = -1 if max_cycles is None else max_cycles - cycles
+            block = compiled.get(pc)
+            if block is None:
+                count = counts.get(pc, 0) + 1
+                counts[pc] = count
+                if count > threshold:
+                    block = self.compile(pc)
+            if block is not None and until_pc is not None:
+                if block.entry < until_pc < block.end:
+                    block = None  # breakpoint partway through the block
+            if block is not None and 0 <= remaining < block.size:
+                block = None  # budget runs out partway through the block
+
+            if block is None:
+                # Cold, untranslatable, or we need to stop partway through.
+                # The interpreter runs (at most) one block's worth.
+                size = sizes.get(pc)
+                if size is None:
+                    size = sizes[pc] = max(len(self._scan(pc)), 1)
+                if 0 <= remaining < size:
+                    size = remaining
+                cpu._pc = pc
+                n, reason = interpret(size, until_pc)
+                cycles += n
+                if reason != STOP_BUDGET:
+                    return cycles, reason
+                pc = cpu._pc
+                continue
+
+            limit = -1
+            if block.loops:
+                if remaining >= 0:
+                    limit = remaining // block.size
+                if until_pc == block.entry:
+                    limit = 1
+            try:
+                pc, runs = block.run(limit)
+            finally:
+                cpu._decoded = None
+            hits[block.entry] = hits.get(block.entry, 0) + 1
+            cpu._ir = block.words[-1]
+            cycles += runs * block.size
+            if cpu._halt:
+                reason = STOP_HALT
+                break
+            if pc == until_pc:
+                reason = STOP_BREAKPOINT
+                break
+        else:
+            reason = STOP_BUDGET
+
+        cpu._pc = pc
+        cpu._decoded = None
+        return cycles, reason
@@ -0,0 +1,92 @@
+"""
+Tests for the dynamic block JIT. The reference interpreter (`Cpu._execute`)
+is the oracle: both must leave the machine in exactly the same state.
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import random
+from functools import partial
+
+import pytest
+
+from cpu import STOP_BREAKPOINT, STOP_BUDGET, STOP_HALT, make_cpu
+from jit import JitEngine
+from threaded_test import GAUSS, random_program, state
+
+EAGER = partial(JitEngine, threshold=0)  # compile everything at once
+
+
+def run_both(prog, engine=EAGER, **kwargs):
+    """
+    Run `prog` on the interpreter and the JIT; return results.
+    """
+    results = []
+    for eng in (None, engine):
+        c = make_cpu(prog, engine=eng)
+        try:
+            outcome = c.run(**kwargs)
+            outcome = (outcome.cycles, outcome.reason)
+        except (ValueError, RuntimeError) as e:
+            outcome = type(e)
+        results.append((outcome, state(c)))
+    return results
+
+
+@pytest.mark.parametrize("engine", [EAGER, JitEngine])
+def test_gauss_matches_interpreter(engine):
+    ref, jitted = run_both(GAUSS, engine=engine)
+    assert ref == jitted
+    assert jitted[0] == (402, STOP_HALT)
+    assert jitted[1][4][2] == 5050
+
+
+@pytest.mark.parametrize("budget", [0, 1, 5, 6, 7, 8, 12, 100, 401])
+def test_budget(budget):
+    ref, jitted = run_both(GAUSS, max_cycles=budget)
+    assert ref == jitted
+    assert jitted[0] == (budget, STOP_BUDGET)
+
+
+@pytest.mark.parametrize("until_pc", [2, 4, 5, 7, 8, 9])
+def test_breakpoint(until_pc):
+    ref, jitted = run_both(GAUSS, until_pc=until_pc)
+    assert ref == jitted
+    assert jitted[0][1] == STOP_BREAKPOINT
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_programs_match_interpreter(seed):
+    rng = random.Random(seed)
+    prog = random_program(rng, rng.randrange(4, 40))
+    ref, jitted = run_both(prog, max_cycles=500)
+    assert ref == jitted
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_programs_warm_up(seed):
+    rng = random.Random(seed)
+    prog = random_program(rng, rng.randrange(4, 40))
+    ref, jitted = run_both(prog, engine=partial(JitEngine, threshold=3),
+                           max_cycles=500)
+    assert ref == jitted
+
+
+def test_stats():
+    c = make_cpu(GAUSS, engine=JitEngine)
+    c.run()
+    stats = c._engine.stats  # OK to access in tests
+    assert stats.blocks_compiled == 1  # only the loop gets hot
+    assert stats.compile_time > 0
+    assert stats.hits == {4: 1}  # the whole loop ran in one call
+
+
+def test_blocks_recompiled_after_reload():
+    c = make_cpu([0x0202, 0xF000], engine=EAGER)
+    c.run()
+    c.load_program([0x0204, 0xF000])
+    c._pc = 0  # OK to access in tests
+    c._halt = False  # OK to access in tests
+    c.run()
+    assert c.get_reg(1) == 2
@@ -0,0 +1,174 @@
+"""
+Separate compilation and linking, for programs built from several source
+files (say, a main program and a library of subroutines).
+
+Each source file is assembled on its own into a `Module`. A label is local
+to its module unless the module exports it with a `.global` line:
+
+    .global GCD
+    GCD:
+        ...
+        RET
+
+A branch or CALL to a label the module doesn't define is left for the
+linker, as a relocation. `link()` lays the modules out one after another
+(the first one starts at address 0, where the CPU starts), and fills in
+those offsets from the exported labels. Since offsets are PC-relative,
+nothing else in a module changes when it moves, so linking is one pass
+over the words, and only modules whose source changed need assembling
+again (see `build()`).
+
+Modules are saved as object files (see `objfile`) marked as modules, with
+suffix `.o` rather than `.obj`, so they never get mixed up with whole
+programs assembled by `objfile.build()` or `asmbatch`.
+
+    prog, symbols = link_files(["main.asm", "gcd.asm"])
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import os
+from dataclasses import dataclass, field
+
+from assembler import _encode_line, _strip
+from objfile import ObjectFile, write_object
+
+SUFFIX = ".o"  # not objfile's ".obj": a module is not a whole program
+
+
+@dataclass
+class Module:
+    """
+    One assembled source file. `exports` maps exported labels to their
+    offset in the module; `relocations` lists `(offset, symbol, shift)` for
+    each branch or CALL to a symbol defined elsewhere.
+    """
+
+    words: list
+    exports: dict = field(default_factory=dict)
+    relocations: list = field(default_factory=list)
+    line_map: list = None
+
+
+def assemble_module(lines):
+    """
+    Assemble one source file into a `Module`.
+    """
+    exports = []
+    entries = []
+    nums = []
+    for num, raw in enumerate(lines, 1):
+        line = _strip(raw)
+        if line.startswith(".global"):
+            exports += line[len(".global"):].replace(",", " ").split()
+            continue
+        entries.append(_encode_line(line))
+        nums.append(num)
+
+    labels = {}
+    pc = 0
+    for entry in entries:
+        if isinstance(entry, str):
+            if entry in labels:
+                raise ValueError(f"Duplicate label: {entry}")
+            labels[entry] = pc
+        elif entry is not None:
+            pc += 1
+
+    words = []
+    line_map = []
+    relocations = []
+    for entry, num in zip(entries, nums):
+        if not isinstance(entry, tuple):
+            continue
+        word, label, shift = entry
+        pc = len(words)
+        if label in labels:
+            word |= ((labels[label] - pc - 1) & 0xFF) << shift
+        elif label is not None:
+            relocations.append((pc, label, shift))
+        words.append(word)
+        line_map.append(num)
+
+    for name in exports:
+        if name not in labels:
+            raise ValueError(f"Exported label {name} is not defined")
+    return Module(words, {name: labels[name] for name in exports}, relocations, line_map)
+
+
+def save_module(path, module):
+    """
+    Write `module` to an object file.
+    """
+    write_object(path, module.words, module.exports, module.line_map, module.relocations,
+                 module=True)
+
+
+def load_module(path):
+    """
+    Read a `Module` from an object file. Raises `ValueError` for an object
+    file that isn't a module.
+    """
+    with ObjectFile(path) as obj:
+        if not obj.module:
+            raise ValueError(f"Not a module object file: {path}")
+        return Module(obj.words.tolist(), dict(obj.labels), list(obj.relocations),
+                      obj.line_map.tolist())
+
+
+def build(src_path, obj_path=None):
+    """
+    The `Module` for the source file at `src_path`, assembled into an object
+    file (by default next to it, with suffix `.o`) only if that file is
+    missing or older than the source.
+    """
+    if obj_path is None:
+        obj_path = os.path.splitext(src_path)[0] + SUFFIX
+    if (os.path.exists(obj_path)
+            and os.path.getmtime(obj_path) >= os.path.getmtime(src_path)):
+        return load_module(obj_path)
+    with open(src_path) as fh:
+        module = assemble_module(fh)
+    save_module(obj_path, module)
+    return module
+
+
+def link(modules):
+    """
+    Lay out `modules` in order and resolve references between them. Returns
+    `(words, symbols)`, where `symbols` maps each exported label to its
+    address. Raises `ValueError` for a symbol exported twice, a symbol no
+    module exports, or a reference too far away for its 8-bit offset.
+    """
+    words = []
+    symbols = {}
+    bases = []
+    for module in modules:
+        base = len(words)
+        bases.append(base)
+        for name, offset in module.exports.items():
+            if name in symbols:
+                raise ValueError(f"Symbol {name} exported more than once")
+            symbols[name] = base + offset
+        words += module.words
+    if len(words) > 0x10000:
+        raise ValueError("Program does not fit in instruction memory")
+
+    for module, base in zip(modules, bases):
+        for offset, name, shift in module.relocations:
+            if name not in symbols:
+                raise ValueError(f"Undefined symbol {name}")
+            pc = base + offset
+            distance = symbols[name] - pc - 1
+            if not -128 <= distance <= 127:
+                raise ValueError(f"{name} is out of range at {pc:#06x}")
+            words[pc] |= (distance & 0xFF) << shift
+    return words, symbols
+
+
+def link_files(paths):
+    """
+    Build (as needed) and link the source files at `paths`.
+    """
+    return link([build(path) for path in paths])
@@ -0,0 +1,114 @@
+"""
+Tests for separate compilation and linking
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import os
+
+import pytest
+
+import objfile
+from assembler import assemble
+from linker import Module, assemble_module, build, link, link_files, load_module, save_module
+
+MAIN = [
+    "LOADI R1, #6",
+    "CALL DOUBLE",
+    "CALL TRIPLE",
+    "LOOP:",
+    "B LOOP  ; local",
+    "HALT",
+]
+DOUBLE = [
+    ".global DOUBLE",
+    "DOUBLE:",
+    "ADD R1, R1, R1",
+    "B DONE",
+    "DONE:",
+    "RET",
+]
+TRIPLE = [
+    ".global TRIPLE, THRICE",
+    "THRICE:",
+    "TRIPLE:",
+    "ADD R2, R1, R1",
+    "CALL DOUBLE  ; from the other module",
+    "ADD R1, R1, R2",
+    "DONE:  ; not the other module's DONE",
+    "RET",
+]
+
+
+def flat(*sources):
+    """The same program as one source file, for comparison."""
+    lines = []
+    for n, src in enumerate(sources):
+        lines += [line.replace("DONE", f"DONE{n}") for line in src
+                  if not line.startswith(".global")]
+    return lines
+
+
+def test_module():
+    module = assemble_module(TRIPLE)
+    assert module.exports == {"TRIPLE": 0, "THRICE": 0}
+    assert module.relocations == [(1, "DOUBLE", 4)]
+    assert module.line_map == [4, 5, 6, 8]
+    assert module.words[1] == 0xD000  # offset left for the linker
+
+
+def test_link_matches_single_file():
+    words, symbols = link([assemble_module(src) for src in (MAIN, DOUBLE, TRIPLE)])
+    assert words == assemble(flat(MAIN, DOUBLE, TRIPLE))
+    assert symbols == {"DOUBLE": 5, "TRIPLE": 8, "THRICE": 8}
+
+
+def test_link_errors():
+    with pytest.raises(ValueError, match="Undefined symbol DOUBLE"):
+        link([assemble_module(MAIN)])
+    with pytest.raises(ValueError, match="more than once"):
+        link([assemble_module(DOUBLE), assemble_module(DOUBLE)])
+    with pytest.raises(ValueError, match="not defined"):
+        assemble_module([".global NOPE", "HALT"])
+    far = Module([0xD000], relocations=[(0, "FAR", 4)])  # CALL FAR
+    with pytest.raises(ValueError, match="out of range"):
+        link([far, Module([0] * 200), Module([0xE000], exports={"FAR": 0})])
+
+
+def test_save_and_load(tmp_path):
+    module = assemble_module(TRIPLE)
+    save_module(tmp_path / "triple.obj", module)
+    assert load_module(tmp_path / "triple.obj") == module
+
+
+def test_only_changed_modules_rebuilt(tmp_path):
+    paths = []
+    for name, src in (("main", MAIN), ("double", DOUBLE), ("triple", TRIPLE)):
+        path = tmp_path / f"{name}.asm"
+        path.write_text("\n".join(src))
+        paths.append(str(path))
+    words, _ = link_files(paths)
+    assert words == assemble(flat(MAIN, DOUBLE, TRIPLE))
+
+    stamps = [os.path.getmtime(tmp_path / f"{name}.o") for name in ("main", "double")]
+    double = ["ADD R1, R1, R1" if line == "B DONE" else line for line in DOUBLE]
+    (tmp_path / "double.asm").write_text("\n".join(double))
+    later = stamps[1] + 10
+    os.utime(tmp_path / "double.asm", (later, later))
+    words, _ = link_files(paths)
+    assert words == assemble(flat(MAIN, double, TRIPLE))
+    assert os.path.getmtime(tmp_path / "main.o") == stamps[0]  # not rebuilt
+    assert build(paths[1]) == assemble_module(double)
+
+
+def test_program_objects_are_not_modules(tmp_path):
+    path = tmp_path / "double.asm"
+    path.write_text("\n".join(DOUBLE[1:]))  # also a whole program, to objfile
+    objfile.build(str(path)).close()
+    with pytest.raises(ValueError):
+        load_module(tmp_path / "double.obj")
+    module = build(str(path))
+    assert module == assemble_module(DOUBLE[1:])
+    assert module.exports == {}  # local labels (DOUBLE, DONE) stay local
+    assert (tmp_path / "double.o").exists()
@@ -11,9 +11,62 @@ First released: 2025-11-10
   - Added `return True` to all write methods and write stubs.
   Revision: 2025-11-12
   - Moved definition of `STACK_BASE` to `constants.py`.
+  Revision: 2026-10-17
+  - `InstructionMemory.generation` counts program loads, so anything caching
+    decoded instructions can tell when its cache is stale.
+  - Added `FlatMemory`, a contiguous array-backed alternative to the sparse
+    dict, with `FlatDataMemory` and `FlatInstructionMemory`.
+  - Added `MappedDataMemory`, data memory backed by an mmap-ed image file.
+  - `hexdump()` walks a sorted index of initialized addresses and collapses
+    empty rows to `*`; `write_hexdump()` streams it to a file.
+  - `InstructionMemory.load_program()` installs the whole program at once,
+    and also takes `bytes`, `bytearray`, `array('H')`, or a `memoryview`.
+  - Added `ProgramImage`, a read-only program (with its predecoded form)
+    that any number of CPUs can share as instruction memory.
+  - Added `InstructionMemory.patch()` to change a few words of a loaded
+    program in place.
+  - Added `snapshot()` and `restore()`, and `PagedMemory`, whose pages are
+    shared copy-on-write with its snapshots, with `PagedDataMemory`.
 """
 
+import mmap
+import sys
+from array import array
+from bisect import bisect_left, insort
+from itertools import compress
+
 from constants import STACK_BASE, WORD_SIZE
+from instruction_set import predecode
+
+# Byte translation table: zero stays zero, anything else becomes one
+_NONZERO = bytes([0]) + bytes([1]) * 255
+
+
+def _as_words(words):
+    """
+    Return `words` as an `array('H')`. Bytes-like objects (and byte
+    memoryviews) hold little-endian 16-bit words; an `array('H')` or `'H'`
+    memoryview is used as is; anything else is a sequence of ints, masked
+    to 16 bits.
+    """
+    if isinstance(words, array) and words.typecode == "H":
+        return words
+    if isinstance(words, memoryview) and words.format == "H":
+        image = array("H")
+        image.frombytes(words.cast("B"))
+        return image
+    if isinstance(words, (bytes, bytearray, memoryview)):
+        if len(words) % 2:
+            raise ValueError("Odd number of bytes in program image")
+        image = array("H")
+        image.frombytes(words)
+        if sys.byteorder != "little":
+            image.byteswap()
+        return image
+    try:
+        return array("H", words)
+    except OverflowError:  # out of range, so mask
+        return array("H", [w & 0xFFFF for w in words])
 
 
 class Memory:
@@ -21,6 +74,7 @@ class Memory:
 
     def __init__(self, default=0):
         self._cells = {}
+        self._index = []  # initialized addresses, ascending
         self.default = default
         self._write_enable = False
 
@@ -56,6 +110,8 @@ class Memory:
         # `True` on success. Replace `pass` below.
         if (self._write_enable):
             self._check_addr(addr)
+            if addr not in self._cells:
+                insort(self._index, addr)  # sorted, for `hexdump()`
             self._cells[addr] = value & 0xFFFF
             self._write_enable = False
             return True
@@ -64,27 +120,90 @@ class Memory:
 
 
 
-    def hexdump(self, start=0, stop=None, width=8):
+    def _install(self, start, words):
+        """
+        Store `words` (an `array('H')`) at `start` onward in one operation.
+        No checks: callers validate the range.
+        """
+        stop = start + len(words)
+        self._cells.update(zip(range(start, stop), words))
+        if not self._index or self._index[-1] < start:
+            self._index.extend(range(start, stop))
+        else:
+            self._index = sorted(set(self._index).union(range(start, stop)))
+
+    def hexdump(self, start=0, stop=None, width=8, squeeze=True):
         """
         Yield formatted lines showing memory cells in ascending order
         from `start` to the highest initialized address (or `stop` if provided).
         Uninitialized cells display as 0000.
+
+        With `squeeze` (the default), each run of rows without any
+        initialized cells is shown as a single `*` line, as `xxd` and `od`
+        do, and only rows actually shown cost anything.
         """
-        if not self._cells:
+        highest = self._highest()
+        if highest is None:
             return  # nothing to show
-
-        highest = max(self._cells)
         end = highest + 1 if stop is None else min(stop, highest + 1)
 
-        for base in range(start, end, width):
-            row = []
-            for offset in range(width):
-                addr = base + offset
-                if addr >= end:
-                    break
-                val = self._cells.get(addr, 0)
-                row.append(f"{val:04X}")
-            yield f"{base:04X}: {' '.join(row)}"
+        base = start
+        while base < end:
+            if squeeze:
+                nxt = self._next_initialized(base)
+                row = end if nxt is None else start + (nxt - start) // width * width
+                if row > base:
+                    yield "*"
+                    base = row
+                    if base >= end:
+                        break
+            vals = [self._peek(addr) for addr in range(base, min(base + width, end))]
+            yield f"{base:04X}: {' '.join(f'{val:04X}' for val in vals)}"
+            base += width
+
+    def write_hexdump(self, fh, start=0, stop=None, width=8, squeeze=True):
+        """
+        Stream `hexdump()` lines to file object `fh`. Returns lines written.
+        """
+        n = 0
+        for n, line in enumerate(self.hexdump(start, stop, width, squeeze), 1):
+            fh.write(line + "\n")
+        return n
+
+    def _highest(self):
+        """
+        Highest initialized address, or `None`.
+        """
+        return self._index[-1] if self._index else None
+
+    def _next_initialized(self, addr):
+        """
+        Lowest initialized address at or after `addr`, or `None`.
+        """
+        i = bisect_left(self._index, addr)
+        return self._index[i] if i < len(self._index) else None
+
+    def _peek(self, addr):
+        """
+        Value of an initialized cell, or 0.
+        """
+        return self._cells.get(addr, 0)
+
+    def snapshot(self):
+        """
+        Contents of memory, to give to `restore()` later. This copies every
+        initialized cell; see `PagedMemory` for a cheaper alternative.
+        """
+        return dict(self._cells), list(self._index)
+
+    def restore(self, snap):
+        """
+        Put back the contents saved by `snapshot()` (which can be restored
+        again later).
+        """
+        cells, index = snap
+        self._cells = dict(cells)
+        self._index = list(index)
 
     def __len__(self):
         return len(self._cells)
@@ -93,6 +212,257 @@ class Memory:
         return addr in self._cells
 
 
+class FlatMemory(Memory):
+    """
+    Word-addressable memory backed by one contiguous `array('H')` covering
+    the whole 16-bit address space (128 KiB). Same semantics as `Memory`.
+    Which cells have been written is tracked in a map of one byte per cell
+    (a bit per cell makes every write noticeably slower), so `len()`, `in`,
+    and `hexdump()` still only see initialized cells.
+    """
+
+    SIZE = 0x10000  # words
+
+    def __init__(self, default=0):
+        # No `Memory.__init__`: there is no dict of cells.
+        self.default = default
+        self._write_enable = False
+        self._words = array("H", [default]) * self.SIZE
+        self._written = bytearray(self.SIZE)  # 1 if cell written
+
+    @property
+    def _cells(self):
+        """
+        Initialized cells as a dict (a snapshot, for inspection).
+        """
+        words = self._words
+        addrs = compress(range(self.SIZE), self._initialized())
+        return {addr: words[addr] for addr in addrs}
+
+    def _initialized(self):
+        """
+        Map of initialized cells, one byte per cell.
+        """
+        return self._written
+
+    def read(self, addr):
+        """
+        Return 16-bit word from memory (default if never written).
+        """
+        if 0 <= addr <= 0xFFFF:
+            return self._words[addr]
+        raise ValueError
+
+    def write(self, addr, value):
+        """
+        Write 16-bit word to memory, masking to 16 bits.
+        """
+        if not self._write_enable:
+            raise RuntimeError("Write not enabled.")
+        if not 0 <= addr <= 0xFFFF:
+            raise ValueError
+        self._words[addr] = value & 0xFFFF
+        self._written[addr] = 1
+        self._write_enable = False
+        return True
+
+    def read_block(self, start, stop):
+        """
+        Read-only view of the words from `start` up to (not including)
+        `stop`.
+        """
+        if not 0 <= start <= stop <= self.SIZE:
+            raise ValueError
+        return memoryview(self._words)[start:stop].toreadonly()
+
+    def write_block(self, start, words):
+        """
+        Write consecutive words (any sequence of ints, an `array('H')`, or a
+        memoryview of one) starting at `start`, as a single write: it needs
+        `write_enable(True)` once, beforehand. Returns a read-only view of
+        the words written.
+        """
+        if not self._write_enable:
+            raise RuntimeError("Write not enabled.")
+        words = _as_words(words)
+        stop = start + len(words)
+        if not 0 <= start <= stop <= self.SIZE:
+            raise ValueError
+        self._install(start, words)
+        self._write_enable = False
+        return self.read_block(start, stop)
+
+    def _install(self, start, words):
+        stop = start + len(words)
+        self._words[start:stop] = words
+        self._written[start:stop] = b"\x01" * (stop - start)
+
+    def _highest(self):
+        highest = self._initialized().rfind(1)
+        return None if highest < 0 else highest
+
+    def _next_initialized(self, addr):
+        nxt = self._initialized().find(1, addr)
+        return None if nxt < 0 else nxt
+
+    def _peek(self, addr):
+        return self._words[addr] if self._initialized()[addr] else 0
+
+    def snapshot(self):
+        return array("H", self._words), bytes(self._initialized())
+
+    def restore(self, snap):
+        words, written = snap
+        self._words[:] = words
+        self._initialized()[:] = written
+
+    def __len__(self):
+        return self._initialized().count(1)
+
+    def __contains__(self, addr):
+        if not isinstance(addr, int) or not 0 <= addr <= 0xFFFF:
+            return False
+        return bool(self._initialized()[addr])
+
+
+class PagedMemory(Memory):
+    """
+    Word-addressable memory kept in pages of `PAGE` words, each an
+    `array('H')` plus a map of which of its cells have been written. Pages
+    are only allocated when first written. Same semantics as `Memory`.
+
+    Pages are shared with snapshots, copy-on-write: `snapshot()` takes the
+    list of pages as it stands and marks every page shared, so it costs the
+    same however much memory is in use. The first write to a shared page
+    copies it. `restore()` puts back only the pages that differ from the
+    snapshot, i.e., those written since.
+    """
+
+    PAGE = 256  # words
+    SIZE = 0x10000  # words
+
+    def __init__(self, default=0):
+        # No `Memory.__init__`: there is no dict of cells.
+        self.default = default
+        self._write_enable = False
+        self._pages = [None] * (self.SIZE // self.PAGE)  # (words, written)
+        self._owned = bytearray(len(self._pages))  # 1 if not shared
+
+    @property
+    def _cells(self):
+        """
+        Initialized cells as a dict (a snapshot, for inspection).
+        """
+        cells = {}
+        for base, page in self._used_pages():
+            words, written = page
+            for offset in compress(range(self.PAGE), written):
+                cells[base + offset] = words[offset]
+        return cells
+
+    def _used_pages(self):
+        """
+        `(first address, page)` for every page allocated, in order.
+        """
+        return [(i * self.PAGE, page) for i, page in enumerate(self._pages) if page]
+
+    def _own(self, i):
+        """
+        Page `i`, allocated or copied so it can be written in place.
+        """
+        page = self._pages[i]
+        if page is None:
+            page = (array("H", [self.default]) * self.PAGE, bytearray(self.PAGE))
+        else:
+            page = (array("H", page[0]), bytearray(page[1]))
+        self._pages[i] = page
+        self._owned[i] = 1
+        return page
+
+    def read(self, addr):
+        """
+        Return 16-bit word from memory (default if never written).
+        """
+        if 0 <= addr <= 0xFFFF:
+            page = self._pages[addr // self.PAGE]
+            return self.default if page is None else page[0][addr % self.PAGE]
+        raise ValueError
+
+    def write(self, addr, value):
+        """
+        Write 16-bit word to memory, masking to 16 bits.
+        """
+        if not self._write_enable:
+            raise RuntimeError("Write not enabled.")
+        if not 0 <= addr <= 0xFFFF:
+            raise ValueError
+        i, offset = divmod(addr, self.PAGE)
+        words, written = self._pages[i] if self._owned[i] else self._own(i)
+        words[offset] = value & 0xFFFF
+        written[offset] = 1
+        self._write_enable = False
+        return True
+
+    def _install(self, start, words):
+        addr = start
+        stop = start + len(words)
+        while addr < stop:
+            i, offset = divmod(addr, self.PAGE)
+            n = min(self.PAGE - offset, stop - addr)
+            page_words, written = self._pages[i] if self._owned[i] else self._own(i)
+            page_words[offset:offset + n] = words[addr - start:addr - start + n]
+            written[offset:offset + n] = b"\x01" * n
+            addr += n
+
+    def snapshot(self):
+        """
+        Contents of memory, to give to `restore()` later. Shares every page.
+        """
+        self._owned = bytearray(len(self._pages))
+        return tuple(self._pages)
+
+    def restore(self, snap):
+        """
+        Put back the contents saved by `snapshot()`, page by page, skipping
+        pages not written since. The snapshot can be restored again later.
+        """
+        pages = self._pages
+        for i, page in enumerate(snap):
+            if pages[i] is not page:
+                pages[i] = page
+        self._owned = bytearray(len(pages))
+
+    def _highest(self):
+        for base, (_, written) in reversed(self._used_pages()):
+            offset = written.rfind(1)
+            if offset >= 0:
+                return base + offset
+        return None
+
+    def _next_initialized(self, addr):
+        for base, (_, written) in self._used_pages():
+            if base + self.PAGE > addr:
+                offset = written.find(1, max(addr - base, 0))
+                if offset >= 0:
+                    return base + offset
+        return None
+
+    def _peek(self, addr):
+        page = self._pages[addr // self.PAGE]
+        if page is None or not page[1][addr % self.PAGE]:
+            return 0
+        return page[0][addr % self.PAGE]
+
+    def __len__(self):
+        return sum(written.count(1) for _, (_, written) in self._used_pages())
+
+    def __contains__(self, addr):
+        if not isinstance(addr, int) or not 0 <= addr <= 0xFFFF:
+            return False
+        page = self._pages[addr // self.PAGE]
+        return page is not None and bool(page[1][addr % self.PAGE])
+
+
 class DataMemory(Memory):
     """
     Word-addressable memory for data. Reserves a portion for stack use.
@@ -114,6 +484,7 @@ class InstructionMemory(Memory):
     def __init__(self, default=0):
         super().__init__(default)
         self._loading = False  # internal guard flag
+        self.generation = 0  # bumped on every program load
 
     def write(self, addr, value):
         """
@@ -126,22 +497,209 @@ class InstructionMemory(Memory):
 
     def load_program(self, words, start_addr=0x0000):
         """
-        Load list of 16-bit words into consecutive memory cells.
+        Load 16-bit words into consecutive memory cells from `start_addr`.
+        `words` is a list of ints, an `array('H')`, or `bytes`, `bytearray`,
+        or a `memoryview` holding little-endian words. The range is checked
+        first and the words installed in one go, so a failed load changes
+        nothing. Returns the number of words loaded.
         """
+        words = _as_words(words)
+        if not 0 <= start_addr <= start_addr + len(words) <= 0x10000:
+            raise ValueError(f"Program does not fit at {start_addr:#06x}")
         self._loading = True
         self._write_enable = True
         try:
-            for offset, word in enumerate(words):
+            self._install(start_addr, words)
+        finally:
+            self._loading = False
+            self._write_enable = False
+            self.generation += 1
+        return len(words)
+
+    def patch(self, changes):
+        """
+        Change some words of the loaded program in place. `changes` maps
+        address to word, e.g., from `asmsession.AssemblySession.update()`.
+        Addresses are checked first, so a failed patch changes nothing.
+        """
+        for addr in changes:
+            self._check_addr(addr)
+        self._loading = True
+        try:
+            for addr, word in changes.items():
                 self._write_enable = True
-                super().write(start_addr + offset, word)
+                super().write(addr, word)
         finally:
             self._loading = False
             self._write_enable = False
-        # Write each word in `words` to successive addresses in instruction
-        # memory. Set `_write_enable` as needed can call parent write with
-        # `super().write(start_addr + offset, word)` as needed. Important:
-        # Ensure that `_loading` and `_write_enable` are set to `False` when
-        # done. (Hint: use `try`/`finally`.) Replace `pass` below.
+            self.generation += 1
+
+
+class FlatDataMemory(DataMemory, FlatMemory):
+    """
+    `DataMemory` backed by `FlatMemory`.
+    """
+
+
+class FlatInstructionMemory(InstructionMemory, FlatMemory):
+    """
+    `InstructionMemory` backed by `FlatMemory`.
+    """
+
+
+class PagedDataMemory(DataMemory, PagedMemory):
+    """
+    `DataMemory` backed by `PagedMemory`, for cheap snapshots.
+    """
+
+
+class ProgramImage(InstructionMemory):
+    """
+    An assembled program, frozen: read-only instruction memory that any
+    number of CPUs can share instead of each loading its own copy. Build it
+    once, e.g., `ProgramImage(assemble(lines))`, and pass it as `i_mem` (or
+    as `prog` to `make_cpu`). The words are predecoded once, here, and CPUs
+    using the image share `predecoded` as well; since the words never
+    change, neither do its entries. Words with bad zero padding are left
+    out of `predecoded` and listed in `bad`, as `(address, word)`.
+    """
+
+    def __init__(self, words, default=0):
+        # No `InstructionMemory.__init__`: there is no dict of cells.
+        if isinstance(words, memoryview) and words.readonly and words.format == "H":
+            image = words  # e.g., mapped from an object file: no copy
+        else:
+            image = memoryview(_as_words(words).tobytes()).cast("H")
+        if len(image) > FlatMemory.SIZE:
+            raise ValueError("Too many words for instruction memory")
+        self.default = default
+        self._write_enable = False
+        self._loading = False  # never
+        self.generation = 0  # never reloaded
+        self._words = image  # read-only
+        self._size = len(image)
+        self.predecoded = {}  # address -> tuple from `predecode()`
+        self.bad = []
+        for addr, word in enumerate(self._words):
+            entry = predecode(word, addr)
+            if entry is not None:
+                self.predecoded[addr] = entry
+            else:
+                self.bad.append((addr, word))
+
+    @property
+    def _cells(self):
+        """
+        Program words as a dict (a snapshot, for inspection).
+        """
+        return dict(enumerate(self._words))
+
+    def read(self, addr):
+        """
+        Return 16-bit word from memory (default past the end of the program).
+        """
+        if 0 <= addr < self._size:
+            return self._words[addr]
+        if 0 <= addr <= 0xFFFF:
+            return self.default
+        raise ValueError
+
+    def load_program(self, words, start_addr=0x0000):
+        raise RuntimeError("Program images are read-only.")
+
+    def patch(self, changes):
+        raise RuntimeError("Program images are read-only.")
+
+    def _highest(self):
+        return self._size - 1 if self._size else None
+
+    def _next_initialized(self, addr):
+        return addr if addr < self._size else None
+
+    def _peek(self, addr):
+        return self._words[addr] if addr < self._size else 0
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, addr):
+        return isinstance(addr, int) and 0 <= addr < self._size
+
+
+def create_image(path, words=()):
+    """
+    Create a data memory image file at `path`: 64K little-endian 16-bit
+    words, starting with `words` and zero after that.
+    """
+    image = array("H", [w & 0xFFFF for w in words])
+    if len(image) > FlatMemory.SIZE:
+        raise ValueError("Too many words for memory image")
+    image.extend(array("H", bytes(2 * (FlatMemory.SIZE - len(image)))))
+    if sys.byteorder != "little":
+        image.byteswap()
+    with open(path, "wb") as fh:
+        image.tofile(fh)
+
+
+class MappedDataMemory(DataMemory, FlatMemory):
+    """
+    `DataMemory` backed by an `mmap` of an image file (see `create_image`),
+    so a run starts from, and ends up in, the file. Opening an image does
+    not read it. Cells count as initialized if they are nonzero in the image
+    or have been written since.
+
+    With `copy_on_write=True` the file is mapped privately and never
+    changed, so many runs can share one read-only baseline image.
+
+    Call `close()` (or use `with`) when done; views from `read_block()` must
+    be released first.
+    """
+
+    def __init__(self, path, copy_on_write=False):
+        # No `FlatMemory.__init__`: the words are in the file.
+        if sys.byteorder != "little":
+            raise NotImplementedError("Memory images are little-endian")
+        self.default = 0
+        self._write_enable = False
+        mode = "rb" if copy_on_write else "r+b"
+        access = mmap.ACCESS_COPY if copy_on_write else mmap.ACCESS_WRITE
+        with open(path, mode) as fh:
+            self._mmap = mmap.mmap(fh.fileno(), 2 * self.SIZE, access=access)
+        self._words = memoryview(self._mmap).cast("H")
+        self._written = bytearray(self.SIZE)
+        self._scanned = False  # nonzero image cells not yet in `_written`
+
+    def _initialized(self):
+        """
+        Map of initialized cells, adding nonzero cells of the image the
+        first time it is needed.
+        """
+        if not self._scanned:
+            data = self._mmap[:]
+            lo = int.from_bytes(data[0::2], "little")
+            hi = int.from_bytes(data[1::2], "little")
+            nonzero = (lo | hi).to_bytes(self.SIZE, "little").translate(_NONZERO)
+            merged = int.from_bytes(nonzero, "little")
+            merged |= int.from_bytes(self._written, "little")
+            self._written = bytearray(merged.to_bytes(self.SIZE, "little"))
+            self._scanned = True
+        return self._written
+
+    def flush(self):
+        """
+        Make sure writes have reached the file (no-op if copy-on-write).
+        """
+        self._mmap.flush()
+
+    def close(self):
+        self._words.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
 
@@ -5,10 +5,26 @@ CS 2210 Computer Organization
 Clayton Cafiero <cbcafier@uvm.edu>
 """
 
+import io
+import random
+from array import array
+
 import pytest
 
 from constants import STACK_BASE
-from memory import DataMemory, InstructionMemory, Memory
+from memory import (
+    DataMemory,
+    FlatDataMemory,
+    FlatInstructionMemory,
+    FlatMemory,
+    InstructionMemory,
+    MappedDataMemory,
+    Memory,
+    PagedDataMemory,
+    PagedMemory,
+    ProgramImage,
+    create_image,
+)
 
 
 def test_write_out_of_range():
@@ -85,6 +101,43 @@ def test_hexdump_multiple_lines_and_range():
     assert len(lines) == 3  # restricted to width
 
 
+@pytest.mark.parametrize("cls", [Memory, FlatMemory, PagedMemory])
+def test_hexdump_squeezes_empty_rows(cls):
+    """
+    Ensure runs of untouched rows collapse to `*`.
+    """
+    m = cls()
+    for addr in (0x0001, 0xFFFF):
+        m.write_enable(True)
+        m.write(addr, 0xAAAA)
+    assert list(m.hexdump()) == [
+        "0000: 0000 AAAA 0000 0000 0000 0000 0000 0000",
+        "*",
+        "FFF8: 0000 0000 0000 0000 0000 0000 0000 AAAA",
+    ]
+    assert len(list(m.hexdump(squeeze=False))) == 0x2000
+    assert list(m.hexdump(2, 0x20)) == ["*"]
+
+
+@pytest.mark.parametrize("cls", [Memory, FlatMemory, PagedMemory])
+def test_write_hexdump(cls):
+    """
+    Ensure hexdump streams to a file object.
+    """
+    m = cls()
+    for addr in (0x0010, 0x0011, 0x8000):
+        m.write_enable(True)
+        m.write(addr, addr)
+    fh = io.StringIO()
+    assert m.write_hexdump(fh, width=16) == 4
+    assert fh.getvalue() == (
+        "*\n"
+        "0010: 0010 0011 " + "0000 " * 13 + "0000\n"
+        "*\n"
+        "8000: 8000\n"
+    )
+
+
 def test_load_program():
     """
     Ensures instructions properly loaded in instruction memory.
@@ -127,6 +180,68 @@ def test_instruction_memory_load_program_allowed():
         assert im.read(addr) == word
 
 
+@pytest.mark.parametrize("cls", [InstructionMemory, FlatInstructionMemory])
+@pytest.mark.parametrize(
+    "image",
+    [
+        [0x0DFF, 0xC002, 0xE000],
+        array("H", [0x0DFF, 0xC002, 0xE000]),
+        bytes.fromhex("ff0d02c000e0"),
+        bytearray.fromhex("ff0d02c000e0"),
+        memoryview(bytes.fromhex("ff0d02c000e0")),
+        memoryview(array("H", [0x0DFF, 0xC002, 0xE000])),
+    ],
+)
+def test_load_program_bulk(cls, image):
+    """
+    Ensure any program image loads, relocated to `start_addr`.
+    """
+    im = cls()
+    im.load_program([0x1111, 0x2222])
+    assert im.load_program(image, start_addr=0xFFFD) == 3
+    assert [im.read(a) for a in range(0xFFFD, 0x10000)] == [0x0DFF, 0xC002, 0xE000]
+    assert len(im) == 5
+    assert list(im.hexdump(stop=2)) == ["0000: 1111 2222"]
+    assert not im._write_enable  # OK to access in tests
+    with pytest.raises(RuntimeError):
+        im.write(0, 1)
+
+
+@pytest.mark.parametrize("cls", [InstructionMemory, FlatInstructionMemory])
+def test_load_program_checks_range_first(cls):
+    """
+    Ensure a program that does not fit is rejected without loading any of it.
+    """
+    im = cls()
+    with pytest.raises(ValueError):
+        im.load_program([1, 2, 3], start_addr=0xFFFE)
+    with pytest.raises(ValueError):
+        im.load_program(b"\x01\x02\x03")
+    assert len(im) == 0
+    im.load_program([-1, 0x12345])  # masked, as `write()` does
+    assert [im.read(0), im.read(1)] == [0xFFFF, 0x2345]
+
+
+@pytest.mark.parametrize("cls", [InstructionMemory, FlatInstructionMemory])
+def test_patch_program(cls):
+    """
+    Ensure a loaded program can be patched in place, all or nothing.
+    """
+    im = cls()
+    im.load_program([0x0202, 0x0404, 0xF000])
+    generation = im.generation
+    im.patch({1: 0x0606, 3: 0xF000})
+    assert [im.read(a) for a in range(4)] == [0x0202, 0x0606, 0xF000, 0xF000]
+    assert im.generation > generation
+    with pytest.raises(ValueError):
+        im.patch({0: 0, 0x10000: 0})
+    assert im.read(0) == 0x0202
+    with pytest.raises(RuntimeError):
+        im.write(0, 1)
+    with pytest.raises(RuntimeError):
+        ProgramImage([0xF000]).patch({0: 0})
+
+
 def test_data_memory_blocks_nonstack_write():
     """
     Ensure writes at or beyond STACK_BASE raise an error.
@@ -177,3 +292,218 @@ def test_memory_len_and_contains():
     assert len(m) == 1
     assert 0 in m
     assert 1 not in m
+
+
+@pytest.mark.parametrize("cls", [FlatMemory, PagedMemory])
+def test_flat_memory_matches_sparse(cls):
+    """
+    Ensure flat (and paged) memory behaves just like sparse memory.
+    """
+    rng = random.Random(2210)
+    sparse, flat = Memory(), cls()
+    for _ in range(2000):
+        addr = rng.choice([rng.randrange(0x10000), rng.randrange(64), -1, 0x10000])
+        write = rng.random() < 0.5
+        value = rng.randrange(-0x8000, 0x10000)
+        results = []
+        for m in (sparse, flat):
+            try:
+                if write:
+                    m.write_enable(True)
+                    results.append(m.write(addr, value))
+                else:
+                    results.append(m.read(addr))
+            except ValueError:
+                results.append(ValueError)
+            m.write_enable(False)
+        assert results[0] == results[1]
+        assert len(sparse) == len(flat)
+        assert (addr in sparse) == (addr in flat)
+    assert sparse._cells == flat._cells  # OK to access in tests
+    assert list(sparse.hexdump()) == list(flat.hexdump())
+    assert list(sparse.hexdump(0x10, 0x40, 4)) == list(flat.hexdump(0x10, 0x40, 4))
+
+
+def test_flat_memory_write_protocol():
+    """
+    Ensure flat memory needs write enable, which clears after a write.
+    """
+    m = FlatMemory()
+    with pytest.raises(RuntimeError):
+        m.write(0, 1)
+    m.write_enable(True)
+    m.write(0, 0x1ABCD)
+    assert m.read(0) == 0xABCD
+    with pytest.raises(RuntimeError):
+        m.write(0, 1)
+    with pytest.raises(ValueError):
+        m.read(0x10000)
+
+
+def test_flat_memory_blocks():
+    """
+    Ensure bulk writes land, are counted, and reads are views.
+    """
+    m = FlatMemory()
+    with pytest.raises(RuntimeError):
+        m.write_block(0, [1, 2, 3])
+    m.write_enable(True)
+    view = m.write_block(5, array("H", range(1, 21)))
+    assert view.tolist() == list(range(1, 21))
+    assert len(m) == 20
+    assert 4 not in m and 5 in m and 24 in m and 25 not in m
+    block = m.read_block(4, 8)
+    assert block.tolist() == [0, 1, 2, 3]
+    assert block.readonly
+    m.write_enable(True)
+    with pytest.raises(ValueError):
+        m.write_block(0xFFFF, [1, 2])
+
+
+def test_flat_data_and_instruction_memory():
+    """
+    Ensure the stack guard and loader protection still apply.
+    """
+    d = FlatDataMemory()
+    d.write_enable(True)
+    with pytest.raises(RuntimeError):
+        d.write(STACK_BASE, 1)
+    d.write_enable(True)
+    d.write(STACK_BASE, 1, from_stack=True)
+    assert d.read(STACK_BASE) == 1
+
+    i = FlatInstructionMemory()
+    i.load_program([0x0202, 0xF000], start_addr=4)
+    assert [i.read(a) for a in range(4, 6)] == [0x0202, 0xF000]
+    assert len(i) == 2
+    with pytest.raises(RuntimeError):
+        i.write(0, 1)
+
+
+@pytest.mark.parametrize("cls", [DataMemory, FlatDataMemory, PagedDataMemory])
+def test_snapshot_restore(cls):
+    """
+    Ensure restoring a snapshot undoes every write since, and can be
+    repeated.
+    """
+    m = cls()
+    for addr in (0x0000, 0x0123, STACK_BASE + 3):
+        m.write_enable(True)
+        m.write(addr, addr + 1, from_stack=True)
+    before = dict(m._cells)  # OK to access in tests
+    snap = m.snapshot()
+    for _ in range(2):
+        for addr in (0x0000, 0x0124, 0x8000):
+            m.write_enable(True)
+            m.write(addr, 0xBEEF)
+        assert m.read(0x0000) == 0xBEEF
+        m.restore(snap)
+        assert m._cells == before  # OK to access in tests
+        assert m.read(0x8000) == 0
+        assert 0x0124 not in m
+
+
+def test_paged_memory_copy_on_write():
+    """
+    Ensure pages are shared with snapshots until written, and restoring
+    only replaces pages written since.
+    """
+    m = PagedMemory()
+    for addr in range(0, 0x10000, 0x80):
+        m.write_enable(True)
+        m.write(addr, addr)
+    snap = m.snapshot()
+    pages = m._pages  # OK to access in tests
+    assert all(a is b for a, b in zip(pages, snap))  # nothing copied
+    m.write_enable(True)
+    m.write(0x0301, 7)
+    assert pages[3] is not snap[3] and pages[4] is snap[4]
+    assert snap[3][0][1] == 0  # the snapshot's page is unchanged
+    untouched = pages[4]
+    m.restore(snap)
+    assert pages[3] is snap[3] and pages[4] is untouched
+    assert m.read(0x0301) == 0
+    m.write_enable(True)
+    m.write(0x0302, 9)  # shared again after restore, so copied again
+    assert pages[3] is not snap[3] and snap[3][0][2] == 0
+
+
+def test_paged_data_memory():
+    """
+    Ensure the stack guard and loader path work for paged memory.
+    """
+    d = PagedDataMemory()
+    d.write_enable(True)
+    with pytest.raises(RuntimeError):
+        d.write(STACK_BASE, 1)
+    d._install(0x00FE, array("H", [1, 2, 3, 4]))  # OK to access in tests
+    assert [d.read(a) for a in range(0x00FD, 0x0103)] == [0, 1, 2, 3, 4, 0]
+    assert len(d) == 4
+
+
+def test_mapped_memory_persists(tmp_path):
+    """
+    Ensure writes to a mapped image end up in the file.
+    """
+    path = tmp_path / "data.img"
+    create_image(path, [0x1234, 0, 0xABCD])
+    assert path.stat().st_size == 0x20000
+    with MappedDataMemory(path) as m:
+        assert m.read(0) == 0x1234
+        assert len(m) == 2  # nonzero image cells count as initialized
+        assert 0 in m and 1 not in m
+        assert list(m.hexdump()) == ["0000: 1234 0000 ABCD"]
+        m.write_enable(True)
+        m.write(1, 0x5555)
+        m.write_enable(True)
+        m.write(0xFFFF, 0x0042, from_stack=True)
+        assert len(m) == 4
+        m.write_enable(True)
+        with pytest.raises(RuntimeError):
+            m.write(STACK_BASE, 1)
+    with MappedDataMemory(path) as m:
+        assert [m.read(a) for a in range(3)] == [0x1234, 0x5555, 0xABCD]
+        assert m.read(0xFFFF) == 0x0042
+    assert path.read_bytes()[:4] == bytes([0x34, 0x12, 0x55, 0x55])
+
+
+def test_mapped_memory_copy_on_write(tmp_path):
+    """
+    Ensure copy-on-write runs share an image without changing it.
+    """
+    path = tmp_path / "baseline.img"
+    create_image(path, [7])
+    path.chmod(0o444)  # read-only baseline
+    runs = [MappedDataMemory(path, copy_on_write=True) for _ in range(2)]
+    runs[0].write_enable(True)
+    runs[0].write(0, 8)
+    assert runs[0].read(0) == 8
+    assert runs[1].read(0) == 7
+    for m in runs:
+        m.close()
+    with MappedDataMemory(path, copy_on_write=True) as m:
+        assert m.read(0) == 7
+
+
+def test_program_image():
+    """
+    Ensure a program image reads like instruction memory and cannot be
+    changed.
+    """
+    image = ProgramImage(bytes.fromhex("0402fe00"))
+    assert [image.read(0), image.read(1), image.read(0xFFFF)] == [0x0204, 0x00FE, 0]
+    assert len(image) == 2 and 1 in image and 2 not in image
+    assert image._cells == {0: 0x0204, 1: 0x00FE}  # OK to access in tests
+    assert list(image.hexdump()) == ["0000: 0204 00FE"]
+    assert sorted(image.predecoded) == [0, 1]
+    assert image.bad == []
+    assert ProgramImage([0x0202, 0xF001]).bad == [(1, 0xF001)]
+    with pytest.raises(ValueError):
+        image.read(0x10000)
+    with pytest.raises(RuntimeError):
+        image.load_program([0xF000])
+    image.write_enable(True)
+    with pytest.raises(RuntimeError):
+        image.write(0, 0xF000)
+    with pytest.raises(TypeError):
+        image._words[0] = 0xF000  # OK to access in tests
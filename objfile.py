@@ -0,0 +1,177 @@
+"""
+Object files for assembled Catamount programs, so a program can be
+assembled once and then loaded without going through the assembler again.
+
+Layout (all little-endian):
+
+    header      magic b"CATO" (b"CATM" for a linker module, see `linker`),
+                version (u16), number of relocations (u16), number of words
+                (u32), number of symbols (u32)
+    words       one u16 per instruction word, padded to a multiple of 4 bytes
+    line map    one u32 per word: source line it was assembled from (1-based)
+    symbols     per label: address (u16), name length (u8), name (UTF-8)
+    relocations per reference to a symbol defined elsewhere (see `linker`):
+                address (u16), bit the offset goes at (u8), name length
+                (u8), name
+
+Version 1 files are the same, without relocations.
+
+Opening an object file maps it into memory; nothing is read until it is
+used, and the words can be loaded into instruction memory straight from the
+mapping.
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import mmap
+import os
+import struct
+import sys
+from functools import cached_property
+
+from assembler import assemble_with_symbols
+from memory import ProgramImage
+
+MAGIC = b"CATO"
+MODULE_MAGIC = b"CATM"  # symbols are exports only, and words need relocating
+VERSION = 2
+SUFFIX = ".obj"
+HEADER = struct.Struct("<4sHHII")
+SYMBOL = struct.Struct("<HB")
+RELOCATION = struct.Struct("<HBB")
+
+
+def write_object(path, words, labels=None, line_map=None, relocations=(), module=False):
+    """
+    Write an object file holding `words`, plus the label table and line map
+    as returned by `assembler.assemble_with_symbols()`, if available, and
+    any relocations, as `(address, symbol, shift)` tuples. With `module`,
+    it is marked as a linker module rather than a program.
+    """
+    labels = labels or {}
+    if line_map is None:
+        line_map = [0] * len(words)
+    if len(line_map) != len(words):
+        raise ValueError("Line map does not match words")
+    parts = [
+        HEADER.pack(MODULE_MAGIC if module else MAGIC, VERSION, len(relocations),
+                    len(words), len(labels)),
+        struct.pack(f"<{len(words)}H", *(w & 0xFFFF for w in words)),
+        bytes(2 * (len(words) % 2)),  # pad
+        struct.pack(f"<{len(words)}I", *line_map),
+    ]
+    for name, addr in labels.items():
+        encoded = name.encode()
+        parts.append(SYMBOL.pack(addr, len(encoded)) + encoded)
+    for addr, name, shift in relocations:
+        encoded = name.encode()
+        parts.append(RELOCATION.pack(addr, shift, len(encoded)) + encoded)
+    with open(path, "wb") as fh:
+        fh.write(b"".join(parts))
+
+
+def build(src_path, obj_path=None):
+    """
+    Assemble the source file at `src_path` into an object file (by default
+    next to it, with suffix `.obj`) unless that is already up to date, and
+    open it.
+    """
+    if obj_path is None:
+        obj_path = os.path.splitext(src_path)[0] + SUFFIX
+    if (not os.path.exists(obj_path)
+            or os.path.getmtime(obj_path) < os.path.getmtime(src_path)):
+        with open(src_path) as fh:
+            words, labels, line_map = assemble_with_symbols(fh)
+        write_object(obj_path, words, labels, line_map)
+    return ObjectFile(obj_path)
+
+
+class ObjectFile:
+    """
+    An object file, mapped read-only. `words` and `line_map` are views of
+    the mapping; `labels` and `relocations` are read the first time they
+    are used. `module` is true for a linker module.
+
+    Call `close()` (or use `with`) when done; views of the words, including
+    any `ProgramImage` made by `image()`, must be released first.
+    """
+
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise NotImplementedError("Object files are little-endian")
+        with open(path, "rb") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError(f"Not a Catamount object file: {path}")
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, nrelocs, nwords, nsyms = HEADER.unpack_from(self._mmap)
+        if magic not in (MAGIC, MODULE_MAGIC):
+            raise ValueError(f"Not a Catamount object file: {path}")
+        self.module = magic == MODULE_MAGIC
+        if version not in (1, VERSION):
+            raise ValueError(f"Unsupported object file version {version}")
+        self._nrelocs = nrelocs if version > 1 else 0
+        words_at = HEADER.size
+        lines_at = words_at + 2 * (nwords + nwords % 2)
+        self._symbols_at = lines_at + 4 * nwords
+        if size < self._symbols_at:
+            raise ValueError(f"Truncated object file: {path}")
+        self._nsyms = nsyms
+        view = memoryview(self._mmap)
+        self.words = view[words_at:words_at + 2 * nwords].cast("H")
+        self.line_map = view[lines_at:self._symbols_at].cast("I")
+
+    @cached_property
+    def labels(self):
+        """
+        Label table: name -> address.
+        """
+        labels = {}
+        offset = self._symbols_at
+        for _ in range(self._nsyms):
+            addr, length = SYMBOL.unpack_from(self._mmap, offset)
+            offset += SYMBOL.size
+            labels[self._mmap[offset:offset + length].decode()] = addr
+            offset += length
+        self._relocations_at = offset
+        return labels
+
+    @cached_property
+    def relocations(self):
+        """
+        Relocations: `(address, symbol, shift)` tuples.
+        """
+        relocations = []
+        self.labels  # relocations follow the symbols; this finds where
+        offset = self._relocations_at
+        for _ in range(self._nrelocs):
+            addr, shift, length = RELOCATION.unpack_from(self._mmap, offset)
+            offset += RELOCATION.size
+            relocations.append((addr, self._mmap[offset:offset + length].decode(), shift))
+            offset += length
+        return relocations
+
+    def image(self):
+        """
+        A `ProgramImage` that uses the mapped words directly.
+        """
+        return ProgramImage(self.words)
+
+    def load_into(self, i_mem, start_addr=0x0000):
+        """
+        Load the words into instruction memory `i_mem`, in one go. Returns
+        the number of words loaded.
+        """
+        return i_mem.load_program(self.words, start_addr)
+
+    def close(self):
+        self.words.release()
+        self.line_map.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
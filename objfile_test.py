@@ -0,0 +1,112 @@
+"""
+Tests for object files
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import os
+
+import pytest
+
+from assembler import assemble, assemble_with_symbols
+from cpu import make_cpu
+from memory import InstructionMemory
+from objfile import ObjectFile, build, write_object
+
+SOURCE = [
+    "; (3 - 1) * 2",
+    "LOADI R1, #3",
+    "LOADI R2, #1",
+    "",
+    "MIDDLE:",
+    "SUB R1, R1, R2  ; R1 -= 1",
+    "ADD R3, R1, R1",
+    "DONE:",
+    "",
+    "HALT",
+]
+
+
+def test_assemble_with_symbols():
+    words, labels, line_map = assemble_with_symbols(SOURCE)
+    assert words == assemble(SOURCE)
+    assert labels == {"MIDDLE": 2, "DONE": 4}
+    assert line_map == [2, 3, 6, 7, 10]
+
+
+@pytest.mark.parametrize("n", [0, 1, 6, 7])
+def test_round_trip(tmp_path, n):
+    path = tmp_path / "prog.obj"
+    words = list(range(0xFFF0, 0xFFF0 + n))
+    write_object(path, words, {"START": 0, "É": n}, list(range(1, n + 1)))
+    with ObjectFile(path) as obj:
+        assert obj.words.tolist() == words
+        assert obj.line_map.tolist() == list(range(1, n + 1))
+        assert obj.labels == {"START": 0, "É": n}
+
+
+def test_relocations(tmp_path):
+    path = tmp_path / "prog.obj"
+    write_object(path, [0xD000, 0xC000], {"A": 1}, relocations=[(0, "GCD", 4), (1, "X", 4)])
+    with ObjectFile(path) as obj:
+        assert obj.relocations == [(0, "GCD", 4), (1, "X", 4)]
+        assert obj.labels == {"A": 1}
+    data = bytearray(path.read_bytes())
+    data[4:8] = bytes([1, 0, 0, 0])  # as version 1 wrote it: no relocations
+    path.write_bytes(data)
+    with ObjectFile(path) as obj:
+        assert obj.relocations == []
+        assert obj.words.tolist() == [0xD000, 0xC000]
+
+
+def test_load_into_instruction_memory(tmp_path):
+    path = tmp_path / "prog.obj"
+    words, labels, line_map = assemble_with_symbols(SOURCE)
+    write_object(path, words, labels, line_map)
+    with ObjectFile(path) as obj:
+        im = InstructionMemory()
+        assert obj.load_into(im, start_addr=0x10) == len(words)
+        assert [im.read(0x10 + i) for i in range(len(words))] == words
+
+
+def test_image_runs_like_source(tmp_path):
+    path = tmp_path / "prog.obj"
+    write_object(path, assemble(SOURCE))
+    obj = ObjectFile(path)
+    image = obj.image()
+    c = make_cpu(image)
+    ref = make_cpu(assemble(SOURCE))
+    c.run()
+    ref.run()
+    assert c.get_reg(3) == 4
+    assert [c.get_reg(r) for r in range(8)] == [ref.get_reg(r) for r in range(8)]
+    del c, image
+    obj.close()
+
+
+def test_build_only_when_stale(tmp_path):
+    src = tmp_path / "prog.asm"
+    src.write_text("\n".join(SOURCE))
+    with build(str(src)) as obj:
+        assert obj.words.tolist() == assemble(SOURCE)
+    obj_path = tmp_path / "prog.obj"
+    stamp = os.path.getmtime(obj_path)
+    os.utime(src, (stamp - 10, stamp - 10))
+    with build(str(src)):
+        pass
+    assert os.path.getmtime(obj_path) == stamp  # not rebuilt
+
+
+def test_bad_object_files(tmp_path):
+    path = tmp_path / "bad.obj"
+    path.write_bytes(b"")
+    with pytest.raises(ValueError):
+        ObjectFile(path)
+    path.write_bytes(b"NOPE" + bytes(12))
+    with pytest.raises(ValueError):
+        ObjectFile(path)
+    write_object(path, [1, 2, 3])
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(ValueError):
+        ObjectFile(path)
@@ -5,6 +5,11 @@ These do not include special-purpose registers elsewhere in the CPU:
   - program counter,
   - etc.
 
+`RegisterFile.execute()` models the hardware interface, checks and all. The
+CPU and its engines bind the `Register` objects themselves in hot loops.
+`read1()` is an unchecked read by index, for internal callers that have
+already validated the index.
+
 CS 2210 Computer Organization
 Clayton Cafiero <cbcafier@uvm.edu>
 
@@ -150,6 +155,12 @@ class RegisterFile:
 
         return self._read(ra, rb)  # looks like a read
 
+    def read1(self, ra):
+        """
+        Fast path: value of register `ra`. No checks, so `ra` must be 0-7.
+        """
+        return self.registers[ra].value
+
     def __repr__(self):
         # Notice that this expects a member field `registers`, a list.
         vals = [str(r) for r in self.registers]
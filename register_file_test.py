@@ -174,3 +174,13 @@ def test_extraneous_write_args_are_ignored_on_read():
     rf.execute(rd=3, data=77, write_enable=False, ra=1, rb=5)
     assert rf.execute(ra=1) == (77, None)
     assert rf.execute(ra=1, rb=5) == (77, 42)
+
+
+def test_positional_accessor():
+    """
+    The fast-path accessor sees the same registers as `execute()`.
+    """
+    rf = RegisterFile()
+    rf.execute(rd=2, data=0xABCD, write_enable=True)
+    assert rf.read1(2) == 0xABCD
+    assert rf.read1(1) == 0
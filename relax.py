@@ -0,0 +1,225 @@
+"""
+Branch relaxation, so programs can be bigger than a branch can reach.
+
+BEQ, BNE, B, and CALL hold an 8-bit PC-relative offset, so they reach
+targets from 127 words back to 128 words ahead (relative to the branch
+itself). `assemble()` masks any offset to 8 bits, so a branch farther than
+that silently goes to the wrong place. `assemble_relaxed()` finds such
+branches and sends them to their targets in hops instead: via a chain of
+trampolines, each just `B` to the next, kept in islands between the
+program's instructions. Islands may go after any B, RET, or HALT, and
+every `GRID` instructions in between; those need a `B` around them.
+
+Each pass lays the program out with the islands and trampolines so far,
+and re-plans only the jumps that are out of range: to the trampoline for
+the same target that gets closest to it, or else to a new one in the
+island in reach that gets closest (preferring islands already there, or
+every `COARSE_GRID` instructions, if nearly as close). Islands and trampolines are kept from pass to
+pass (a trampoline serves every branch to its target that passes by), so
+this settles in a few passes. Trampolines nothing ends up using are
+dropped at the end, which only brings things closer together.
+
+The ISA has no absolute jump, so a trampoline chain is the only way to go
+farther; a conditional branch or CALL simply goes to the first trampoline
+(CALL still returns to right after itself). A chain only goes to one
+target, so a program needs about one trampoline per 100 words for each
+far target crossing that stretch of code.
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+from bisect import bisect_left, bisect_right
+
+from assembler import _encode_line
+from instruction_set import ISA
+
+GRID = 16  # instructions between places for islands, if no B, RET, or HALT
+COARSE_GRID = 48  # same, for places preferred for new islands
+NEAR = 96  # words farther from the target worth going to avoid a new island
+SLACK = 16  # reach kept in hand when planning, as islands grow
+ISLAND_MAX = 64  # trampolines per island
+MAX_PASSES = 64
+
+_B = ISA["B"]["opcode"] << 12
+_BARRIERS = {ISA[m]["opcode"] for m in ("B", "RET", "HALT")}  # no fall-through
+
+
+def _in_range(target, addr, slack=0):
+    return -128 + slack <= target - addr - 1 <= 127 - slack
+
+
+class _Layout:
+    """
+    Addresses, given the program's instructions and the islands after
+    some of them. `islands[j]` lists the trampolines in the island after
+    instruction `anchors[j]`; `guards[j]` is true if that instruction
+    falls through, so the island needs a `B` around it.
+    """
+
+    def __init__(self, anchors, guards, islands):
+        self.anchors = anchors
+        self.sizes = [len(t) + (1 if g and t else 0) for g, t in zip(guards, islands)]
+        self.before = [0]  # words of islands before island j
+        for size in self.sizes:
+            self.before.append(self.before[-1] + size)
+        self.starts = [a + 1 + b for a, b in zip(anchors, self.before)]
+
+    def addr(self, n):
+        """
+        Address of instruction `n` (or of a label just before it).
+        """
+        return n + self.before[bisect_left(self.anchors, n)]
+
+
+def assemble_relaxed(lines):
+    """
+    Assemble `lines` like `assemble()`, relaxing branches that are out of
+    range. Returns `(words, expanded)`, where `expanded` counts the branch
+    sites that go through trampolines.
+    """
+    program = []  # (word, label, shift) per instruction
+    labels = {}  # label -> instruction number
+    for entry in map(_encode_line, lines):
+        if isinstance(entry, str):
+            if entry in labels:
+                raise ValueError(f"Duplicate label: {entry}")
+            labels[entry] = len(program)
+        elif entry is not None:
+            program.append(entry)
+    sites = [n for n, (_, label, _) in enumerate(program) if label is not None]
+    for n in sites:
+        if program[n][1] not in labels:
+            raise ValueError(f"Unknown label {program[n][1]}")
+
+    anchors, guards, preferred = [], [], []
+    last = last_preferred = -1
+    for n, (word, _, _) in enumerate(program):
+        barrier = (word >> 12) in _BARRIERS
+        if barrier or n - last >= GRID:
+            anchors.append(n)
+            guards.append(not barrier)
+            preferred.append(barrier or n - last_preferred >= COARSE_GRID)
+            if preferred[-1]:
+                last_preferred = n
+            last = n
+    islands = [[] for _ in anchors]  # trampoline numbers, in order
+    tramps = []  # per trampoline: [island index, target label, hop]
+    by_target = {}  # label -> trampolines to it
+    route = {}  # site -> hop, if not straight to its label
+    # A hop is a label (str) or a trampoline number (int).
+
+    def tramp_addr(t, layout):
+        j = tramps[t][0]
+        return layout.starts[j] + (1 if guards[j] else 0) + islands[j].index(t)
+
+    def hop_addr(hop, layout):
+        if isinstance(hop, str):
+            return layout.addr(labels[hop])
+        return tramp_addr(hop, layout)
+
+    def step(src, target, layout):
+        """
+        One hop from address `src` toward `target`: straight there, to the
+        trampoline for it getting closest, or to a new trampoline (with no
+        hop yet). Returns the hop and its address.
+        """
+        dest = layout.addr(labels[target])
+        if _in_range(dest, src):
+            return target, dest
+        lo, hi = min(src, dest), max(src, dest)
+        best = None
+        for t in by_target.get(target, ()):
+            x = tramp_addr(t, layout)
+            if lo < x < hi and _in_range(x, src, SLACK):
+                if best is None or abs(dest - x) < abs(dest - best[1]):
+                    best = (t, x)
+        if best is not None:
+            return best
+
+        # New trampoline, in the island in reach that gets closest (but
+        # rather in one already there or in a preferred place, if nearly
+        # as close, so islands and their guards are fewer)
+        starts = layout.starts
+        if dest > src:
+            js = range(bisect_right(starts, src) - 1, bisect_right(starts, src + 128 - SLACK))
+        else:
+            js = range(bisect_left(starts, src - 127 + SLACK) - 1, bisect_left(starts, src) + 1)
+        choices = []
+        for j in js:
+            if not 0 <= j < len(starts) or len(islands[j]) >= ISLAND_MAX:
+                continue
+            x = starts[j] + (1 if guards[j] else 0) + len(islands[j])
+            if lo < x < hi and _in_range(x, src, SLACK):
+                choices.append((abs(dest - x), preferred[j] or bool(islands[j]), j, x))
+        if not choices:
+            raise ValueError(f"Too many far branches to relax near address {src}")
+        closest = min(choices)[0]
+        cheap = [c for c in choices if c[1] and c[0] < closest + NEAR]
+        _, _, j, x = min(cheap or choices)
+        t = len(tramps)
+        tramps.append([j, target, None])
+        islands[j].append(t)
+        by_target.setdefault(target, []).append(t)
+        return t, x
+
+    def plan(src, target, layout):
+        """
+        First hop from address `src` toward `target`, adding trampolines
+        (each with its own hop) as needed.
+        """
+        first, x = step(src, target, layout)
+        hop = first
+        while isinstance(hop, int) and tramps[hop][2] is None:
+            tramps[hop][2], next_x = step(x, target, layout)
+            hop, x = tramps[hop][2], next_x
+        return first
+
+    for _ in range(MAX_PASSES):
+        layout = _Layout(anchors, guards, islands)
+        settled = True
+        used = set()
+        for n in sites:
+            target = program[n][1]
+            src = layout.addr(n)
+            hop = route.get(n, target)
+            if not _in_range(hop_addr(hop, layout), src):
+                hop = route[n] = plan(src, target, layout)
+                settled = False
+            while isinstance(hop, int) and hop not in used:
+                used.add(hop)
+                t = tramps[hop]
+                src = tramp_addr(hop, layout)
+                if not _in_range(hop_addr(t[2], layout), src):
+                    t[2] = plan(src, t[1], layout)
+                    settled = False
+                hop = t[2]
+        # Drop trampolines nothing uses (any more). That only brings things
+        # closer together, so what's in range stays in range.
+        for island in islands:
+            island[:] = [t for t in island if t in used]
+        for target, ts in by_target.items():
+            ts[:] = [t for t in ts if t in used]
+        if settled:
+            break
+    else:
+        raise ValueError("Branch relaxation did not settle")
+    layout = _Layout(anchors, guards, islands)
+
+    words = []
+    j = 0
+    for n, (word, label, shift) in enumerate(program):
+        if label is not None:
+            word |= ((hop_addr(route.get(n, label), layout) - len(words) - 1) & 0xFF) << shift
+        words.append(word)
+        if j < len(anchors) and anchors[j] == n:
+            if islands[j] and guards[j]:
+                words.append(_B | len(islands[j]) << 4)
+            for t in islands[j]:
+                offset = hop_addr(tramps[t][2], layout) - len(words) - 1
+                words.append(_B | (offset & 0xFF) << 4)
+            j += 1
+    if len(words) > 0x10000:
+        raise ValueError("Program does not fit in instruction memory")
+    expanded = sum(1 for n in sites if isinstance(route.get(n), int))
+    return words, expanded
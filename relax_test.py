@@ -0,0 +1,182 @@
+"""
+Tests for branch relaxation
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import random
+
+import pytest
+
+from assembler import _encode_line, assemble
+from relax import assemble_relaxed
+
+CONTROL = {0xA: "BEQ", 0xB: "BNE", 0xC: "B", 0xD: "CALL", 0xE: "RET", 0xF: "HALT"}
+
+
+def offset(imm):
+    return (imm & 0x7F) - (imm & 0x80)
+
+
+def trace(step, steps):
+    """
+    Abstract run: the non-control words executed, in order. BEQ is taken
+    if its register field is odd, BNE if even. `step(pc)` gives the kind
+    of instruction at `pc`, the word, and the branch target.
+    """
+    out, stack, pc = [], [], 0
+    for _ in range(steps):
+        kind, word, target = step(pc)
+        if kind is None:
+            out.append(word)
+            pc += 1
+        elif kind == "HALT":
+            break
+        elif kind == "RET":
+            if not stack:
+                break
+            pc = stack.pop()
+        elif kind == "CALL":
+            stack.append(pc + 1)
+            pc = target
+        elif kind == "B" or (kind == "BEQ") == bool((word >> 9) & 1):
+            pc = target
+        else:
+            pc += 1
+    return out
+
+
+def ideal(src):
+    """
+    Step function for `src` with branches that reach anywhere.
+    """
+    entries = [e for e in map(_encode_line, src) if e is not None]
+    labels, program = {}, []
+    for e in entries:
+        if isinstance(e, str):
+            labels[e] = len(program)
+        else:
+            program.append(e)
+
+    def step(pc):
+        word, label, _ = program[pc]
+        return CONTROL.get(word >> 12), word, labels.get(label)
+
+    return step
+
+
+def decoded(words):
+    def step(pc):
+        word = words[pc]
+        kind = CONTROL.get(word >> 12)
+        imm = (word >> 1) & 0xFF if kind in ("BEQ", "BNE") else (word >> 4) & 0xFF
+        return kind, word, pc + 1 + offset(imm)
+
+    return step
+
+
+def far_program(rng, n, gaps):
+    """
+    `n` blocks of filler, each with a label and a branch or CALL to a
+    random block, some of them far away.
+    """
+    src = []
+    for b in range(n):
+        src.append(f"BLOCK{b}:")
+        src += [f"ADDI R1, R1, #{rng.randrange(32)}"] * rng.choice(gaps)
+        target = f"BLOCK{rng.randrange(n)}"
+        src.append(rng.choice([
+            f"BEQ R{rng.randrange(8)}, {target}",
+            f"BNE R{rng.randrange(8)}, {target}",
+            f"B {target}",
+            f"CALL SUB{rng.randrange(3)}",
+            "HALT",
+        ]))
+    for s in range(3):
+        src += [f"SUB{s}:", f"LOADI R2, #{s}", "RET"]
+    return src
+
+
+def dense_program(rng, n):
+    """
+    `n` instructions, one in ten a branch or CALL: most to a label close
+    by, some to one anywhere in the program, so far branches interleave.
+    """
+    src = []
+    for i in range(n):
+        if i % 10 == 0:
+            src.append(f"L{i // 10}:")
+        if rng.random() < 0.1:
+            if rng.random() < 0.1:
+                target = f"L{rng.randrange(n // 10)}"
+            else:
+                target = f"L{min(n // 10 - 1, max(0, i // 10 + rng.randrange(-12, 13)))}"
+            src.append(rng.choice([
+                f"BEQ R{rng.randrange(8)}, {target}",
+                f"BNE R{rng.randrange(8)}, {target}",
+                f"B {target}",
+                f"CALL {target}",
+            ]))
+        else:
+            src.append(f"ADDI R1, R1, #{rng.randrange(32)}")
+    src.append("HALT")
+    return src
+
+
+def test_near_program_unchanged():
+    src = ["L:", "ADD R1, R1, R1", "BNE R1, L", "CALL F", "HALT", "F:", "RET"]
+    assert assemble_relaxed(src) == (assemble(src), 0)
+
+
+def test_far_branch_forward_and_back():
+    src = ["START:", "B END"] + ["ADDI R1, R1, #1"] * 1000 + ["END:", "CALL START"]
+    words, expanded = assemble_relaxed(src)
+    assert expanded > 0
+    assert len(words) > len(src) - 2
+    a = trace(ideal(src), 3000)
+    b = trace(decoded(words), 30000)
+    assert b[:len(a)] == a and len(b) >= len(a)
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_relaxed_programs_run_the_same(seed):
+    rng = random.Random(seed)
+    src = far_program(rng, 40, [0, 3, 60, 200])
+    words, expanded = assemble_relaxed(src)
+    a = trace(ideal(src), 20000)
+    b = trace(decoded(words), 200000)
+    assert b[:len(a)] == a
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_many_interleaved_far_branches(seed):
+    rng = random.Random(seed)
+    src = dense_program(rng, 4000)
+    sites = sum(1 for line in src if line.split()[0] in ("BEQ", "BNE", "B", "CALL"))
+    words, expanded = assemble_relaxed(src)
+    assert 0 < expanded <= sites
+    assert len(words) < 4001 * 3 // 2  # trampolines shared, not a chain per branch
+    a = trace(ideal(src), 20000)
+    b = trace(decoded(words), 200000)
+    assert b[:len(a)] == a
+
+
+def test_big_program():
+    src = ["B END"] + ["ADDI R1, R1, #1"] * 60000 + ["END:", "HALT"]
+    words, expanded = assemble_relaxed(src)
+    assert expanded == 1
+    assert len(words) > 60000 + 60000 // 128  # at least a trampoline per hop
+    step = decoded(words)
+    pc = 0
+    for _ in range(1000):  # follow the hops
+        kind, _, target = step(pc)
+        if kind != "B":
+            break
+        pc = target
+    assert words[pc] == assemble(["HALT"])[0]
+
+
+def test_unknown_label():
+    with pytest.raises(ValueError, match="Unknown label"):
+        assemble_relaxed(["B NOWHERE"])
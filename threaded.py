@@ -0,0 +1,349 @@
+"""
+Threaded-code execution engine for the Catamount Processing Unit.
+
+Instead of dispatching on the mnemonic once per instruction (as
+`Cpu._execute` does), we split instruction memory into basic blocks and turn
+each block into a list of handler closures. Register objects, immediates,
+and branch targets are bound into the closures when the block is
+translated, so running a block is just calling its handlers in order and
+then its terminator. We dispatch once per block, not once per instruction.
+
+A basic block starts at any PC we jump to and runs up to and including the
+first BEQ, BNE, B, CALL, RET, or HALT. Only the ALU operations whose flags
+can be observed (see `observed_flags`) update the ALU; the rest just
+compute their result. Anything we can't translate (e.g., a
+word with bad zero padding) ends the block, and the engine lets the
+reference interpreter execute it instead. Results are identical to the
+interpreter: registers, memory, flags, SP, PC, and IR.
+
+Usage:
+
+    c = make_cpu(prog, engine=ThreadedEngine)
+    c.run()
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+from alu import RESULTS, LazyAlu
+from cpu import STOP_BREAKPOINT, STOP_BUDGET, STOP_HALT, Cpu
+from instruction_set import predecode
+
+TERMINATORS = ("BEQ", "BNE", "B", "CALL", "RET", "HALT")
+MAX_BLOCK = 256  # longest block we translate; longer runs are split
+
+# Instructions that may raise (memory faults). The machine state must be
+# exact when they execute, so pending flags are materialized first.
+FAULTING = ("LOAD", "STORE", "CALL", "RET")
+ALU_OPS = ("ADDI", "ADD", "SUB", "AND", "OR", "SHFT")
+
+
+class Block:
+    """
+    A translated basic block.
+    """
+
+    def __init__(self, entry, body, words, term):
+        self.entry = entry  # address of first instruction
+        self.body = body  # handler closures, one per non-branch instruction
+        self.words = words  # raw words, for IR (includes terminator)
+        self.term = term  # terminator closure returning next PC, or None
+        self.size = len(words)  # instructions (cycles) in block
+        self.end = entry + self.size  # address after last instruction
+
+
+def split_blocks(words):
+    """
+    Split a program (list of words starting at address 0) into basic blocks.
+    Returns a sorted list of (start, end) address pairs, `end` exclusive.
+    This is for inspecting a program; the engine itself translates blocks
+    lazily, by entry PC.
+    """
+    leaders = {0}
+    for pc, word in enumerate(words):
+        entry = predecode(word & 0xFFFF, pc)
+        if entry is None:  # untranslatable, so a block of its own
+            leaders.update((pc, pc + 1))
+        elif entry[0] in TERMINATORS:
+            leaders.add(pc + 1)
+            if entry[6] is not None:
+                leaders.add(entry[6])
+    starts = sorted(a for a in leaders if 0 <= a < len(words))
+    ends = starts[1:] + [len(words)]
+    return list(zip(starts, ends))
+
+
+def observed_flags(entries):
+    """
+    Indices of the ALU operations in predecoded `entries` (a basic block)
+    whose flags can be observed: the last one in the block, and any followed
+    by a faulting instruction before the next ALU operation.
+    """
+    observed = set()
+    pending = None
+    for i, entry in enumerate(entries):
+        if entry[0] in ALU_OPS:
+            pending = i
+        elif entry[0] in FAULTING and pending is not None:
+            observed.add(pending)
+            pending = None
+    if pending is not None:
+        observed.add(pending)
+    return observed
+
+
+def _body_handler(cpu, entry, observed):
+    """
+    Build the closure for one non-branch instruction. An ALU operation only
+    updates the ALU's flags and operation if they are `observed`; with a
+    `LazyAlu`, even then only the operation and operands are recorded.
+    """
+    mnem, rd, ra, rb, imm, addr, _, _ = entry
+    regs = cpu._regs.registers
+    alu = cpu._alu
+    d_mem = cpu._d_mem
+    op = "ADD" if mnem == "ADDI" else mnem
+    kernel = cpu._kernels.get(op)
+    result = RESULTS.get(op)
+    lazy = observed and isinstance(alu, LazyAlu)
+
+    match mnem:
+        case "LOADI":
+            dst = regs[rd]
+
+            def handler():
+                dst.value = imm
+
+        case "LUI":
+            dst = regs[rd]
+            upper = (imm & 0xFF) << 8
+
+            def handler():
+                dst.value = upper | (dst.value & 0x00FF)
+
+        case "LOAD":
+            dst, base = regs[rd], regs[ra]
+            offset = Cpu.sext(addr)
+            read = d_mem.read
+
+            def handler():
+                dst.value = read(base.value + offset)
+
+        case "STORE":
+            src, base = regs[ra], regs[rb]
+            offset = imm
+            write_enable = d_mem.write_enable
+            write = d_mem.write
+
+            def handler():
+                write_enable(True)
+                write(base.value + offset, src.value)
+
+        case "ADDI" if not observed:
+            dst, src = regs[rd], regs[ra]
+
+            def handler():
+                dst.value = ((src.value + imm + 0x8000) & 0xFFFF) - 0x8000
+
+        case "ADDI" if lazy:
+            dst, src = regs[rd], regs[ra]
+
+            def handler():
+                a = src.value
+                dst.value = alu._result = ((a + imm + 0x8000) & 0xFFFF) - 0x8000
+                alu._pending = ("ADD", a, imm)
+                alu._op = "ADD"
+
+        case "ADDI":
+            dst, src = regs[rd], regs[ra]
+
+            def handler():
+                dst.value, alu._flags = kernel(src.value, imm)
+                alu._op = "ADD"
+
+        case "ADD" | "SUB" | "AND" | "OR" | "SHFT" if not observed:
+            dst, src_a, src_b = regs[rd], regs[ra], regs[rb]
+
+            def handler():
+                r = result(src_a.value & 0xFFFF, src_b.value & 0xFFFF)
+                dst.value = (r ^ 0x8000) - 0x8000
+
+        case "ADD" | "SUB" | "AND" | "OR" | "SHFT" if lazy:
+            dst, src_a, src_b = regs[rd], regs[ra], regs[rb]
+
+            def handler():
+                a, b = src_a.value, src_b.value
+                r = result(a & 0xFFFF, b & 0xFFFF)
+                dst.value = alu._result = (r ^ 0x8000) - 0x8000
+                alu._pending = (mnem, a, b)
+                alu._op = mnem
+
+        case "ADD" | "SUB" | "AND" | "OR" | "SHFT":
+            dst, src_a, src_b = regs[rd], regs[ra], regs[rb]
+
+            def handler():
+                dst.value, alu._flags = kernel(src_a.value, src_b.value)
+                alu._op = mnem
+
+        case _:
+            raise ValueError(f"Not a block body instruction: {mnem}")
+    return handler
+
+
+def _terminator(cpu, entry, nxt):
+    """
+    Build the closure for the branch ending a block. It returns the next PC.
+    """
+    mnem, *_, target, _ = entry
+    alu = cpu._alu
+    d_mem = cpu._d_mem
+
+    match mnem:
+        case "BEQ":
+
+            def term():
+                return target if alu.zero else nxt
+
+        case "BNE":
+
+            def term():
+                return nxt if alu.zero else target
+
+        case "B":
+
+            def term():
+                return target
+
+        case "CALL":
+
+            def term():
+                cpu._sp -= 1  # grow stack downward
+                d_mem.write_enable(True)
+                d_mem.write(cpu._sp, nxt, from_stack=True)  # return address
+                return target
+
+        case "RET":
+
+            def term():
+                ret_addr = d_mem.read(cpu._sp)
+                cpu._sp += 1  # shrink stack upward
+                return ret_addr
+
+        case "HALT":
+
+            def term():
+                cpu._halt = True
+                return nxt
+
+        case _:
+            raise ValueError(f"Not a block terminator: {mnem}")
+    return term
+
+
+class ThreadedEngine:
+    """
+    Runs a `Cpu` one basic block at a time. Pass the class as `engine` to
+    `Cpu` or `make_cpu`; it is instantiated once per CPU, and its block
+    cache is dropped whenever the program is reloaded.
+    """
+
+    def __init__(self, cpu):
+        self._cpu = cpu
+        self._blocks = {}  # entry PC -> Block
+        self._program_gen = None
+
+    def translate(self, pc):
+        """
+        Translate the block starting at `pc`, or return `None` if the
+        instruction at `pc` can't be translated.
+        """
+        cpu = self._cpu
+        entries = []
+        addr = pc
+        while addr - pc < MAX_BLOCK:
+            try:
+                entry = cpu._predecoded.get(addr) or cpu._predecode_at(addr)
+            except ValueError:  # ran off the end of instruction memory
+                entry = None
+            if entry is None:
+                break
+            entries.append(entry)
+            addr += 1
+            if entry[0] in TERMINATORS:
+                break
+        if not entries:
+            return None
+        observed = observed_flags(entries)
+        words = [entry[-1] for entry in entries]
+        term = None
+        if entries[-1][0] in TERMINATORS:
+            term = _terminator(cpu, entries.pop(), addr)
+        body = [
+            _body_handler(cpu, entry, i in observed)
+            for i, entry in enumerate(entries)
+        ]
+        block = Block(pc, body, words, term)
+        self._blocks[pc] = block
+        return block
+
+    def execute(self, max_cycles, until_pc):
+        """
+        Same contract as `Cpu._execute`: returns (cycles, reason).
+        """
+        cpu = self._cpu
+        if cpu._halt:
+            return 0, STOP_HALT
+        if self._program_gen != cpu._i_mem.generation:
+            if cpu._program_gen != cpu._i_mem.generation:
+                cpu._invalidate_program()
+            self._blocks = {}
+            self._program_gen = cpu._i_mem.generation
+        blocks = self._blocks
+        translate = self.translate
+        interpret = cpu._execute
+        pc = cpu._pc
+        cycles = 0
+        while cycles != max_cycles:
+            block = blocks.get(pc) or translate(pc)
+            if (
+                block is None
+                or (max_cycles is not None and cycles + block.size > max_cycles)
+                or (until_pc is not None and pc < until_pc < block.end)
+            ):
+                # Untranslatable, or we need to stop partway through the
+                # block. Let the interpreter take a single step.
+                cpu._pc = pc
+                n, reason = interpret(1, until_pc)
+                cycles += n
+                if reason != STOP_BUDGET:
+                    return cycles, reason
+                pc = cpu._pc
+                continue
+
+            i = 0
+            try:
+                for handler in block.body:
+                    handler()
+                    i += 1
+                pc = block.term() if block.term else block.end
+            except Exception:
+                # Leave the CPU as the interpreter would have on the
+                # faulting instruction.
+                cpu._pc = block.entry + i + 1
+                cpu._ir = block.words[i]
+                cpu._decoded = None
+                raise
+            cpu._ir = block.words[-1]
+            cycles += block.size
+            if cpu._halt:
+                reason = STOP_HALT
+                break
+            if pc == until_pc:
+                reason = STOP_BREAKPOINT
+                break
+        else:
+            reason = STOP_BUDGET
+
+        cpu._pc = pc
+        cpu._decoded = None
+        return cycles, reason
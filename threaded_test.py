@@ -0,0 +1,170 @@
+"""
+Tests for the threaded-code execution engine. The reference interpreter
+(`Cpu._execute`) is the oracle: both must leave the machine in exactly the
+same state.
+
+CS 2210 Computer Organization
+Clayton Cafiero <cbcafier@uvm.edu>
+"""
+
+import random
+
+import pytest
+
+from assembler import assemble
+from cpu import STOP_BREAKPOINT, STOP_BUDGET, STOP_HALT, make_cpu
+from instruction_set import DecodeError
+from threaded import ThreadedEngine, split_blocks
+
+# Little Gauss, summing 1..100. Hand-encoded BNE (offset -4) since the
+# assembler wants a register operand for BNE.
+GAUSS = assemble(
+    [
+        "LOADI R0, #1",
+        "LOADI R1, #1",
+        "LOADI R2, #0",
+        "LOADI R3, #100",
+        "ADD R2, R2, R1",
+        "ADD R1, R1, R0",
+        "SUB R4, R1, R3",
+        "HALT",  # placeholder for BNE LOOP
+        "ADD R2, R2, R1",
+        "HALT",
+    ]
+)
+GAUSS[7] = 0xB0FC
+
+
+def state(c):
+    """
+    Everything observable about a CPU.
+    """
+    return (
+        c.pc,
+        c.sp,
+        c.ir,
+        c.running,
+        [c.get_reg(r) for r in range(8)],
+        c._alu._flags,  # OK to access in tests
+        dict(c._d_mem._cells),  # OK to access in tests
+    )
+
+
+def random_program(rng, length):
+    """
+    Random, well-formed program: ALU ops, loads and stores (some of which
+    fault), conditional and unconditional branches, calls, and returns.
+    """
+    words = []
+    for _ in range(length):
+        op = rng.choice(
+            [0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7, 0x8, 0x9]
+            + [0xA, 0xB, 0xC, 0xD, 0xE, 0xF] * 2
+        )
+        if op in (0x0, 0x1):
+            word = (op << 12) | (rng.randrange(8) << 9) | (rng.randrange(256) << 1)
+        elif op in (0x2, 0x3, 0x4):
+            word = (op << 12) | rng.randrange(1 << 12)
+        elif op <= 0x9:
+            word = (op << 12) | (rng.randrange(1 << 9) << 3)
+        elif op == 0xD:
+            word = (op << 12) | ((rng.randrange(-8, 8) & 0xFF) << 4)
+        elif op in (0xA, 0xB, 0xC):
+            word = (op << 12) | (rng.randrange(-8, 8) & 0xFF)
+        else:
+            word = op << 12
+        words.append(word)
+    return words
+
+
+def run_both(prog, **kwargs):
+    """
+    Run `prog` on the interpreter and the threaded engine; return results.
+    """
+    results = []
+    for engine in (None, ThreadedEngine):
+        c = make_cpu(prog, engine=engine)
+        try:
+            outcome = c.run(**kwargs)
+            outcome = (outcome.cycles, outcome.reason)
+        except (ValueError, RuntimeError) as e:
+            outcome = type(e)
+        results.append((outcome, state(c)))
+    return results
+
+
+def test_gauss_matches_interpreter():
+    ref, threaded = run_both(GAUSS)
+    assert ref == threaded
+    assert threaded[0] == (402, STOP_HALT)
+    assert threaded[1][4][2] == 5050
+
+
+@pytest.mark.parametrize("budget", [0, 1, 5, 6, 7, 100, 401])
+def test_budget_stops_mid_block(budget):
+    ref, threaded = run_both(GAUSS, max_cycles=budget)
+    assert ref == threaded
+    assert threaded[0] == (budget, STOP_BUDGET)
+
+
+@pytest.mark.parametrize("until_pc", [2, 5, 7, 8, 9])
+def test_breakpoint_inside_block(until_pc):
+    ref, threaded = run_both(GAUSS, until_pc=until_pc)
+    assert ref == threaded
+    assert threaded[0][1] == STOP_BREAKPOINT
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_random_programs_match_interpreter(seed):
+    rng = random.Random(seed)
+    prog = random_program(rng, rng.randrange(4, 40))
+    ref, threaded = run_both(prog, max_cycles=500)
+    assert ref == threaded
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_random_programs_lazy_flags_match_ticks(seed):
+    """
+    Flags are only computed where they can be observed. Ticking computes
+    them after every instruction, so it is the oracle here.
+    """
+    rng = random.Random(seed)
+    prog = random_program(rng, rng.randrange(4, 40))
+    results = []
+    for engine, lazy_flags in ((None, False), (None, True), (ThreadedEngine, True)):
+        c = make_cpu(prog, engine=engine, lazy_flags=lazy_flags)
+        try:
+            if engine is None and not lazy_flags:
+                for _ in range(500):
+                    c.tick()
+            else:
+                c.run(max_cycles=500)
+        except (ValueError, RuntimeError) as e:
+            results.append((type(e), state(c)))
+        else:
+            results.append((None, state(c)))
+    assert results[0] == results[1] == results[2]
+
+
+def test_untranslatable_word_falls_back_to_interpreter():
+    prog = [0x0202, 0x0404, 0xF001]  # last word: HALT, bad zero padding
+    for engine in (None, ThreadedEngine):
+        c = make_cpu(prog, engine=engine, strict=True)
+        with pytest.raises(DecodeError):
+            c.run()
+        assert c.pc == 3
+        assert c.get_reg(2) == 2
+
+
+def test_blocks_retranslated_after_reload():
+    c = make_cpu([0x0202, 0xF000], engine=ThreadedEngine)
+    c.run()
+    c.load_program([0x0204, 0xF000])
+    c._pc = 0  # OK to access in tests
+    c._halt = False  # OK to access in tests
+    c.run()
+    assert c.get_reg(1) == 2
+
+
+def test_split_blocks():
+    assert split_blocks(GAUSS) == [(0, 4), (4, 8), (8, 10)]